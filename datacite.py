@@ -6,8 +6,11 @@ __license__ = 'GPLv3, see LICENSE'
 
 import random
 import string
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from util import *
 
@@ -17,6 +20,104 @@ __all__ = ['rule_generate_random_id',
            'rule_check_doi_availability',
            'rule_delete_doi_metadata']
 
+TIMEOUT = 30
+"""Timeout in seconds of requests to DataCite."""
+
+RETRIES = 3
+"""Number of times an idempotent request to DataCite is retried after a transient error."""
+
+BACKOFF = 0.5
+"""Base delay in seconds between retries, doubled after every attempt."""
+
+BACKOFF_MAX = 10
+"""Maximum delay in seconds between retries."""
+
+RETRY_STATUS = [429, 500, 502, 503, 504]
+"""HTTP status codes that are considered transient."""
+
+# HTTP session shared by all requests to DataCite within this agent.
+# Connections are kept alive and reused between requests.
+_session = None
+_session_lock = threading.Lock()
+
+# Request metrics since the start of this agent, see metrics().
+_metrics = {'requests': 0, 'retries': 0, 'errors': 0, 'seconds': 0.0}
+_metrics_lock = threading.Lock()
+
+
+def session():
+    """Get the HTTP session shared by requests to DataCite.
+
+    :returns: requests.Session with pooled connections
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=16)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+
+    return _session
+
+
+def metrics():
+    """Get DataCite request metrics since the start of this agent.
+
+    :returns: Dict with number of requests, retries, errors and total request time in seconds
+    """
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def request(method, url, idempotent=True, **kwargs):
+    """Send a request to DataCite.
+
+    Idempotent requests that fail with a connection error, a timeout or a
+    transient HTTP status are retried up to RETRIES times, with jittered
+    exponential backoff. This function does not call into the rule engine,
+    so it can be used from worker threads.
+
+    :param method:     HTTP method
+    :param url:        URL to send request to
+    :param idempotent: Whether the request can safely be retried
+    :param kwargs:     Arguments passed on to requests
+
+    :raises requests.exceptions.RequestException: Request failed after all retries
+
+    :returns: requests.Response
+    """
+    kwargs.setdefault('timeout', TIMEOUT)
+    attempts = RETRIES + 1 if idempotent else 1
+    start = time.time()
+
+    for attempt in range(attempts):
+        if attempt > 0:
+            # Full jitter: spread retries of concurrent requests.
+            time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF * 2 ** attempt)))
+
+        try:
+            response = session().request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            response = None
+            if attempt == attempts - 1:
+                _count(start, attempt, error=True)
+                raise
+
+        transient = response is None or response.status_code in RETRY_STATUS
+        if not transient or attempt == attempts - 1:
+            _count(start, attempt, error=transient)
+            return response
+
+
+def _count(start, retries, error):
+    with _metrics_lock:
+        _metrics['requests'] += 1
+        _metrics['retries'] += retries
+        _metrics['errors'] += int(error)
+        _metrics['seconds'] += time.time() - start
+
 
 @rule.make(inputs=[0], outputs=[1])
 def rule_generate_random_id(ctx, length):
@@ -36,11 +137,27 @@ def rule_register_doi_metadata(ctx, doi, payload):
 
 def register_doi_metadata(ctx, doi, payload):
     """Register DOI metadata with DataCite."""
+    return put_doi_metadata(doi, payload)
+
+
+def put_doi_metadata(doi, payload):
+    """Send DOI metadata to DataCite.
+
+    This function does not take a rule engine context, so it can be used
+    from worker threads.
+
+    :param doi:     DOI to register metadata of
+    :param payload: DataCite XML
+
+    :raises requests.exceptions.RequestException: Request failed after all retries
+
+    :returns: HTTP status code returned by DataCite
+    """
     url = "{}/metadata/{}".format(config.datacite_url, doi)
     auth = (config.datacite_username, config.datacite_password)
     headers = {'Content-Type': 'application/xml', 'charset': 'UTF-8'}
 
-    response = requests.put(url, auth=auth, data=payload, headers=headers, timeout=30)
+    response = request('PUT', url, auth=auth, data=payload, headers=headers)
 
     return response.status_code
 
@@ -57,7 +174,7 @@ def register_doi_url(ctx, doi, url):
     payload = "doi={}\nurl={}".format(doi, url)
     headers = {'content-type': 'text/plain', 'charset': 'UTF-8'}
 
-    response = requests.put(url, auth=auth, data=payload, headers=headers, timeout=30)
+    response = request('PUT', url, auth=auth, data=payload, headers=headers)
 
     return response.status_code
 
@@ -73,7 +190,7 @@ def check_doi_availability(ctx, doi):
     url = "{}/doi/{}".format(config.datacite_url, doi)
     auth = (config.datacite_username, config.datacite_password)
 
-    response = requests.get(url, auth=auth, timeout=30)
+    response = request('GET', url, auth=auth)
 
     return response.status_code
 
@@ -89,6 +206,6 @@ def delete_doi_metadata(ctx, doi):
     auth = (config.datacite_username, config.datacite_password)
     headers = {'content-type': 'text/plain', 'charset': 'UTF-8'}
 
-    response = requests.delete(url, auth=auth, headers=headers, timeout=30)
+    response = request('DELETE', url, auth=auth, headers=headers)
 
     return response.status_code
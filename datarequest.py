@@ -36,10 +36,12 @@ __all__ = ['api_datarequest_browse',
            'api_datarequest_assignment_get',
            'api_datarequest_review_submit',
            'api_datarequest_reviews_get',
+           'api_datarequest_documents_get',
            'api_datarequest_evaluation_submit',
            'api_datarequest_dta_post_upload_actions',
            'api_datarequest_signed_dta_post_upload_actions',
-           'api_datarequest_data_ready']
+           'api_datarequest_data_ready',
+           'rule_datarequest_summary_update']
 
 
 ###################################################
@@ -47,6 +49,8 @@ __all__ = ['api_datarequest_browse',
 ###################################################
 
 DATAREQUESTSTATUSATTRNAME = "status"
+DATAREQUESTSUMMARYATTRNAME = "browse_summary"
+DATAREQUESTSUMMARYKEYLENGTH = 250
 
 YODA_PORTAL_FQDN  = config.yoda_portal_fqdn
 
@@ -211,6 +215,69 @@ def metadata_set(ctx, request_id, key, value):
     ctx.adminDatarequestActions()
 
 
+def summary_update(ctx, request_coll):
+    """Update the browse summary of a data request.
+
+    The summary is a single AVU on the data request file. Its value is a
+    JSON list of the status and title of the data request, so that sorting on
+    the value sorts on status. Its unit is the (truncated) title, so that
+    sorting on the unit sorts on title. This allows the browse view to be
+    served, sorted and paginated from a single query.
+
+    :param ctx:          Combined type of a callback and rei struct
+    :param request_coll: Path of the data request collection
+    """
+    file_path = "{}/{}".format(request_coll, DATAREQUEST + JSON_EXT)
+
+    fields = dict(Query(ctx, "META_DATA_ATTR_NAME, META_DATA_ATTR_VALUE",
+                        "COLL_NAME = '{}' AND DATA_NAME = '{}' AND META_DATA_ATTR_NAME in ('{}', 'title', '{}')"
+                        .format(request_coll, DATAREQUEST + JSON_EXT,
+                                DATAREQUESTSTATUSATTRNAME, DATAREQUESTSUMMARYATTRNAME)))
+
+    status_value = fields.get(DATAREQUESTSTATUSATTRNAME, status.IN_SUBMISSION.value)
+    title = fields.get('title', '')
+    # Truncate the sort key to the maximum unit length, on a character boundary.
+    key = title[:DATAREQUESTSUMMARYKEYLENGTH].decode('utf-8', 'ignore').encode('utf-8')
+
+    if DATAREQUESTSUMMARYATTRNAME in fields:
+        avu.rmw_from_data(ctx, file_path, DATAREQUESTSUMMARYATTRNAME, '%', '%')
+    avu.add_to_data(ctx, file_path, DATAREQUESTSUMMARYATTRNAME, json.dumps([status_value, title]), key)
+
+
+@rule.make(inputs=range(1), outputs=range(1, 2))
+def rule_datarequest_summary_update(ctx, request_coll):
+    """Update the browse summary of a data request after a status change.
+
+    Called by the data request action processing, which runs as rodsadmin.
+    When called without a collection, the summaries of all data requests are
+    rebuilt (e.g. for data requests submitted before summaries existed).
+
+    :param ctx:          Combined type of a callback and rei struct
+    :param request_coll: Path of the data request collection (empty to update all)
+
+    :returns: Status
+    """
+    if user.user_type(ctx) != 'rodsadmin':
+        return 'Insufficient permissions - should only be called by rodsadmin'
+
+    if request_coll == '':
+        request_colls = list(Query(ctx, "COLL_NAME",
+                                   "COLL_PARENT_NAME = '/{}/{}' AND DATA_NAME = '{}'"
+                                   .format(user.zone(ctx), DRCOLLECTION, DATAREQUEST + JSON_EXT)))
+    else:
+        request_colls = [request_coll]
+
+    for coll in request_colls:
+        file_path = "{}/{}".format(coll, DATAREQUEST + JSON_EXT)
+        msi.set_acl(ctx, "default", "admin:write", user.full_name(ctx), file_path)
+        try:
+            summary_update(ctx, coll)
+        finally:
+            msi.set_acl(ctx, "default", "admin:null", user.full_name(ctx), file_path)
+
+    return 'Success'
+
+
 @api.make()
 def api_datarequest_is_owner(ctx, request_id):
     """Check if the invoking user is also the owner of a given data request
@@ -346,6 +413,46 @@ def api_datarequest_schema_get(ctx, schema_name):
     return datarequest_schema_get(ctx, schema_name)
 
 
+# Parsed schemas and compiled validators, keyed by schema name.
+# Values are (modify times, schemas, validator) tuples.
+_schema_cache = {}
+
+
+def datarequest_schema_load(ctx, schema_name):
+    """Get parsed schemas and compiled validator of a datarequest form
+
+    Schemas are cached for the lifetime of the agent, and are only read,
+    parsed and compiled again when one of the schema data objects was
+    modified.
+
+    :param ctx:         Combined type of a callback and rei struct
+    :param schema_name: Name of schema
+
+    :raises UUFileNotExistError: Schema does not exist
+
+    :returns: Tuple of dict with schema and UI schema, and schema validator
+    """
+    coll_path = "/{}{}/{}".format(user.zone(ctx), SCHEMACOLLECTION, schema_name)
+
+    modify_times = dict(Query(ctx, "DATA_NAME, DATA_MODIFY_TIME",
+                              "COLL_NAME = '{}' AND DATA_NAME in ('{}', '{}')"
+                              .format(coll_path, SCHEMA + JSON_EXT, UISCHEMA + JSON_EXT)))
+
+    if schema_name in _schema_cache and len(modify_times) == 2:
+        cached_modify_times, schemas, validator = _schema_cache[schema_name]
+        if cached_modify_times == modify_times:
+            return schemas, validator
+
+    # Retrieve and read schema and uischema
+    schemas = {"schema":   jsonutil.read(ctx, "{}/{}".format(coll_path, SCHEMA + JSON_EXT)),
+               "uischema": jsonutil.read(ctx, "{}/{}".format(coll_path, UISCHEMA + JSON_EXT))}
+    validator = jsonschema.Draft7Validator(schemas["schema"])
+
+    _schema_cache[schema_name] = (modify_times, schemas, validator)
+
+    return schemas, validator
+
+
 def datarequest_schema_get(ctx, schema_name):
     """Get schema and UI schema of a datarequest form
 
@@ -354,20 +461,13 @@ def datarequest_schema_get(ctx, schema_name):
 
     :returns: Dict with schema and UI schema
     """
-    # Define paths to schema and uischema
-    coll_path = "/{}{}".format(user.zone(ctx), SCHEMACOLLECTION)
-    schema_path = "{}/{}/{}".format(coll_path, schema_name, SCHEMA + JSON_EXT)
-    uischema_path = "{}/{}/{}".format(coll_path, schema_name, UISCHEMA + JSON_EXT)
-
-    # Retrieve and read schema and uischema
     try:
-        schema = jsonutil.read(ctx, schema_path)
-        uischema = jsonutil.read(ctx, uischema_path)
+        schemas, _ = datarequest_schema_load(ctx, schema_name)
     except error.UUFileNotExistError:
         return api.Error("file_read_error", "Could not read schema because it doesn't exist.")
 
     # Return JSON with schema and uischema
-    return {"schema": schema, "uischema": uischema}
+    return dict(schemas)
 
 
 def datarequest_data_valid(ctx, data, schema_name):
@@ -380,14 +480,10 @@ def datarequest_data_valid(ctx, data, schema_name):
     :returns: Boolean indicating if datarequest is valid or API error
     """
     try:
-        schema = datarequest_schema_get(ctx, schema_name)['schema']
-
-        validator = jsonschema.Draft7Validator(schema)
-
-        errors = list(validator.iter_errors(data))
+        _, validator = datarequest_schema_load(ctx, schema_name)
 
-        return len(errors) == 0
-    except error.UUJsonValidationError as e:
+        return validator.is_valid(data)
+    except error.UUError as e:
         # File may be missing or not valid JSON
         return api.Error("validation_error",
                          "{} form data could not be validated against its schema.".format(schema_name))
@@ -401,8 +497,14 @@ def datarequest_data_valid(ctx, data, schema_name):
 def api_datarequest_browse(ctx, sort_on='name', sort_order='asc', offset=0, limit=10):
     """Get paginated datarequests, including size/modify date information.
 
+    All data is retrieved with a single query on the browse summary of the
+    data requests (see summary_update), so that sorting, pagination and the
+    total count are handled by the iCAT. A second query counts the data
+    requests that have a status: if some of them have no summary yet, the
+    data requests are browsed by status instead (see browse_by_status).
+
     :param ctx:        Combined type of a callback and rei struct
-    :param sort_on:    Column to sort on ('name', 'modified')
+    :param sort_on:    Column to sort on ('name', 'modified', 'status', 'title')
     :param sort_order: Column sort order ('asc' or 'desc')
     :param offset:     Offset to start browsing from
     :param limit:      Limit number of results
@@ -414,50 +516,42 @@ def api_datarequest_browse(ctx, sort_on='name', sort_order='asc', offset=0, limi
     def transform(row):
         # Remove ORDER_BY etc. wrappers from column names.
         x = {re.sub('.*\((.*)\)', '\\1', k): v for k, v in row.items()}
+        status_value, title = jsonutil.parse(x['META_DATA_ATTR_VALUE'])
 
         return {'id':          x['COLL_NAME'].split('/')[-1],
                 'name':        x['COLL_OWNER_NAME'],
                 'create_time': int(x['COLL_CREATE_TIME']),
-                'status':      x['META_DATA_ATTR_VALUE']}
-
-    def transform_title(row):
-        # Remove ORDER_BY etc. wrappers from column names.
-        x = {re.sub('.*\((.*)\)', '\\1', k): v for k, v in row.items()}
-
-        return {'id':          x['COLL_NAME'].split('/')[-1],
-                'title':       x['META_DATA_ATTR_VALUE']}
-
-    if sort_on == 'modified':
-        # FIXME: Sorting on modify date is borked: There appears to be no
-        # reliable way to filter out replicas this way - multiple entries for
-        # the same file may be returned when replication takes place on a
-        # minute boundary, for example.
-        # We would want to take the max modify time *per* data name.
-        # (or not? replication may take place a long time after a modification,
-        #  resulting in a 'too new' date)
-        ccols = ['COLL_NAME', 'ORDER(COLL_CREATE_TIME)', "COLL_OWNER_NAME", "META_DATA_ATTR_VALUE"]
-    else:
-        ccols = ['ORDER(COLL_NAME)', 'COLL_CREATE_TIME', "COLL_OWNER_NAME", "META_DATA_ATTR_VALUE"]
-
-    if sort_order == 'desc':
-        ccols = [x.replace('ORDER(', 'ORDER_DESC(') for x in ccols]
-
-    qcoll = Query(ctx, ccols, "COLL_PARENT_NAME = '{}' AND DATA_NAME = '{}' AND META_DATA_ATTR_NAME = 'status'".format(coll, DATAREQUEST + JSON_EXT),
+                'status':      status_value,
+                'title':       title}
+
+    # FIXME: Sorting on modify date is borked: There appears to be no
+    # reliable way to filter out replicas this way - multiple entries for
+    # the same file may be returned when replication takes place on a
+    # minute boundary, for example.
+    # We would want to take the max modify time *per* data name.
+    # (or not? replication may take place a long time after a modification,
+    #  resulting in a 'too new' date)
+    sort_column = {'modified': 'COLL_CREATE_TIME',
+                   'status':   'META_DATA_ATTR_VALUE',
+                   'title':    'META_DATA_ATTR_UNITS'}.get(sort_on, 'COLL_NAME')
+
+    ccols = ['COLL_NAME', 'COLL_CREATE_TIME', 'COLL_OWNER_NAME', 'META_DATA_ATTR_VALUE', 'META_DATA_ATTR_UNITS']
+    ccols = [('ORDER_DESC({})' if sort_order == 'desc' else 'ORDER({})').format(x) if x == sort_column else x
+             for x in ccols]
+
+    qcoll = Query(ctx, ccols, "COLL_PARENT_NAME = '{}' AND DATA_NAME = '{}' AND META_DATA_ATTR_NAME = '{}'"
+                              .format(coll, DATAREQUEST + JSON_EXT, DATAREQUESTSUMMARYATTRNAME),
                   offset=offset, limit=limit, output=query.AS_DICT)
 
-    ccols_title = ['COLL_NAME', "META_DATA_ATTR_VALUE"]
-    qcoll_title = Query(ctx, ccols_title, "COLL_PARENT_NAME = '{}' AND DATA_NAME = '{}' AND META_DATA_ATTR_NAME = 'title'".format(coll, DATAREQUEST + JSON_EXT),
-                        offset=offset, limit=limit, output=query.AS_DICT)
-
     colls = map(transform, list(qcoll))
-    colls_title = map(transform_title, list(qcoll_title))
+    total = qcoll.total_rows()
 
-    # Merge datarequest title in results.
-    for datarequest_title in colls_title:
-        for datarequest in colls:
-            if datarequest_title['id'] == datarequest['id']:
-                datarequest['title'] = datarequest_title['title']
-                break
+    # Data requests submitted before summaries existed, or of which the
+    # status change has not been processed yet, have no summary.
+    if total < Query(ctx, "COLL_NAME", "COLL_PARENT_NAME = '{}' AND DATA_NAME = '{}' AND META_DATA_ATTR_NAME = '{}'"
+                                       .format(coll, DATAREQUEST + JSON_EXT, DATAREQUESTSTATUSATTRNAME),
+                     limit=1).total_rows():
+        return browse_by_status(ctx, coll, sort_on, sort_order, offset, limit)
 
     if len(colls) == 0:
         # No results at all?
@@ -466,6 +560,56 @@ def api_datarequest_browse(ctx, sort_on='name', sort_order='asc', offset=0, limi
             return api.Error('nonexistent', 'The given path does not exist')
         # (checking this beforehand would waste a query in the most common situation)
 
+    return OrderedDict([('total', total),
+                        ('items', colls)])
+
+
+def browse_by_status(ctx, coll, sort_on, sort_order, offset, limit):
+    """Get paginated datarequests from their status and title metadata.
+
+    Fallback of api_datarequest_browse for data requests without a browse
+    summary. Sorting on status or title is not possible here; those sort on
+    name instead.
+
+    :param ctx:        Combined type of a callback and rei struct
+    :param coll:       Collection holding the data requests
+    :param sort_on:    Column to sort on ('name', 'modified')
+    :param sort_order: Column sort order ('asc' or 'desc')
+    :param offset:     Offset to start browsing from
+    :param limit:      Limit number of results
+
+    :returns: Dict with paginated datarequests
+    """
+    def transform(row):
+        # Remove ORDER_BY etc. wrappers from column names.
+        x = {re.sub('.*\((.*)\)', '\\1', k): v for k, v in row.items()}
+
+        return {'id':          x['COLL_NAME'].split('/')[-1],
+                'name':        x['COLL_OWNER_NAME'],
+                'create_time': int(x['COLL_CREATE_TIME']),
+                'status':      x['META_DATA_ATTR_VALUE']}
+
+    sort_column = 'COLL_CREATE_TIME' if sort_on == 'modified' else 'COLL_NAME'
+
+    ccols = ['COLL_NAME', 'COLL_CREATE_TIME', 'COLL_OWNER_NAME', 'META_DATA_ATTR_VALUE']
+    ccols = [('ORDER_DESC({})' if sort_order == 'desc' else 'ORDER({})').format(x) if x == sort_column else x
+             for x in ccols]
+
+    qcoll = Query(ctx, ccols, "COLL_PARENT_NAME = '{}' AND DATA_NAME = '{}' AND META_DATA_ATTR_NAME = '{}'"
+                              .format(coll, DATAREQUEST + JSON_EXT, DATAREQUESTSTATUSATTRNAME),
+                  offset=offset, limit=limit, output=query.AS_DICT)
+
+    colls = map(transform, list(qcoll))
+
+    # Titles of the data requests on this page.
+    if colls:
+        titles = dict(Query(ctx, "COLL_NAME, META_DATA_ATTR_VALUE",
+                            "COLL_NAME in ({}) AND DATA_NAME = '{}' AND META_DATA_ATTR_NAME = 'title'"
+                            .format(", ".join("'{}/{}'".format(coll, x['id']) for x in colls),
+                                    DATAREQUEST + JSON_EXT)))
+        for x in colls:
+            x['title'] = titles.get('{}/{}'.format(coll, x['id']), '')
+
     return OrderedDict([('total', qcoll.total_rows()),
                         ('items', colls)])
 
@@ -1020,25 +1164,113 @@ def api_datarequest_reviews_get(ctx, request_id):
     except error.UUError as e:
         return api.Error("PermissionError", "Something went wrong during permission checking: {}.".format(e))
 
-    # Construct filename
-    coll_path = "/{}/{}/{}".format(user.zone(ctx), DRCOLLECTION, request_id)
-    file_name = 'review_%.json'
-
     # Get the review JSON files
+    coll_path = "/{}/{}/{}".format(user.zone(ctx), DRCOLLECTION, request_id)
     reviews = []
-    rows = row_iterator(["DATA_NAME"],
-                        "COLL_NAME = '{}' AND DATA_NAME like '{}'".format(coll_path, file_name),
-                        AS_DICT, ctx)
-    for row in rows:
-        file_path = "{}/{}".format(coll_path, row['DATA_NAME'])
+    for name, (size, _) in sorted(documents_list(ctx, coll_path).items()):
+        if not (name.startswith(REVIEW + '_') and name.endswith(JSON_EXT)):
+            continue
         try:
-            reviews.append(json.loads(data_object.read(ctx, file_path)))
+            reviews.append(json.loads(data_object.read(ctx, "{}/{}".format(coll_path, name), sz=size)))
         except error.UUError as e:
             return api.Error("ReadError", "Could not get review data: {}.".format(e))
 
     return json.dumps(reviews)
 
 
+def documents_list(ctx, coll_path):
+    """List the documents in a data request collection in a single query
+
+    Only documents the user has access to are listed.
+
+    :param ctx:       Combined type of a callback and rei struct
+    :param coll_path: Path of the data request collection
+
+    :returns: Dict of document name => (size, owner name)
+    """
+    documents = {}
+    # Order on modify time, so that the newest replica of a document is used.
+    for name, size, owner, _ in Query(ctx, "DATA_NAME, DATA_SIZE, DATA_OWNER_NAME, ORDER_DESC(DATA_MODIFY_TIME)",
+                                      "COLL_NAME = '{}'".format(coll_path)):
+        if name not in documents:
+            documents[name] = (int(size), owner)
+
+    return documents
+
+
+@api.make()
+def api_datarequest_documents_get(ctx, request_id):
+    """Retrieve a data request with all its review and evaluation documents.
+
+    Permissions are checked once, all documents in the data request collection
+    are listed in a single query, and only the documents the user is
+    authorized to view are read. This allows a data request detail page to be
+    rendered from a single API call.
+
+    :param ctx:        Combined type of a callback and rei struct
+    :param request_id: Unique identifier of the data request
+
+    :returns: Dict with status and the parsed documents the user may view
+    """
+    # Force conversion of request_id to string
+    request_id = str(request_id)
+
+    coll_path = "/{}/{}/{}".format(user.zone(ctx), DRCOLLECTION, request_id)
+
+    documents = documents_list(ctx, coll_path)
+    if DATAREQUEST + JSON_EXT not in documents:
+        return api.Error("permission_error", "User is not authorized to view this data request.")
+
+    # Roles of the user, from a single query on group memberships.
+    client = user.user_and_zone(ctx)
+    memberships = set(Query(ctx, "USER_GROUP_NAME",
+                            "USER_NAME = '{}' AND USER_ZONE = '{}'".format(client.name, client.zone)))
+    isboardmember = GROUP_BOD in memberships
+    isdatamanager = GROUP_DM in memberships
+    isdmcmember = GROUP_DMC in memberships
+    isrequestowner = documents[DATAREQUEST + JSON_EXT][1] == client.name
+
+    # Status and reviewers, from a single query on the data request metadata.
+    datarequest_status = status.IN_SUBMISSION.value
+    reviewers = []
+    for name, value in Query(ctx, "META_DATA_ATTR_NAME, META_DATA_ATTR_VALUE",
+                             "COLL_NAME = '{}' AND DATA_NAME = '{}' AND META_DATA_ATTR_NAME in ('{}', 'assignedForReview')"
+                             .format(coll_path, DATAREQUEST + JSON_EXT, DATAREQUESTSTATUSATTRNAME)):
+        if name == DATAREQUESTSTATUSATTRNAME:
+            datarequest_status = value
+        else:
+            reviewers.append(value)
+    isreviewer = client.name in reviewers
+
+    if not (isboardmember or isdatamanager or isdmcmember or isrequestowner):
+        return api.Error("permission_error", "User is not authorized to view this data request.")
+
+    # Documents the user is authorized to view (see the individual get API calls).
+    # Documents without a check of their own are protected by their ACLs only.
+    authorized = [(DATAREQUEST, True),
+                  (PR_REVIEW,   isboardmember or isdatamanager or isreviewer),
+                  (DM_REVIEW,   isboardmember or isdatamanager or isreviewer),
+                  (ASSIGNMENT,  True),
+                  (EVALUATION,  True)]
+
+    def read(name):
+        return jsonutil.parse(data_object.read(ctx, "{}/{}".format(coll_path, name), sz=documents[name][0]))
+
+    result = OrderedDict([('requestStatus', datarequest_status)])
+    try:
+        for document, allowed in authorized:
+            if allowed and document + JSON_EXT in documents:
+                result[document] = read(document + JSON_EXT)
+
+        if isboardmember:
+            result['reviews'] = [read(name) for name in sorted(documents)
+                                 if name.startswith(REVIEW + '_') and name.endswith(JSON_EXT)]
+    except error.UUError as e:
+        return api.Error("ReadError", "Could not get data request documents: {}.".format(e))
+
+    return result
+
+
 @api.make()
 def api_datarequest_evaluation_submit(ctx, data, request_id):
     """Persist an evaluation to disk.
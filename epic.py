@@ -6,7 +6,7 @@ __license__   = 'GPLv3, see LICENSE'
 
 import uuid
 
-import publication
+import publication_config
 from util import *
 
 __all__ = ['rule_generate_uuid']
@@ -29,7 +29,7 @@ def register_epic_pid(ctx, target):
 
     :return: Dict with url, PID and http status.
     """
-    config = publication.get_publication_config(ctx)
+    config = publication_config.get_publication_config(ctx)
     host = config['davrodsVHost']
     parts = target.split('/')
     subpath = '/'.join(parts[2:])  # only user part without /tempZone/home
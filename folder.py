@@ -4,6 +4,9 @@
 __copyright__ = 'Copyright (c) 2019-2020, Utrecht University'
 __license__   = 'GPLv3, see LICENSE'
 
+import threading
+from contextlib import contextmanager
+
 import irods_types
 
 import epic
@@ -458,7 +461,7 @@ def has_locks(ctx, coll, org_metadata=None):
     return len(get_locks(ctx, coll, org_metadata=org_metadata)) > 0
 
 
-def is_locked(ctx, coll, org_metadata=None):
+def is_locked(ctx, coll, org_metadata=None, op=None):
     """Check whether a lock exists on the given collection itself or a parent collection.
 
     Locks on subcollections are not counted.
@@ -466,22 +469,121 @@ def is_locked(ctx, coll, org_metadata=None):
     :param ctx:          Combined type of a callback and rei struct
     :param coll:         Collection to check for locks
     :param org_metadata: Organizational metadata
+    :param op:           Operation of which the lock state is reused, if it covers the collection
 
     :returns: Boolean indicating if folder is locked
     """
+    if op is not None and op.coll == coll:
+        return op.locked
+
     locks = get_locks(ctx, coll, org_metadata=org_metadata)
 
     # Count only locks that exist on the coll itself or its parents.
     return len([x for x in locks if coll.startswith(x)]) > 0
 
 
-def is_data_locked(ctx, path, org_metadata=None):
-    """Check whether a lock exists on the given data object."""
+def is_data_locked(ctx, path, org_metadata=None, op=None):
+    """Check whether a lock exists on the given data object.
+
+    The lock state of the operation op is reused if it covers the data object.
+    """
+    if op is not None:
+        coll, name = pathutil.chop(path)
+        if op.coll == coll and name in op.data_names:
+            return name in op.data_locked
+
     locks = get_locks(ctx, path, org_metadata=org_metadata, object_type=pathutil.ObjectType.DATA)
 
     return len(locks) > 0
 
 
+class Operation(object):
+    """State needed to validate a file or folder operation in a research folder.
+
+    Membership, lock state and existence of the collection and of the source
+    and target names in it are gathered in a fixed number of queries, instead
+    of one rule or query per check. The state is passed explicitly to the
+    checks of the API call that created it. Policies triggered by the
+    operation's microservices in the same agent request obtain it with
+    running_operation (see running) and pass it on to their checks.
+
+    :param ctx:        Combined type of a callback and rei struct
+    :param coll:       Research collection the operation takes place in
+    :param data_names: Names of data objects in coll involved in the operation
+    :param coll_names: Names of subcollections of coll involved in the operation
+    """
+
+    def __init__(self, ctx, coll, data_names=(), coll_names=()):
+        self.coll = coll
+        self.group = coll.split('/')[3]
+        self.client = user.user_and_zone(ctx)
+        self.data_names = set(data_names)
+
+        # Groups the client is a member of (see uuGroupGetMemberType).
+        memberships = set(Query(ctx, "USER_GROUP_NAME",
+                                "USER_NAME = '{}' AND USER_ZONE = '{}'".format(self.client.name, self.client.zone)))
+        self.member = self.group in memberships
+
+        self.org_metadata = get_org_metadata(ctx, coll)
+        self.locked = is_locked(ctx, coll, self.org_metadata)
+
+        self.collections = set(Query(ctx, "COLL_NAME", "COLL_NAME in ({})".format(
+            ", ".join("'{}'".format(c) for c in [coll] + ['{}/{}'.format(coll, x) for x in coll_names]))))
+
+        self.data_objects = set()
+        self.data_locked = set()
+        if self.data_names:
+            names = ", ".join("'{}'".format(x) for x in self.data_names)
+            self.data_objects = set(Query(ctx, "DATA_NAME",
+                                          "COLL_NAME = '{}' AND DATA_NAME in ({})".format(coll, names)))
+            self.data_locked = set(Query(ctx, "DATA_NAME",
+                                         "COLL_NAME = '{}' AND DATA_NAME in ({}) AND META_DATA_ATTR_NAME = '{}'"
+                                         .format(coll, names, constants.IILOCKATTRNAME)))
+
+    def coll_exists(self, name=None):
+        """Check whether the collection, or the given subcollection of it, exists."""
+        return (self.coll if name is None else '{}/{}'.format(self.coll, name)) in self.collections
+
+    def data_exists(self, name):
+        """Check whether the given data object in the collection exists."""
+        return name in self.data_objects
+
+
+_running = threading.local()
+"""Operation whose microservices are being executed, per thread (see running)."""
+
+
+@contextmanager
+def running(op):
+    """Make an operation available to the policies triggered by its microservices.
+
+    These policies run in the same agent and thread as the API call, within
+    the same request. The operation is only registered for the block, and
+    removed when it ends, also when the microservice fails.
+
+    :param op: Operation whose microservices are executed in the block
+    """
+    previous = getattr(_running, 'operation', None)
+    _running.operation = op
+    try:
+        yield op
+    finally:
+        _running.operation = previous
+
+
+def running_operation(ctx):
+    """Return the operation of the client that is being executed in this thread, if any.
+
+    :param ctx: Combined type of a callback and rei struct
+
+    :returns: Operation, or None
+    """
+    op = getattr(_running, 'operation', None)
+    if op is not None and op.client == user.user_and_zone(ctx):
+        return op
+    return None
+
+
 def get_status(ctx, path, org_metadata=None):
     """Get the status of a research folder."""
     if org_metadata is None:
@@ -4,9 +4,14 @@
 __copyright__ = 'Copyright (c) 2018-2019, Utrecht University'
 __license__   = 'GPLv3, see LICENSE'
 
+import time
+import uuid
+
 import requests
 
+import prefix_index
 from util import *
+from util.query import Query
 
 __all__ = ['api_group_data',
            'api_group_data_filtered',
@@ -25,80 +30,306 @@ __all__ = ['api_group_data',
            'api_group_user_add',
            'api_group_user_update_role',
            'api_group_get_user_role',
-           'api_group_remove_user_from_group']
+           'api_group_remove_user_from_group',
+           'rule_group_directory_update']
+
+
+GROUP_QUERY_CHUNK = 64
+"""Maximum number of group names in a single query condition (see queryGroupData)."""
+
+GROUP_DIRECTORY_LOCK_TIMEOUT = 600
+"""Time in seconds after which the group directory lock of an update that did not finish is taken over."""
+
+GROUP_DIRECTORY_REBUILD = '*'
+"""Pending group directory update for all groups (see rule_group_directory_update)."""
+
+GROUP_DIRECTORY_MAX_SIZE = 256 * 1024 * 1024
+"""Maximum size in bytes of the group directory that is read, larger directories are ignored."""
 
 
 def getGroupData(ctx):
-    """Return groups and related data."""
+    """Return groups and related data.
+
+    Group data is read from the group directory, a materialized copy of the
+    group data that is kept up to date by the group manager (see
+    rule_group_directory_update). If the directory does not exist yet, or
+    is too large to read, group data is retrieved from the iCAT.
+    """
+    groups = read_group_directory(ctx)
+    if groups is None:
+        groups = queryGroupData(ctx)
+
+    return groups.values()
+
+
+def read_group_directory(ctx):
+    """Read the group directory.
+
+    :param ctx: Combined type of a ctx and rei struct
+
+    :returns: Dict of group name => group data, or None if the directory does not exist or is too large
+    """
+    directory = '/' + user.zone(ctx) + constants.UUGROUPDIRECTORY
+
+    try:
+        return jsonutil.parse(data_object.read(ctx, directory, max_size=GROUP_DIRECTORY_MAX_SIZE))
+    except error.UUFileNotExistError:
+        return None
+    except error.UUFileSizeError as e:
+        log.write(ctx, 'Ignoring group directory: {}'.format(e))
+        return None
+
+
+def queryGroupData(ctx, group_names=None):
+    """Retrieve groups and related data from the iCAT.
+
+    When group names are given, only data of these groups (and their
+    read-only shadow groups) is retrieved, using queries on at most
+    GROUP_QUERY_CHUNK groups at a time.
+
+    :param ctx:         Combined type of a ctx and rei struct
+    :param group_names: Only retrieve data of these groups (defaults to all groups)
+
+    :returns: Dict of group name => group data
+    """
     groups = {}
 
+    if group_names is None:
+        conditions = ['']
+    else:
+        # Include the read-only shadow group of research and initial groups.
+        names = set(group_names)
+        names.update("read-" + name.split('-', 1)[1] for name in group_names
+                     if name.startswith(("research-", "initial-")))
+        names = sorted(names)
+
+        conditions = [" AND USER_GROUP_NAME in ({})".format(", ".join("'{}'".format(name) for name in chunk))
+                      for chunk in [names[i:i + GROUP_QUERY_CHUNK] for i in range(0, len(names), GROUP_QUERY_CHUNK)]]
+
     # First query: obtain a list of groups with group attributes.
-    iter = genquery.row_iterator(
-        "USER_GROUP_NAME, META_USER_ATTR_NAME, META_USER_ATTR_VALUE",
-        "USER_TYPE = 'rodsgroup'",
-        genquery.AS_LIST, ctx
-    )
+    for condition in conditions:
+        iter = genquery.row_iterator(
+            "USER_GROUP_NAME, META_USER_ATTR_NAME, META_USER_ATTR_VALUE",
+            "USER_TYPE = 'rodsgroup'" + condition,
+            genquery.AS_LIST, ctx
+        )
+
+        for row in iter:
+            name = row[0]
+            attr = row[1]
+            value = row[2]
+
+            # Create/update group with this information.
+            try:
+                group = groups[name]
+            except Exception:
+                group = {
+                    "name": name,
+                    "managers": [],
+                    "members": [],
+                    "read": []
+                }
+                groups[name] = group
+
+            if attr in ["data_classification", "category", "subcategory"]:
+                group[attr] = value
+            elif attr == "description":
+                # Deal with legacy use of '.' for empty description metadata.
+                # See uuGroupGetDescription() in uuGroup.r for correct behavior of the old query interface.
+                group[attr] = '' if value == '.' else value
+            elif attr == "manager":
+                group["managers"].append(value)
 
-    for row in iter:
-        name = row[0]
-        attr = row[1]
-        value = row[2]
+    # Second query: obtain list of groups with memberships.
+    for condition in conditions:
+        iter = genquery.row_iterator(
+            "USER_GROUP_NAME, USER_NAME, USER_ZONE",
+            "USER_TYPE != 'rodsgroup'" + condition,
+            genquery.AS_LIST, ctx
+        )
+
+        for row in iter:
+            name = row[0]
+            user = row[1]
+            zone = row[2]
+
+            if name != user and name != "rodsadmin" and name != "public":
+                user = user + "#" + zone
+                if name.startswith("read-"):
+                    # Match read-* group with research-* or initial-* group.
+                    name = name[5:]
+                    try:
+                        # Attempt to add to read list of research group.
+                        group = groups["research-" + name]
+                        group["read"].append(user)
+                    except Exception:
+                        try:
+                            # Attempt to add to read list of initial group.
+                            group = groups["initial-" + name]
+                            group["read"].append(user)
+                        except Exception:
+                            pass
+                elif not name.startswith("vault-"):
+                    # Ardinary group.
+                    group = groups[name]
+                    group["members"].append(user)
+
+    return groups
+
+
+@rule.make(inputs=range(1), outputs=range(1, 2))
+def rule_group_directory_update(ctx, group_name):
+    """Update the group directory.
+
+    The directory is a JSON data object with the data of all groups. It is
+    updated for a single group after every change made through the group
+    manager, and rebuilt completely when called without a group name
+    (e.g. periodically, to reconcile changes made outside the group manager).
+
+    Concurrent updates are serialized: the group is first marked as pending,
+    and the directory is only written by the caller holding the directory
+    lock, for all pending groups at once.  A caller that does not get the
+    lock leaves its group to the lock holder.  Every change gets its own
+    pending mark, which is only removed once the directory has been written.
+
+    :param ctx:        Combined type of a ctx and rei struct
+    :param group_name: Group to update (empty to rebuild the whole directory)
+
+    :returns: Status
+    """
+    if user.user_type(ctx) != 'rodsadmin':
+        return 'Insufficient permissions - should only be called by rodsadmin'
 
-        # Create/update group with this information.
+    system = '/' + user.zone(ctx) + constants.UUSYSTEMCOLLECTION
+
+    avu.add_to_coll(ctx, system, constants.UUGROUPDIRECTORYPENDINGATTRNAME,
+                    group_name or GROUP_DIRECTORY_REBUILD, str(uuid.uuid4()))
+
+    # Groups marked pending after the last check of the lock holder are
+    # left to the next caller that gets the lock, so check again after
+    # releasing it.
+    while pending_directory_updates(ctx, system) and lock_group_directory(ctx):
         try:
-            group = groups[name]
-        except Exception:
-            group = {
-                "name": name,
-                "managers": [],
-                "members": [],
-                "read": []
-            }
-            groups[name] = group
-
-        if attr in ["data_classification", "category", "subcategory"]:
-            group[attr] = value
-        elif attr == "description":
-            # Deal with legacy use of '.' for empty description metadata.
-            # See uuGroupGetDescription() in uuGroup.r for correct behavior of the old query interface.
-            group[attr] = '' if value == '.' else value
-        elif attr == "manager":
-            group["managers"].append(value)
+            while update_group_directory_entries(ctx, system):
+                pass
+        finally:
+            data_object.remove(ctx, '/' + user.zone(ctx) + constants.UUGROUPDIRECTORYLOCK)
 
-    # Second query: obtain list of groups with memberships.
-    iter = genquery.row_iterator(
-        "USER_GROUP_NAME, USER_NAME, USER_ZONE",
-        "USER_TYPE != 'rodsgroup'",
-        genquery.AS_LIST, ctx
-    )
+    return 'Success'
 
-    for row in iter:
-        name = row[0]
-        user = row[1]
-        zone = row[2]
 
-        if name != user and name != "rodsadmin" and name != "public":
-            user = user + "#" + zone
+def pending_directory_updates(ctx, system):
+    """Return the pending group directory updates, as (group name, mark id)."""
+    return list(Query(ctx, "META_COLL_ATTR_VALUE, META_COLL_ATTR_UNITS",
+                      "COLL_NAME = '{}' AND META_COLL_ATTR_NAME = '{}'"
+                      .format(system, constants.UUGROUPDIRECTORYPENDINGATTRNAME)))
+
+
+def lock_group_directory(ctx):
+    """Take the group directory lock.
+
+    Creating a data object fails if it exists already, so only one caller
+    gets the lock.  The lock of an update that did not finish is taken over
+    after GROUP_DIRECTORY_LOCK_TIMEOUT.
+
+    :param ctx: Combined type of a ctx and rei struct
+
+    :returns: Whether the lock was taken
+    """
+    lock = '/' + user.zone(ctx) + constants.UUGROUPDIRECTORYLOCK
+
+    for attempt in range(2):
+        try:
+            ret = msi.data_obj_create(ctx, lock, '', 0)
+        except msi.Error:
+            if attempt > 0:
+                return False
+            try:
+                locked = data_object.read(ctx, lock)
+            except error.UUFileNotExistError:
+                continue
+
+            # The lock is empty until its holder has written the time it was
+            # taken.  If the holder did not finish, the lock ages from its creation.
+            if locked == '':
+                locked = Query(ctx, "DATA_MODIFY_TIME",
+                               "COLL_NAME = '%s' AND DATA_NAME = '%s'" % pathutil.chop(lock)).first()
+                if locked is None:
+                    continue
+
+            if int(locked) + GROUP_DIRECTORY_LOCK_TIMEOUT > time.time():
+                return False
+
+            # Rename before removing, so that only one caller takes over the lock.
+            stale = '{}.{}'.format(lock, int(time.time()))
+            try:
+                data_object.rename(ctx, lock, stale)
+            except msi.Error:
+                return False
+
+            log.write(ctx, 'Taking over group directory lock taken at {}'.format(locked))
+            data_object.remove(ctx, stale)
+            continue
+
+        handle = ret['arguments'][2]
+        msi.data_obj_write(ctx, handle, str(int(time.time())), 0)
+        msi.data_obj_close(ctx, handle, 0)
+        return True
+
+    return False
+
+
+def update_group_directory_entries(ctx, system):
+    """Write the group directory entries of all pending groups (as holder of the directory lock).
+
+    :param ctx:    Combined type of a ctx and rei struct
+    :param system: System collection of the zone
+
+    :returns: Whether there were pending groups
+    """
+    pending = pending_directory_updates(ctx, system)
+    if not pending:
+        return False
+
+    pending_names = set(name for name, _ in pending)
+    groups = None if GROUP_DIRECTORY_REBUILD in pending_names else read_group_directory(ctx)
+
+    if groups is None:
+        groups = queryGroupData(ctx)
+    else:
+        names = set()
+        for name in pending_names:
+            # Read-only shadow groups are part of their research or initial group.
             if name.startswith("read-"):
-                # Match read-* group with research-* or initial-* group.
-                name = name[5:]
-                try:
-                    # Attempt to add to read list of research group.
-                    group = groups["research-" + name]
-                    group["read"].append(user)
-                except Exception:
-                    try:
-                        # Attempt to add to read list of initial group.
-                        group = groups["initial-" + name]
-                        group["read"].append(user)
-                    except Exception:
-                        pass
-            elif not name.startswith("vault-"):
-                # Ardinary group.
-                group = groups[name]
-                group["members"].append(user)
+                base = name.split('-', 1)[1]
+                name = "research-" + base if ("research-" + base) in groups else "initial-" + base
+            names.add(name)
+            groups.pop(name, None)
 
-    return groups.values()
+        groups.update(queryGroupData(ctx, sorted(names)))
+
+    directory = '/' + user.zone(ctx) + constants.UUGROUPDIRECTORY
+    jsonutil.write(ctx, directory, groups)
+    msi.set_acl(ctx, 'default', 'read', 'public', directory)
+
+    # Changes marked after the pending updates were read keep their marks.
+    for name, mark in pending:
+        avu.rmw_from_coll(ctx, system, constants.UUGROUPDIRECTORYPENDINGATTRNAME, name, mark)
+
+    return True
+
+
+def update_group_directory(ctx, group_name):
+    """Update the group directory entry of a group (as rodsadmin) after a change.
+
+    :param ctx:        Combined type of a ctx and rei struct
+    :param group_name: Group that was changed
+    """
+    try:
+        ctx.uuGroupDirectoryUpdate(group_name)
+    except Exception as e:
+        # The directory is reconciled periodically.
+        log.write(ctx, 'Could not update group directory for <{}>: {}'.format(group_name, e))
 
 
 def getCategories(ctx):
@@ -176,7 +407,17 @@ def api_group_data_filtered(ctx, username, zone_name):
 
     :returns: Group data for a single user
     """
-    groups    = getGroupData(ctx)
+    # Groups the user is a member of, with read-only shadow groups replaced
+    # by their research or initial group.
+    group_names = set()
+    for name in Query(ctx, "USER_GROUP_NAME",
+                      "USER_NAME = '{}' AND USER_ZONE = '{}'".format(username, zone_name)):
+        if name.startswith("read-"):
+            group_names.update(["research-" + name[5:], "initial-" + name[5:]])
+        else:
+            group_names.add(name)
+
+    groups    = queryGroupData(ctx, list(group_names)).values() if group_names else []
     full_name = '{}#{}'.format(username, zone_name)
 
     # Filter groups (only return groups user is part of), convert to json and write to stdout.
@@ -184,7 +425,7 @@ def api_group_data_filtered(ctx, username, zone_name):
 
 
 def group_user_exists(ctx, group_name, username, include_readonly):
-    groups = getGroupData(ctx)
+    groups = queryGroupData(ctx, [group_name]).values()
     if '#' not in username:
         import session_vars
         username = username + "#" + session_vars.get_map(ctx.rei)["client_user"]["irods_zone"]
@@ -333,26 +574,56 @@ def rule_group_remove_external_user(rule_args, ctx, rei):
     log.write(ctx, removeExternalUser(ctx, rule_args[0], rule_args[1]))
 
 
+USER_INDEX_TTL = 300
+"""Seconds the user search index is valid (see api_group_search_users)."""
+
+USER_SEARCH_LIMIT = 100
+"""Default maximum number of results of a user search."""
+
+# User search index, kept for the lifetime of the agent: (build time, index).
+_user_index = (0, None)
+
+
+def user_index(ctx):
+    """Get an index of all users and admins for searching, rebuilt after USER_INDEX_TTL seconds.
+
+    :param ctx: Combined type of a ctx and rei struct
+
+    :returns: PrefixIndex of user#zone names
+    """
+    global _user_index
+
+    timestamp, index = _user_index
+    if index is None or time.time() - timestamp > USER_INDEX_TTL:
+        index = prefix_index.PrefixIndex("{}#{}".format(name, zone) for name, zone in
+                                         Query(ctx, "USER_NAME, USER_ZONE", "USER_TYPE in ('rodsuser', 'rodsadmin')"))
+        _user_index = (time.time(), index)
+
+    return index
+
+
 @api.make()
-def api_group_search_users(ctx, pattern):
-    (username, zone_name) = user.from_str(ctx, pattern)
-    userList = list()
+def api_group_search_users(ctx, pattern, limit=USER_SEARCH_LIMIT, substring=False):
+    """Search users and admins by name.
+
+    Users whose name starts with the pattern are listed. When substring
+    is set, these are followed by users whose name contains the pattern
+    elsewhere, which takes a scan of all users.
 
-    userIter = genquery.row_iterator("USER_NAME, USER_ZONE",
-                                     "USER_TYPE = 'rodsuser' AND USER_NAME LIKE '%{}%' AND USER_ZONE LIKE '%{}%'".format(username, zone_name),
-                                     genquery.AS_LIST, ctx)
+    :param ctx:       Combined type of a ctx and rei struct
+    :param pattern:   Name (or part of name) to search for, optionally followed by #zone
+    :param limit:     Maximum number of results
+    :param substring: Also list users whose name contains the pattern elsewhere
 
-    adminIter = genquery.row_iterator("USER_NAME, USER_ZONE",
-                                      "USER_TYPE = 'rodsadmin' AND USER_NAME LIKE '%{}%' AND USER_ZONE LIKE '%{}%'".format(username, zone_name),
-                                      genquery.AS_LIST, ctx)
+    :returns: List of matching users (user#zone)
+    """
+    (username, zone_name) = user.from_str(ctx, pattern)
 
-    for row in userIter:
-        userList.append("{}#{}".format(row[0], row[1]))
-    for row in adminIter:
-        userList.append("{}#{}".format(row[0], row[1]))
+    def match(name):
+        name, zone = name.split('#', 1)
+        return username in name and zone_name in zone
 
-    userList.sort()
-    return userList
+    return user_index(ctx).search(username, match=match, limit=int(limit), substring=substring)
 
 
 @api.make()
@@ -363,16 +634,22 @@ def api_group_exists(ctx, group_name):
 @api.make()
 def api_group_create(ctx, group_name, category, subcategory, description, data_classification):
     ruleResult = ctx.uuGroupAdd(group_name, category, subcategory, description, data_classification, '', '')
+    if ruleResult["arguments"][5] == '0':
+        update_group_directory(ctx, group_name)
 
 
 @api.make()
 def api_group_update(ctx, group_name, property_name, property_value):
     ruleResult = ctx.uuGroupModify(group_name, property_name, property_value, '', '')
+    if ruleResult["arguments"][3] == '0':
+        update_group_directory(ctx, group_name)
 
 
 @api.make()
 def api_group_delete(ctx, group_name):
     ruleResult = ctx.uuGroupRemove(group_name, '', '')
+    if ruleResult["arguments"][1] == '0':
+        update_group_directory(ctx, group_name)
 
 
 @api.make()
@@ -391,11 +668,15 @@ def api_group_user_is_member(ctx, username, group_name):
 @api.make()
 def api_group_user_add(ctx, username, group_name):
     ruleResult = ctx.uuGroupUserAdd(group_name, username, '', '')
+    if ruleResult["arguments"][2] == '0':
+        update_group_directory(ctx, group_name)
 
 
 @api.make()
 def api_group_user_update_role(ctx, username, group_name, new_role):
     ruleResult = ctx.uuGroupUserChangeRole(group_name, username, new_role, '', '')
+    if ruleResult["arguments"][3] == '0':
+        update_group_directory(ctx, group_name)
 
 
 @api.make()
@@ -409,3 +690,5 @@ def api_group_get_user_role(ctx, username, group_name):
 @api.make()
 def api_group_remove_user_from_group(ctx, username, group_name):
     ruleResult = ctx.uuGroupUserRemove(group_name, username, '', '')
+    if ruleResult["arguments"][2] == '0':
+        update_group_directory(ctx, group_name)
@@ -4,22 +4,23 @@
 __copyright__ = 'Copyright (c) 2018-2019, Utrecht University'
 __license__   = 'GPLv3, see LICENSE'
 
-import base64
-import hashlib
 import os.path
 import time
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from enum import Enum
 
 import session_vars
 
+import integrity_hash
 from util import *
+from util.query import Query
 
-__all__ = ['rule_integrity_check_vault']
+__all__ = ['api_integrity_report',
+           'rule_integrity_check_vault',
+           'rule_integrity_check_batch_remote']
 
 
 DataObject = namedtuple('DataObject', ['id', 'name', 'size', 'checksum', 'coll_name', 'resc_path', 'resc_loc'])
-CHUNK_SIZE = 8192
 
 
 class Status(Enum):
@@ -34,117 +35,300 @@ class Status(Enum):
         return self.name
 
 
-def checkDataObject(file_path, file_size, file_checksum):
-    # Check if file exists in vault.
-    if not os.path.isfile(file_path):
-        return Status.NOT_EXISTING
+def checkDataObjects(objects, threads=None):
+    """Check integrity of many files on the local resource.
 
-    # Check if file size matches.
-    if int(file_size) != os.path.getsize(file_path):
-        return Status.FILE_SIZE_MISMATCH
+    Existence, size and registered checksum are checked first. The checksums
+    of the remaining files are then computed concurrently by the hashing
+    engine (see integrity_hash.file_checksums).
 
-    # Check if checksum exists.
-    if not file_checksum:
-        return Status.NO_CHECKSUM
+    :param objects: List of (file_path, file_size, file_checksum) tuples
+    :param threads: Number of hashing threads (defaults to number of CPUs)
 
-    # Open file and compute checksum.
-    try:
-        f = open(file_path, 'rb')
-    except OSError as e:
-        return Status.ACCESS_DENIED
-    else:
-        # Determine if checksum is md5 or sha256.
-        if file_checksum.startswith("sha2:"):
-            checksum = file_checksum[5:]
-            hsh = hashlib.sha256()
+    :returns: List of statuses, in the same order as objects
+    """
+    statuses = []
+    jobs = []
+    for file_path, file_size, file_checksum in objects:
+        if not os.path.isfile(file_path):
+            # File does not exist in vault.
+            statuses.append(Status.NOT_EXISTING)
+        elif int(file_size) != os.path.getsize(file_path):
+            statuses.append(Status.FILE_SIZE_MISMATCH)
+        elif not file_checksum:
+            statuses.append(Status.NO_CHECKSUM)
         else:
-            checksum = file_checksum
-            hsh = hashlib.md5()
-
-        # Compute checksum.
-        while True:
-            chunk = f.read(CHUNK_SIZE)
-            if chunk:
-                hsh.update(chunk)
+            # Compute checksum, in the format iRODS stores it.
+            statuses.append(None)
+            jobs.append((file_path, integrity_hash.algorithm_of(file_checksum)))
+
+    checksums = iter(integrity_hash.file_checksums(jobs, threads))
+
+    for i, (_, _, file_checksum) in enumerate(objects):
+        if statuses[i] is None:
+            computed_checksum = next(checksums)
+            if computed_checksum is None:
+                statuses[i] = Status.ACCESS_DENIED
+            elif file_checksum != computed_checksum:
+                statuses[i] = Status.CHECKSUM_MISMATCH
             else:
-                break
+                statuses[i] = Status.OK
 
-        # iRODS stores md5 hashes plain and the sha256 hash base64 encoded.
-        if hsh.name == 'md5':
-            computed_checksum = hsh.digest()
-        else:
-            computed_checksum = base64.b64encode(hsh.digest())
-        f.close()
+    return statuses
 
-    # Check if checksum matches.
-    if checksum != computed_checksum:
-        return Status.CHECKSUM_MISMATCH
 
-    return Status.OK
+def physicalPath(obj):
+    """Build the path of a data object replica on the resource server filesystem."""
+    coll_name = os.path.join(*(obj.coll_name.split(os.path.sep)[2:]))
+    return obj.resc_path + "/" + coll_name + "/" + obj.name
 
 
-def checkDataObjectRemote(rule_args, callback, rei):
-    file_path = str(rule_args[0])
-    file_size = int(rule_args[1])
-    file_checksum = str(rule_args[2])
+def verificationLedger(ctx, first_data_id, last_data_id):
+    """Get last verification time and result of all replicas in a DATA_ID range.
 
-    status = checkDataObject(file_path, file_size, file_checksum)
+    The ledger is kept as one AVU per replica on the data object, with the
+    resource name as unit and "<timestamp> <status>" as value.
 
-    if status != Status.OK:
-        log.write(callback, "[INTEGRITY] %s: %s" % (file_path, str(status)))
+    :param ctx:           Combined type of a callback and rei struct
+    :param first_data_id: First DATA_ID of the range
+    :param last_data_id:  Last DATA_ID of the range
 
-
-def checkDataObjectIntegrity(callback, data_id):
-    # Obtain all replicas of a data object.
+    :returns: Dict of (data_id, resc_name) => (timestamp, status name)
+    """
     iter = genquery.row_iterator(
-        "DATA_ID, DATA_NAME, DATA_SIZE, DATA_CHECKSUM, COLL_NAME, RESC_VAULT_PATH, RESC_LOC",
-        "DATA_ID = '%s'" % data_id,
-        genquery.AS_LIST, callback
+        "DATA_ID, META_DATA_ATTR_VALUE, META_DATA_ATTR_UNITS",
+        "DATA_ID >= '%s' AND DATA_ID <= '%s' AND META_DATA_ATTR_NAME = '%s'"
+        % (first_data_id, last_data_id, constants.UUINTEGRITYLEDGERATTRNAME),
+        genquery.AS_LIST, ctx
     )
 
-    # Loop through all replicas.
-    for row in iter:
-        data_object = DataObject._make([row[0], row[1], row[2],
-                                        row[3], row[4], row[5],
-                                        row[6]])
-
-        # Build file path to data object.
-        coll_name = os.path.join(*(data_object.coll_name.split(os.path.sep)[2:]))
-        file_path = data_object.resc_path + "/" + coll_name + "/" + data_object.name
-
-        # Check integrity on the resource.
-        remote_rule = "checkDataObjectRemote('%s', '%s', '%s')" % \
-                      (file_path.replace("'", "\\'"), data_object.size, data_object.checksum)
-        callback.remoteExec(
-            "%s" % data_object.resc_loc,
-            "",
-            remote_rule,
-            ""
-        )
-
-
-def checkVaultIntegrityBatch(callback, rods_zone, data_id, batch, pause):
-    """Check integrity of one batch of data objects in the vault."""
-    # Go through data in the vault, ordered by DATA_ID.
+    ledger = {}
+    for data_id, value, resc_name in iter:
+        timestamp, status = value.split(' ', 1)
+        ledger[(int(data_id), resc_name)] = (int(timestamp), status)
+
+    return ledger
+
+
+def isDue(entry, modify_time, verified_before):
+    """Determine if a replica is due for verification.
+
+    A replica is due if it was never verified, was modified since it was last
+    verified, was last verified before the given time, or failed its last check.
+
+    :param entry:           Ledger entry (timestamp, status) of the replica, or None
+    :param modify_time:     Modify time of the replica
+    :param verified_before: Replicas verified before this time are due
+
+    :returns: Boolean indicating if the replica must be verified
+    """
+    if entry is None:
+        return True
+
+    timestamp, status = entry
+    return timestamp < verified_before or modify_time > timestamp or status != Status.OK.name
+
+
+@rule.make(inputs=range(5), outputs=[])
+def rule_integrity_check_batch_remote(ctx, resc_loc, first_data_id, last_data_id, verified_before, report_path):
+    """Check integrity of a batch of replicas stored on this resource server.
+
+    All replicas in the given DATA_ID range that are stored on this host and
+    are due according to the verification ledger are verified locally.
+    The ledger is updated and per-object results are appended as JSON lines
+    to the sweep report of this host, because remoteExec does not return
+    output to the caller. Nothing is appended if no replicas were due.
+
+    :param ctx:             Combined type of a callback and rei struct
+    :param resc_loc:        Host name of this resource server
+    :param first_data_id:   First DATA_ID of the batch
+    :param last_data_id:    Last DATA_ID of the batch
+    :param verified_before: Replicas last verified before this timestamp are due
+    :param report_path:     Sweep report data object of this host
+    """
     iter = genquery.row_iterator(
-        "ORDER(DATA_ID)",
-        "DATA_ID >= '%d'" % (data_id),
-        genquery.AS_LIST, callback
+        "DATA_ID, DATA_NAME, DATA_SIZE, DATA_CHECKSUM, COLL_NAME, RESC_VAULT_PATH, RESC_LOC, RESC_NAME, DATA_MODIFY_TIME",
+        "DATA_ID >= '%s' AND DATA_ID <= '%s' AND RESC_LOC = '%s'" % (first_data_id, last_data_id, resc_loc),
+        genquery.AS_LIST, ctx
     )
 
-    # Check each data object in batch.
-    for row in iter:
-        data_id = int(row[0])
-        checkDataObjectIntegrity(callback, data_id)
+    ledger = verificationLedger(ctx, first_data_id, last_data_id)
 
-        # Sleep briefly between checks.
-        time.sleep(pause)
+    # Only verify replicas that are due.
+    replicas = [(DataObject._make(row[:7]), row[7]) for row in iter
+                if isDue(ledger.get((int(row[0]), row[7])), int(row[8]), int(verified_before))]
 
-        # The next data object to check must have a higher DATA_ID.
-        data_id = data_id + 1
-    else:
+    statuses = checkDataObjects([(physicalPath(obj), obj.size, obj.checksum)
+                                 for obj, _ in replicas])
+    now = int(time.time())
+
+    results = []
+    for (obj, resc_name), status in zip(replicas, statuses):
+        path = obj.coll_name + "/" + obj.name
+
+        # Record verification in the ledger.
+        if (int(obj.id), resc_name) in ledger:
+            avu.rmw_from_data(ctx, path, constants.UUINTEGRITYLEDGERATTRNAME, "%", resc_name)
+        avu.add_to_data(ctx, path, constants.UUINTEGRITYLEDGERATTRNAME, "%d %s" % (now, status.name), resc_name)
+
+        results.append(OrderedDict([('data_id',   int(obj.id)),
+                                    ('path',      path),
+                                    ('resource',  resc_name),
+                                    ('size',      int(obj.size)),
+                                    ('status',    status.name)]))
+
+    if results:
+        data_object.append(ctx, report_path, ''.join(jsonutil.dump(result, indent=None) + '\n'
+                                                     for result in results))
+
+
+def integrityCollection(callback, rods_zone):
+    """Get the system collection for integrity check results, creating it if necessary."""
+    integrity_coll = "/" + rods_zone + constants.UUINTEGRITYCOLLECTION
+    if not collection.exists(callback, integrity_coll):
+        collection.create(callback, integrity_coll)
+
+    return integrity_coll
+
+
+def startSweep(callback, rods_zone):
+    """Start a new integrity sweep, with its own report collection.
+
+    :param callback:  Callback to rule Language
+    :param rods_zone: Zone name
+
+    :returns: Report collection of the new sweep
+    """
+    integrity_coll = integrityCollection(callback, rods_zone)
+    sweep_coll = integrity_coll + "/sweep-" + time.strftime("%Y%m%dT%H%M%S")
+    collection.create(callback, sweep_coll)
+    avu.set_on_coll(callback, integrity_coll, constants.UUINTEGRITYSWEEPATTRNAME, sweep_coll)
+
+    return sweep_coll
+
+
+def latestSweep(callback, rods_zone):
+    """Get the report collection of the latest integrity sweep, or None if there is none."""
+    return Query(callback, "META_COLL_ATTR_VALUE",
+                 "COLL_NAME = '%s' AND META_COLL_ATTR_NAME = '%s'"
+                 % ("/" + rods_zone + constants.UUINTEGRITYCOLLECTION, constants.UUINTEGRITYSWEEPATTRNAME)).first()
+
+
+def updateSweepReport(callback, sweep_coll, results):
+    """Add the results of a batch to the summary counts and failures of a sweep.
+
+    :param callback:   Callback to rule Language
+    :param sweep_coll: Report collection of the sweep
+    :param results:    List of per-replica results
+    """
+    counts = dict((status.name, 0) for status in Status)
+    for attr, value in Query(callback, "META_COLL_ATTR_NAME, META_COLL_ATTR_VALUE",
+                             "COLL_NAME = '%s' AND META_COLL_ATTR_NAME like '%s%%'"
+                             % (sweep_coll, constants.UUINTEGRITYCOUNTATTRNAME)):
+        counts[attr[len(constants.UUINTEGRITYCOUNTATTRNAME):]] = int(value)
+
+    changed = set()
+    for result in results:
+        counts[result['status']] += 1
+        changed.add(result['status'])
+
+        if result['status'] != Status.OK.name:
+            avu.add_to_coll(callback, sweep_coll, constants.UUINTEGRITYFAILUREATTRNAME,
+                            jsonutil.dump(result, indent=None))
+
+    for status in changed:
+        avu.set_on_coll(callback, sweep_coll, constants.UUINTEGRITYCOUNTATTRNAME + status, str(counts[status]))
+
+
+def checkDataObjectsIntegrity(callback, sweep_coll, first_data_id, last_data_id, verified_before):
+    """Check integrity of all due replicas in a DATA_ID range, one remote batch per resource server.
+
+    Results are appended to one JSON lines report per resource server in the
+    sweep report collection. The results of this batch are read back from
+    the part of the report that was appended by the batch.
+
+    :param callback:        Callback to rule Language
+    :param sweep_coll:      Report collection of the sweep
+    :param first_data_id:   First DATA_ID of the batch
+    :param last_data_id:    Last DATA_ID of the batch
+    :param verified_before: Replicas last verified before this timestamp are due
+
+    :returns: List of per-replica results
+    """
+    # Group replicas by resource server.
+    hosts = set(Query(callback, "RESC_LOC",
+                      "DATA_ID >= '%d' AND DATA_ID <= '%d'" % (first_data_id, last_data_id)))
+
+    results = []
+    for host in sorted(hosts):
+        report_path = "%s/report-%s.jsonl" % (sweep_coll, host)
+        offset = data_object.size(callback, report_path) or 0
+
+        # Check integrity of the whole batch on the resource server.
+        remote_rule = "rule_integrity_check_batch_remote('%s', '%d', '%d', '%d', '%s')" % \
+                      (host, first_data_id, last_data_id, verified_before, report_path)
+        callback.remoteExec("%s" % host, "", remote_rule, "")
+
+        size = data_object.size(callback, report_path)
+        if size is not None and size > offset:
+            results += [jsonutil.parse(line) for line
+                        in data_object.read(callback, report_path, sz=size, offset=offset).splitlines()]
+
+    updateSweepReport(callback, sweep_coll, results)
+
+    return results
+
+
+def checkVaultIntegrityBatch(callback, rods_zone, sweep_coll, data_id, batch, budget, interval):
+    """Check integrity of one batch of data objects in the vault.
+
+    A batch consists of at most `batch` data objects, starting at DATA_ID
+    `data_id` (keyset pagination on DATA_ID). Only replicas that are due are
+    verified (see isDue). Instead of pausing after every object, the check
+    sleeps after the batch as long as needed to stay within the budget of
+    verified bytes per second.
+
+    After the batch has been checked, the next DATA_ID is recorded on the
+    integrity collection, so that an interrupted check can be resumed.
+
+    :param callback:   Callback to rule Language
+    :param rods_zone:  Zone name
+    :param sweep_coll: Report collection of the sweep
+    :param data_id:    First DATA_ID to check
+    :param batch:      Maximum number of data objects in the batch
+    :param budget:     Maximum number of bytes to verify per second (0 = unlimited)
+    :param interval:   Number of days after which a verified replica is due again
+
+    :returns: Next DATA_ID to check, or 0 if all data objects have been checked
+    """
+    verified_before = int(time.time()) - interval * 24 * 60 * 60
+    start = time.time()
+
+    # Go through data in the vault, ordered by DATA_ID.
+    ids = [int(x) for x in Query(callback, "ORDER(DATA_ID)", "DATA_ID >= '%d'" % data_id, limit=batch)]
+
+    if len(ids) == 0:
         # All done.
         data_id = 0
+    else:
+        results = checkDataObjectsIntegrity(callback, sweep_coll, ids[0], ids[-1], verified_before)
+        verified = sum(result['size'] for result in results)
+        elapsed = time.time() - start
+
+        log.write(callback, "[INTEGRITY] batch %d-%d: %d objects, %d replicas verified, %d bytes in %.1fs (%.1f MiB/s)"
+                            % (ids[0], ids[-1], len(ids), len(results), verified, elapsed,
+                               verified / elapsed / (1024 * 1024) if elapsed > 0 else 0))
+
+        # Throttle to the bytes per second budget.
+        if budget > 0:
+            time.sleep(max(0, float(verified) / budget - elapsed))
+
+        # The next data object to check must have a higher DATA_ID.
+        data_id = ids[-1] + 1
+
+    # Record progress, for resuming an interrupted check.
+    avu.set_on_coll(callback, integrityCollection(callback, rods_zone),
+                    constants.UUINTEGRITYPROGRESSATTRNAME, str(data_id))
 
     return data_id
 
@@ -152,25 +336,69 @@ def checkVaultIntegrityBatch(callback, rods_zone, data_id, batch, pause):
 def rule_integrity_check_vault(rule_args, callback, rei):
     """Check integrity of all data objects in the vault.
 
-    :param rule_args: [0] first DATA_ID to check
+    :param rule_args: [0] first DATA_ID to check, or -1 to resume from the last completed batch
                       [1] batch size, <= 256
-                      [2] pause between checks (float)
+                      [2] maximum number of bytes to verify per second (0 = unlimited)
                       [3] delay between batches in seconds
+                      [4] number of days after which a verified replica is due again
     :param callback:  Callback to rule Language
     :param rei:       The rei struct
     """
     data_id = int(rule_args[0])
     batch = int(rule_args[1])
-    pause = float(rule_args[2])
+    budget = int(rule_args[2])
     delay = int(rule_args[3])
+    interval = int(rule_args[4])
     rods_zone = session_vars.get_map(rei)["client_user"]["irods_zone"]
 
+    if data_id < 0:
+        # Resume after the last completed batch.
+        progress = Query(callback, "META_COLL_ATTR_VALUE",
+                         "COLL_NAME = '%s' AND META_COLL_ATTR_NAME = '%s'"
+                         % (integrityCollection(callback, rods_zone), constants.UUINTEGRITYPROGRESSATTRNAME)).first()
+        data_id = 0 if progress is None else int(progress)
+
+    # A check starting at the first DATA_ID is a new sweep.
+    sweep_coll = latestSweep(callback, rods_zone)
+    if data_id == 0 or sweep_coll is None:
+        sweep_coll = startSweep(callback, rods_zone)
+
     # Check one batch of vault data.
-    data_id = checkVaultIntegrityBatch(callback, rods_zone, data_id, batch, pause)
+    data_id = checkVaultIntegrityBatch(callback, rods_zone, sweep_coll, data_id, batch, budget, interval)
 
     if data_id != 0:
         # Check the next batch after a delay.
         callback.delayExec(
             "<PLUSET>%ds</PLUSET>" % delay,
-            "rule_integrity_check_vault('%d', '%d', '%f', '%d')" % (data_id, batch, pause, delay),
+            "rule_integrity_check_vault('%d', '%d', '%d', '%d', '%d')" % (data_id, batch, budget, delay, interval),
             "")
+
+
+@api.make()
+def api_integrity_report(ctx):
+    """Get summary counts and failures of the latest integrity sweep.
+
+    :param ctx: Combined type of a callback and rei struct
+
+    :returns: Dict with sweep report collection, counts per status and list of failures
+    """
+    if user.user_type(ctx) != 'rodsadmin':
+        return api.Error('not_allowed', 'Insufficient permissions')
+
+    sweep_coll = latestSweep(ctx, user.zone(ctx))
+    if sweep_coll is None:
+        return api.Error('not_exists', 'No integrity sweep has been run yet')
+
+    counts = OrderedDict((status.name, 0) for status in Status)
+    failures = []
+    for attr, value in Query(ctx, "META_COLL_ATTR_NAME, META_COLL_ATTR_VALUE",
+                             "COLL_NAME = '%s' AND META_COLL_ATTR_NAME like '%s%%'"
+                             % (sweep_coll, constants.UUORGMETADATAPREFIX + 'integrity_')):
+        if attr == constants.UUINTEGRITYFAILUREATTRNAME:
+            failures.append(jsonutil.parse(value))
+        elif attr.startswith(constants.UUINTEGRITYCOUNTATTRNAME):
+            counts[attr[len(constants.UUINTEGRITYCOUNTATTRNAME):]] = int(value)
+
+    return OrderedDict([('sweep',    sweep_coll),
+                        ('counts',   counts),
+                        ('failures', sorted(failures, key=lambda x: (x['data_id'], x['resource'])))])
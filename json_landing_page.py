@@ -10,6 +10,15 @@ from util import *
 
 __all__ = ['rule_json_landing_page_create_json_landing_page']
 
+# Enable autoescaping for all templates.
+# NOTE: autoescape is no longer an extension starting in jinja 2.9 (2017).
+environment = jinja2.Environment(autoescape=True,
+                                 extensions=['jinja2.ext.autoescape'])
+
+# Compiled landing page templates, keyed by template path.
+# Values are (modify time, template) tuples.
+_template_cache = {}
+
 
 def rule_json_landing_page_create_json_landing_page(rule_args, callback, rei):
     """ Get the landing page of published YoDa metadata as a string.
@@ -25,6 +34,37 @@ def rule_json_landing_page_create_json_landing_page(rule_args, callback, rei):
     rule_args[3] = json_landing_page_create_json_landing_page(callback, rodsZone, template_name, combiJsonPath)
 
 
+def get_template(callback, path):
+    """Get a compiled Jinja template from iRODS.
+
+    Compiled templates are cached for the lifetime of the agent, and are
+    only read and compiled again when the template data object was modified.
+
+    :param callback: Callback to rule Language
+    :param path:     Path of template data object
+
+    :return: Compiled Jinja template
+    """
+    modify_time = None
+    iter = genquery.row_iterator(
+        "DATA_MODIFY_TIME",
+        "COLL_NAME = '%s' AND DATA_NAME = '%s'" % pathutil.chop(path),
+        genquery.AS_LIST, callback
+    )
+    for row in iter:
+        modify_time = row[0]
+
+    if path in _template_cache and modify_time is not None:
+        cached_modify_time, template = _template_cache[path]
+        if cached_modify_time == modify_time:
+            return template
+
+    template = environment.from_string(data_object.read(callback, path))
+    _template_cache[path] = (modify_time, template)
+
+    return template
+
+
 def json_landing_page_create_json_landing_page(callback, rodsZone, template_name, combiJsonPath):
     """Get the landing page of published YoDa metadata as a string.
 
@@ -43,18 +83,12 @@ def json_landing_page_create_json_landing_page(callback, rodsZone, template_name
 
     # Load the Jinja template.
     landingpage_template_path = '/' + rodsZone + '/yoda/templates/' + template_name
-    template = data_object.read(callback, landingpage_template_path)
-
-    # Enable autoescaping for all templates.
-    # NOTE: autoescape is no longer an extension starting in jinja 2.9 (2017).
-    Template = jinja2.Environment(autoescape=True,
-                                  extensions=['jinja2.ext.autoescape']).from_string
+    tm = get_template(callback, landingpage_template_path)
 
     # Pre work input for render process.
     # When empty landing page, take a short cut
     if template_name == 'emptylandingpage.html.j2':
         persistent_identifier_datapackage = dictJsonData['System']['Persistent_Identifier_Datapackage']
-        tm = Template(template)
         landing_page = tm.render(persistent_identifier_datapackage=persistent_identifier_datapackage)
         return landing_page
 
@@ -187,7 +221,6 @@ def json_landing_page_create_json_landing_page(callback, rodsZone, template_name
     except KeyError:
         collection_name = ''
 
-    tm = Template(template)
     landing_page = tm.render(
         title=title,
         description=description,
@@ -7,20 +7,38 @@ __license__   = 'GPLv3, see LICENSE'
 import email
 import re
 import smtplib
+import time
+import uuid
 from email.mime.text import MIMEText
 
 from util import *
+from util.query import Query
 
 __all__ = ['rule_mail_new_package_published',
            'rule_mail_your_package_published',
-           'rule_mail_test']
+           'rule_mail_test',
+           'rule_mail_process_queue']
+
+
+MAIL_RETRIES = 5
+"""Number of times delivery of a queued e-mail is retried before it is dropped."""
+
+MAIL_BACKOFF = 60
+"""Delay in seconds before the first retry of a queued e-mail, doubled after every attempt."""
+
+MAIL_CLAIM_TIMEOUT = 3600
+"""Time in seconds after which mails claimed by a queue worker that did not finish are claimed again."""
+
+MAIL_QUEUE_ENTRY = re.compile(r'^((\d+)-([-0-9a-f]+)\.json)(?:\.(\d+)\.claimed)?$')
+"""Name of a queued mail: unclaimed name (time before which it is not delivered and mail id), and time it was claimed (if claimed)."""
 
 
 def send(ctx, to, actor, subject, body):
-    """Send an e-mail with specified recipient, subject and body.
+    """Queue an e-mail with specified recipient, subject and body.
 
-    The originating address and mail server credentials are taken from the
-    ruleset configuration file.
+    Mails are stored in the mail queue collection and delivered by a
+    delayed queue worker (see rule_mail_process_queue), so that callers do
+    not wait for the mail server.
 
     :param ctx:     Combined type of a callback and rei struct
     :param to:      Recipient of them mail
@@ -41,8 +59,204 @@ def send(ctx, to, actor, subject, body):
         log.write(ctx, '[EMAIL] Ignoring invalid destination <{}>'.format(to))
         return  # Silently ignore obviously invalid destinations (mimic old behavior).
 
-    log.write(ctx, '[EMAIL] Sending mail for <{}> to <{}>, subject <{}>'.format(actor, to, subject))
+    log.write(ctx, '[EMAIL] Queueing mail for <{}> to <{}>, subject <{}>'.format(actor, to, subject))
+
+    queue = '/' + user.zone(ctx) + constants.UUMAILQUEUECOLLECTION
+
+    try:
+        if not collection.exists(ctx, queue):
+            collection.create(ctx, queue)
+
+        jsonutil.write(ctx, '{}/{}-{}.json'.format(queue, int(time.time()), uuid.uuid4()),
+                       {'to': to, 'actor': actor, 'subject': subject, 'body': body, 'attempts': 0})
+
+        schedule_queue_worker(ctx, queue, 1)
+
+    except msi.Error as e:
+        log.write(ctx, '[EMAIL] Could not queue mail: {}'.format(e))
+        return api.Error('internal', 'Could not queue mail')
+
+
+def schedule_queue_worker(ctx, queue, delay):
+    """Schedule a mail queue worker, unless one is scheduled already.
+
+    A scheduled worker is marked by a data object in the queue collection,
+    which the worker removes once it has processed the queue.  Creating a
+    data object fails if it exists already, so of concurrent callers only
+    one schedules a worker.  The marker of a worker that did not finish is
+    replaced after MAIL_CLAIM_TIMEOUT.
+
+    :param ctx:   Combined type of a callback and rei struct
+    :param queue: Mail queue collection
+    :param delay: Delay in seconds
+    """
+    marker = queue + '/' + constants.UUMAILQUEUESCHEDULEDNAME
+
+    for attempt in range(2):
+        try:
+            ret = msi.data_obj_create(ctx, marker, '', 0)
+        except msi.Error:
+            if attempt == 0 and remove_stale_marker(ctx, marker):
+                continue
+            return
+
+        handle = ret['arguments'][2]
+        msi.data_obj_write(ctx, handle, str(int(time.time()) + delay), 0)
+        msi.data_obj_close(ctx, handle, 0)
+
+        ctx.delayExec("<PLUSET>%ds</PLUSET>" % delay, "rule_mail_process_queue()", "")
+        return
+
+
+def remove_stale_marker(ctx, marker):
+    """Remove the marker of a scheduled queue worker if that worker did not finish in time.
+
+    :param ctx:    Combined type of a callback and rei struct
+    :param marker: Path of the worker marker
+
+    :returns: Whether there is no marker anymore
+    """
+    try:
+        scheduled = data_object.read(ctx, marker)
+    except error.UUFileNotExistError:
+        return True
+
+    # The marker is empty until its creator has written the scheduled time.
+    # If the creator did not finish, the marker ages from its creation.
+    if scheduled == '':
+        scheduled = Query(ctx, "DATA_MODIFY_TIME",
+                          "COLL_NAME = '%s' AND DATA_NAME = '%s'" % pathutil.chop(marker)).first()
+        if scheduled is None:
+            return True
+
+    if int(scheduled) + MAIL_CLAIM_TIMEOUT > time.time():
+        return False
+
+    # Rename before removing, so that only one caller replaces the marker.
+    stale = '{}.{}'.format(marker, uuid.uuid4())
+    try:
+        data_object.rename(ctx, marker, stale)
+    except msi.Error:
+        return False
+
+    log.write(ctx, '[EMAIL] Replacing marker of queue worker scheduled at {}'.format(scheduled))
+    data_object.remove(ctx, stale)
+    return True
+
+
+def queued_mails(ctx, queue):
+    """List the mails in the mail queue.
+
+    :param ctx:   Combined type of a callback and rei struct
+    :param queue: Mail queue collection
+
+    :returns: List of (data object name, unclaimed name, mail id, time at which the mail is due, whether it is claimed)
+    """
+    mails = []
+    for name in Query(ctx, "ORDER(DATA_NAME)", "COLL_NAME = '" + queue + "'"):
+        match = MAIL_QUEUE_ENTRY.match(name)
+        if match is None:
+            continue  # e.g. the worker marker
+
+        unclaimed, not_before, mail_id, claimed = match.groups()
+        if claimed is None:
+            mails.append((name, unclaimed, mail_id, int(not_before), False))
+        else:
+            mails.append((name, unclaimed, mail_id, int(claimed) + MAIL_CLAIM_TIMEOUT, True))
+
+    return mails
 
+
+@rule.make()
+def rule_mail_process_queue(ctx):
+    """Deliver all queued e-mails that are due over a single mail server connection.
+
+    Each mail is claimed by renaming it before it is delivered, so that no
+    other worker delivers it too.  Mails that could not be delivered are
+    released with a later due time and retried with exponential backoff, at
+    most MAIL_RETRIES times.  Mails that stay claimed because their worker did
+    not finish are claimed again after MAIL_CLAIM_TIMEOUT.
+
+    The worker marker is removed only after the queue has been processed, so
+    mails queued in the meantime are picked up by a rescheduled worker.
+
+    :param ctx: Combined type of a callback and rei struct
+    """
+    if not user.is_admin(ctx):
+        return
+
+    queue = '/' + user.zone(ctx) + constants.UUMAILQUEUECOLLECTION
+    if not collection.exists(ctx, queue):
+        return
+
+    now = int(time.time())
+
+    due = []
+    for name, unclaimed, mail_id, due_time, claimed in queued_mails(ctx, queue):
+        if due_time > now:
+            continue
+
+        if claimed:
+            log.write(ctx, '[EMAIL] Claiming mail <{}> of queue worker that did not finish'.format(name))
+
+        # Claimed names keep the unclaimed name, so that they are listed as queued mails.
+        path = '{}/{}.{}.claimed'.format(queue, unclaimed, now)
+        try:
+            data_object.rename(ctx, '{}/{}'.format(queue, name), path)
+        except msi.Error:
+            continue  # Claimed by another worker.
+
+        try:
+            mail = jsonutil.read(ctx, path)
+        except Exception as e:
+            log.write(ctx, '[EMAIL] Dropping unreadable queued mail <{}>: {}'.format(path, e))
+            data_object.remove(ctx, path)
+            continue
+
+        due.append((path, mail_id, mail))
+
+    results = deliver(ctx, [queued for _, _, queued in due]) if due else []
+
+    for (path, mail_id, mail), result in zip(due, results):
+        if result is None:
+            data_object.remove(ctx, path)
+            continue
+
+        mail['attempts'] += 1
+        if mail['attempts'] > MAIL_RETRIES:
+            log.write(ctx, '[EMAIL] Giving up on mail to <{}>, subject <{}>'.format(mail['to'], mail['subject']))
+            data_object.remove(ctx, path)
+            continue
+
+        # Release the mail for a later attempt.
+        jsonutil.write(ctx, path, mail)
+        data_object.rename(ctx, path, '{}/{}-{}.json'.format(queue,
+                                                             now + MAIL_BACKOFF * 2 ** (mail['attempts'] - 1),
+                                                             mail_id))
+
+    # Mails queued from now on schedule a new worker.  Mails queued while
+    # this worker ran, retries and unfinished claims are scheduled here.
+    try:
+        data_object.remove(ctx, queue + '/' + constants.UUMAILQUEUESCHEDULEDNAME)
+    except msi.Error:
+        pass  # Worker was not scheduled through the queue, e.g. run by hand.
+
+    pending = [due_time for _, _, _, due_time, _ in queued_mails(ctx, queue)]
+    if pending:
+        schedule_queue_worker(ctx, queue, max(min(pending) - int(time.time()), 1))
+
+
+def deliver(ctx, mails):
+    """Deliver e-mails over a single mail server connection.
+
+    The originating address and mail server credentials are taken from the
+    ruleset configuration file.
+
+    :param ctx:   Combined type of a callback and rei struct
+    :param mails: List of dicts with recipient ('to'), 'actor', 'subject' and 'body' of mails
+
+    :returns: List with for every mail None if it was sent, or an api.Error
+    """
     cfg = {k: getattr(config, v)
            for k, v in [('from',      'notifications_sender_email'),
                         ('from_name', 'notifications_sender_name'),
@@ -62,46 +276,73 @@ def send(ctx, to, actor, subject, body):
 
     except Exception as e:
         log.write(ctx, '[EMAIL] Configuration error: ' + str(e))
-        return api.Error('internal', 'Mail configuration error')
+        return [api.Error('internal', 'Mail configuration error')] * len(mails)
 
-    try:
-        smtp = (smtplib.SMTP_SSL if proto == 'smtps' else smtplib.SMTP)(host, port)
+    def connect():
+        try:
+            smtp = (smtplib.SMTP_SSL if proto == 'smtps' else smtplib.SMTP)(host, port)
 
-        if proto != 'smtps':
-            # Enforce TLS.
-            smtp.starttls()
+            if proto != 'smtps':
+                # Enforce TLS.
+                smtp.starttls()
 
-    except Exception as e:
-        log.write(ctx, '[EMAIL] Could not connect to mail server at {}://{}:{}: {}'.format(proto, host, port, e))
-        return api.Error('internal', 'Mail configuration error')
+        except Exception as e:
+            log.write(ctx, '[EMAIL] Could not connect to mail server at {}://{}:{}: {}'.format(proto, host, port, e))
+            return api.Error('internal', 'Mail configuration error')
 
-    try:
-        smtp.login(cfg['username'], cfg['password'])
+        try:
+            smtp.login(cfg['username'], cfg['password'])
 
-    except Exception as e:
-        log.write(ctx, '[EMAIL] Could not login to mail server with configured credentials')
-        return api.Error('internal', 'Mail configuration error')
+        except Exception as e:
+            log.write(ctx, '[EMAIL] Could not login to mail server with configured credentials')
+            return api.Error('internal', 'Mail configuration error')
 
-    fmt_addr = '{} <{}>'.format
+        return smtp
 
-    msg = MIMEText(body)
-    msg['Reply-To'] = cfg['reply_to']
-    msg['Date'] = email.utils.formatdate()
-    msg['From'] = fmt_addr(cfg['from_name'], cfg['from'])
-    msg['To'] = to
-    msg['Subject'] = subject
+    fmt_addr = '{} <{}>'.format
 
-    try:
-        smtp.sendmail(cfg['from'], [to], msg.as_string())
-    except Exception as e:
-        log.write(ctx, '[EMAIL] Could not send mail: {}'.format(e))
-        return api.Error('internal', 'Mail configuration error')
+    smtp = None
+    results = []
+
+    for mail in mails:
+        log.write(ctx, '[EMAIL] Sending mail for <{}> to <{}>, subject <{}>'.format(mail['actor'], mail['to'], mail['subject']))
+
+        msg = MIMEText(mail['body'])
+        msg['Reply-To'] = cfg['reply_to']
+        msg['Date'] = email.utils.formatdate()
+        msg['From'] = fmt_addr(cfg['from_name'], cfg['from'])
+        msg['To'] = mail['to']
+        msg['Subject'] = mail['subject']
+
+        # Reconnect once if the server closed the connection in the meantime.
+        for attempt in range(2):
+            if smtp is None:
+                smtp = connect()
+                if type(smtp) is api.Error:
+                    # No use in trying the remaining mails.
+                    return results + [smtp] * (len(mails) - len(results))
+            try:
+                smtp.sendmail(cfg['from'], [mail['to']], msg.as_string())
+                results.append(None)
+                break
+            except smtplib.SMTPServerDisconnected as e:
+                smtp = None
+                if attempt == 1:
+                    log.write(ctx, '[EMAIL] Could not send mail: {}'.format(e))
+                    results.append(api.Error('internal', 'Mail configuration error'))
+            except Exception as e:
+                log.write(ctx, '[EMAIL] Could not send mail: {}'.format(e))
+                results.append(api.Error('internal', 'Mail configuration error'))
+                break
 
     try:
-        smtp.quit()
+        if smtp is not None:
+            smtp.quit()
     except Exception as e:
         pass
 
+    return results
+
 
 def _wrapper(ctx, to, actor, subject, body):
     """Send mail, returns status/statusinfo in rule-language style."""
@@ -173,13 +414,20 @@ Yoda system
 
 @rule.make(inputs=range(1), outputs=range(1, 3))
 def rule_mail_test(ctx, to):
-    return _wrapper(ctx,
-                    to=to,
-                    actor='None',
-                    subject='[Yoda] Test mail',
-                    body="""
+    # Test mails are not queued, so that mail server errors are reported directly.
+    if not user.is_admin(ctx):
+        return '1', 'Only rodsadmin can send mail'
+
+    x, = deliver(ctx, [{'to':      to,
+                        'actor':   'None',
+                        'subject': '[Yoda] Test mail',
+                        'body':    """
 Congratulations, you have sent a test mail from your Yoda system.
 
 Best regards,
 Yoda system
-""")
+"""}])
+
+    if type(x) is api.Error:
+        return '1', x.info
+    return '0', ''
@@ -14,6 +14,8 @@ import policies_datapackage_status
 import policies_datarequest_status
 import policies_folder_status
 import policies_intake
+import publication_config
+import storage_ledger
 from util import *
 
 
@@ -30,12 +32,12 @@ from util import *
 # Separate from ACLs, we deny certain operations on collections and data in
 # research folders when paths are locked.
 
-def can_coll_create(ctx, actor, coll):
+def can_coll_create(ctx, actor, coll, op=None):
     """Disallow creating collections in locked folders."""
     log.debug(ctx, 'check coll create <{}>'.format(coll))
 
     if pathutil.info(coll).space is pathutil.Space.RESEARCH:
-        if folder.is_locked(ctx, pathutil.dirname(coll)) and not user.is_admin(ctx, actor):
+        if folder.is_locked(ctx, pathutil.dirname(coll), op=op) and not user.is_admin(ctx, actor):
             return policy.fail('Parent folder is locked')
 
     if pathutil.info(coll).space is pathutil.Space.INTAKE:
@@ -63,22 +65,22 @@ def can_coll_delete(ctx, actor, coll):
     return policy.succeed()
 
 
-def can_coll_move(ctx, actor, src, dst):
+def can_coll_move(ctx, actor, src, dst, op=None):
     log.debug(ctx, 'check coll move <{}> -> <{}>'.format(src, dst))
 
     return policy.all(can_coll_delete(ctx, actor, src),
-                      can_coll_create(ctx, actor, dst))
+                      can_coll_create(ctx, actor, dst, op=op))
 
 
-def can_data_create(ctx, actor, path):
+def can_data_create(ctx, actor, path, op=None):
     log.debug(ctx, 'check data create <{}>'.format(path))
 
     if pathutil.info(path).space is pathutil.Space.RESEARCH:
-        if folder.is_locked(ctx, pathutil.dirname(path)):
+        if folder.is_locked(ctx, pathutil.dirname(path), op=op):
             # Parent coll locked?
             if not user.is_admin(ctx, actor):
                 return policy.fail('Folder is locked')
-        elif folder.is_data_locked(ctx, path):
+        elif folder.is_data_locked(ctx, path, op=op):
             # If the parent coll is not locked, there might still be a lock on
             # an existing destination data object (though this situation cannot
             # arise through portal actions).
@@ -108,12 +110,12 @@ def can_data_write(ctx, actor, path):
     return policy.succeed()
 
 
-def can_data_delete(ctx, actor, path):
+def can_data_delete(ctx, actor, path, op=None):
     if re.match(r'^/[^/]+/home/[^/]+$', path) and not user.is_admin(ctx, actor):
         return policy.fail('Cannot delete or move data directly under /home')
 
     if pathutil.info(path).space is pathutil.Space.RESEARCH:
-        if folder.is_data_locked(ctx, path) and not user.is_admin(ctx, actor):
+        if folder.is_data_locked(ctx, path, op=op) and not user.is_admin(ctx, actor):
             return policy.fail('Folder is locked')
 
     if pathutil.info(path).space is pathutil.Space.INTAKE:
@@ -123,15 +125,15 @@ def can_data_delete(ctx, actor, path):
     return policy.succeed()
 
 
-def can_data_copy(ctx, actor, src, dst):
+def can_data_copy(ctx, actor, src, dst, op=None):
     log.debug(ctx, 'check data copy <{}> -> <{}>'.format(src, dst))
-    return can_data_create(ctx, actor, dst)
+    return can_data_create(ctx, actor, dst, op=op)
 
 
-def can_data_move(ctx, actor, src, dst):
+def can_data_move(ctx, actor, src, dst, op=None):
     log.debug(ctx, 'check data move <{}> -> <{}>'.format(src, dst))
-    return policy.all(can_data_delete(ctx, actor, src),
-                      can_data_create(ctx, actor, dst))
+    return policy.all(can_data_delete(ctx, actor, src, op=op),
+                      can_data_create(ctx, actor, dst, op=op))
 
 
 # }}}
@@ -146,13 +148,17 @@ def can_data_move(ctx, actor, src, dst):
 #
 # The actual static PEPs are currently in the rule language part of the ruleset.
 # Most of them 'cut' and call identically named Python functions in this file.
+#
+# PEPs triggered by a research API call (see research.py) reuse the state of
+# its folder.Operation, which they pass on to the check functions.
 
 @policy.require()
 def py_acPreprocForCollCreate(ctx):
     log._debug(ctx, 'py_acPreprocForCollCreate')
     # print(jsonutil.dump(session_vars.get_map(ctx.rei)))
     return can_coll_create(ctx, user.user_and_zone(ctx),
-                           str(session_vars.get_map(ctx.rei)['collection']['name']))
+                           str(session_vars.get_map(ctx.rei)['collection']['name']),
+                           op=folder.running_operation(ctx))
 
 
 @policy.require()
@@ -180,7 +186,8 @@ def py_acDataDeletePolicy(ctx):
     log._debug(ctx, 'py_acDataDeletePolicy')
     return (policy.succeed()
             if can_data_delete(ctx, user.user_and_zone(ctx),
-                               str(session_vars.get_map(ctx.rei)['data_object']['object_path']))
+                               str(session_vars.get_map(ctx.rei)['data_object']['object_path']),
+                               op=folder.running_operation(ctx))
             else ctx.msiDeleteDisallowed())
 
 
@@ -192,10 +199,12 @@ def py_acPreProcForObjRename(ctx, src, dst):
     RENAME_DATA_OBJ = 11
     RENAME_COLL     = 12
 
+    op = folder.running_operation(ctx)
+
     if session_vars.get_map(ctx.rei)['operation_type'] == RENAME_DATA_OBJ:
-        return can_data_move(ctx, user.user_and_zone(ctx), src, dst)
+        return can_data_move(ctx, user.user_and_zone(ctx), src, dst, op=op)
     elif session_vars.get_map(ctx.rei)['operation_type'] == RENAME_COLL:
-        return can_coll_move(ctx, user.user_and_zone(ctx), src, dst)
+        return can_coll_move(ctx, user.user_and_zone(ctx), src, dst, op=op)
 
     # if ($objPath like regex "/[^/]+/home/" ++ IIGROUPPREFIX ++ ".[^/]*/.*") {
 
@@ -220,7 +229,7 @@ def py_acPostProcForCopy(ctx):
     log._debug(ctx, 'py_acPostProcForCopy')
 
     path = str(session_vars.get_map(ctx.rei)['data_object']['object_path'])
-    x = can_data_create(ctx, user.user_and_zone(ctx), path)
+    x = can_data_create(ctx, user.user_and_zone(ctx), path, op=folder.running_operation(ctx))
 
     if not x:
         data_object.remove(ctx, path)
@@ -448,6 +457,10 @@ def py_acPostProcForModifyAVUMetadata(ctx, option, obj_type, obj_name, attr, val
     elif attr == datarequest.DATAREQUESTSTATUSATTRNAME and info.space is pathutil.Space.DATAREQUEST:
         policies_datarequest_status.post_status_transition(ctx, obj_name, value)
 
+    # Drop cached publication configuration when the system collection is modified.
+    elif obj_type == '-C' and obj_name == '/' + info.zone + constants.UUSYSTEMCOLLECTION:
+        publication_config.invalidate_publication_config(info.zone)
+
 
 # }}}
 # ExecCmd {{{
@@ -481,6 +494,9 @@ def py_acPreProcForExecCmd(ctx, cmd, args, addr, hint):
 
 @rule.make()
 def pep_resource_modified_post(ctx, instance_name, _ctx, out):
+    # Record change of storage in the storage ledger.
+    storage_ledger.mark_storage_modified(ctx, _ctx.map()['logical_path'])
+
     if instance_name not in config.resource_primary or not config.resource_replica:
         return
 
@@ -525,5 +541,16 @@ def py_acPostProcForObjRename(ctx, src, dst):
         if len(info.subpath) and info.group != pathutil.info(src).group:
             ctx.uuEnforceGroupAcl(dst)
 
+    # Record storage moved between groups in the storage ledger.
+    if info.group != pathutil.info(src).group:
+        storage_ledger.mark_storage_modified(ctx, src)
+        storage_ledger.mark_storage_modified(ctx, dst)
+
+
+@rule.make()
+def py_acPostProcForDelete(ctx):
+    # Record removal of data in the storage ledger.
+    storage_ledger.mark_storage_modified(ctx, str(session_vars.get_map(ctx.rei)['data_object']['object_path']))
+
 # }}}
 # }}}
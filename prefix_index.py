@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Sorted in-memory index for prefix and substring search.
+
+This module has no iRODS dependencies, so that it can be used (and
+benchmarked) outside of the rule engine as well.
+"""
+
+__copyright__ = 'Copyright (c) 2021, Utrecht University'
+__license__   = 'GPLv3, see LICENSE'
+
+import bisect
+import itertools
+
+
+class PrefixIndex(object):
+    """Sorted list of strings, searchable by prefix with bisect."""
+
+    def __init__(self, items):
+        """Build an index.
+
+        :param items: Iterable of strings to index
+        """
+        self.items = sorted(set(items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def prefix(self, prefix):
+        """Iterate over indexed strings starting with a prefix, in sorted order.
+
+        :param prefix: Prefix to search for
+
+        :returns: Iterator over matching strings
+        """
+        start = bisect.bisect_left(self.items, prefix)
+        return itertools.takewhile(lambda item: item.startswith(prefix),
+                                   itertools.islice(self.items, start, None))
+
+    def search(self, prefix, match=None, limit=None, substring=False):
+        """Search indexed strings.
+
+        Strings starting with the prefix are found with bisect. Only when
+        substring is set, and that yields fewer than `limit` results, are
+        strings containing the prefix elsewhere returned as well. That
+        requires a scan of all indexed strings.
+
+        :param prefix:    String to search for
+        :param match:     Additional predicate results must satisfy
+        :param limit:     Maximum number of results
+        :param substring: Also return strings that contain the prefix elsewhere
+
+        :returns: List of matching strings
+        """
+        if match is None:
+            def match(item):
+                return True
+
+        results = list(itertools.islice((item for item in self.prefix(prefix) if match(item)), limit))
+
+        if substring and (limit is None or len(results) < limit):
+            # Fall back to substring matches.
+            matches = (item for item in self.items
+                       if prefix in item and not item.startswith(prefix) and match(item))
+            results += itertools.islice(matches, None if limit is None else limit - len(results))
+
+        return results
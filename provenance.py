@@ -8,6 +8,7 @@ import json
 import time
 
 from util import *
+from util.query import Query
 
 __all__ = ['rule_provenance_log_action',
            'rule_copy_provenance_log',
@@ -23,12 +24,21 @@ def rule_provenance_log_action(ctx, actor, coll, action):
     :param coll:   The collection the provenance log is linked to.
     :param action: The action that is logged.
     """
-    try:
-        log_item = [str(int(time.time())), action, actor]
-        avu.associate_to_coll(ctx, coll, constants.UUPROVENANCELOG, json.dumps(log_item))
-        log.write(ctx, "rule_provenance_log_action: <{}> has <{}> (<{}>)".format(actor, action, coll))
-    except Exception:
-        log.write(ctx, "rule_provenance_log_action: failed to log action <{}> to provenance".format(action))
+    log_action(ctx, actor, coll, action)
+
+
+def sort_key(timestamp):
+    """Return the sortable key of a provenance log record, stored as AVU unit.
+
+    The key is a fixed width timestamp with microsecond precision, so that
+    ordering on the unit orders records chronologically. Records logged
+    before keys were introduced have an empty unit and sort as oldest.
+
+    :param timestamp: Time of the action, in seconds since the epoch
+
+    :returns: Sortable key of the record
+    """
+    return '{:017.6f}'.format(timestamp)
 
 
 def log_action(ctx, actor, coll, action):
@@ -40,8 +50,9 @@ def log_action(ctx, actor, coll, action):
     :param action: The action that is logged.
     """
     try:
-        log_item = [str(int(time.time())), action, actor]
-        avu.associate_to_coll(ctx, coll, constants.UUPROVENANCELOG, json.dumps(log_item))
+        now = time.time()
+        log_item = [str(int(now)), action, actor]
+        avu.add_to_coll(ctx, coll, constants.UUPROVENANCELOG, json.dumps(log_item), sort_key(now))
         log.write(ctx, "rule_provenance_log_action: <{}> has <{}> (<{}>)".format(actor, action, coll))
     except Exception:
         log.write(ctx, "rule_provenance_log_action: failed to log action <{}> to provenance".format(action))
@@ -67,55 +78,55 @@ def provenance_copy_log(ctx, source, target):
     """
     try:
         # Retrieve all provenance logs on source collection.
-        iter = genquery.row_iterator(
-            "order_desc(META_COLL_ATTR_VALUE)",
-            "COLL_NAME = '%s' AND META_COLL_ATTR_NAME = 'org_action_log'" % (source),
-            genquery.AS_LIST, ctx
-        )
+        avus = [(constants.UUPROVENANCELOG, value, unit) for value, unit
+                in Query(ctx, "META_COLL_ATTR_VALUE, META_COLL_ATTR_UNITS",
+                         "COLL_NAME = '{}' AND META_COLL_ATTR_NAME = '{}'".format(source, constants.UUPROVENANCELOG))]
 
         # Set provenance logs on target collection.
-        for row in iter:
-            avu.associate_to_coll(ctx, target, constants.UUPROVENANCELOG, row[0])
+        if len(avus) > 0:
+            try:
+                avu.add_all_to_coll(ctx, target, avus)
+            except msi.Error:
+                # Fall back to one AVU at a time on iRODS < 4.2.8.
+                for a, v, u in avus:
+                    avu.add_to_coll(ctx, target, a, v, u)
 
         log.write(ctx, "rule_copy_provenance_log: copied provenance log from <{}> to <{}>".format(source, target))
     except Exception:
         log.write(ctx, "rule_copy_provenance_log: failed to copy provenance log from <{}> to <{}>".format(source, target))
 
 
-def get_provenance_log(ctx, coll):
-    """Return provenance log of a collection.
+def get_provenance_log(ctx, coll, offset=0, limit=None):
+    """Return provenance log of a collection, newest records first.
 
-    :param ctx:  Combined type of a callback and rei struct
-    :param coll: Path of a collection in research or vault space.
+    :param ctx:    Combined type of a callback and rei struct
+    :param coll:   Path of a collection in research or vault space.
+    :param offset: Number of newest records to skip
+    :param limit:  Maximum number of records to return (all if None)
 
     :returns: Provenance log as a list
     """
-    provenance_log = []
+    # Order on the sortable key first, then on the record itself for
+    # records without a key (the record starts with its timestamp).
+    iter = Query(ctx, "order_desc(META_COLL_ATTR_UNITS), order_desc(META_COLL_ATTR_VALUE)",
+                 "COLL_NAME = '{}' AND META_COLL_ATTR_NAME = '{}'".format(coll, constants.UUPROVENANCELOG),
+                 offset=offset, limit=limit)
 
-    # Retrieve all provenance logs on a folder.
-    iter = genquery.row_iterator(
-        "order_desc(META_COLL_ATTR_VALUE)",
-        "COLL_NAME = '%s' AND META_COLL_ATTR_NAME = 'org_action_log'" % (coll),
-        genquery.AS_LIST, ctx
-    )
-
-    for row in iter:
-        log_item = jsonutil.parse(row[0])
-        provenance_log.append(log_item)
-
-    return provenance_log
+    return [jsonutil.parse(value) for _, value in iter]
 
 
 @api.make()
-def api_provenance_log(ctx, coll):
+def api_provenance_log(ctx, coll, offset=0, limit=None):
     """Return formatted provenance log of a collection.
 
-    :param ctx:  Combined type of a callback and rei struct
-    :param coll: Path of a collection in research or vault space.
+    :param ctx:    Combined type of a callback and rei struct
+    :param coll:   Path of a collection in research or vault space.
+    :param offset: Number of newest records to skip
+    :param limit:  Maximum number of records to return (all if None)
 
     :returns: Formatted provenance log as a list
     """
-    provenance_log = get_provenance_log(ctx, coll)
+    provenance_log = get_provenance_log(ctx, coll, offset, limit)
     output = []
 
     for item in provenance_log:
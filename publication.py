@@ -4,6 +4,9 @@
 __copyright__ = 'Copyright (c) 2019-2020, Utrecht University'
 __license__   = 'GPLv3, see LICENSE'
 
+import time
+from multiprocessing.pool import ThreadPool
+
 import datacite
 import json_datacite41
 import json_landing_page
@@ -11,57 +14,15 @@ import mail
 import meta
 import provenance
 import vault
+from publication_config import get_publication_config
 from util import *
+from util.query import Query
 
 __all__ = ['rule_process_publication',
            'rule_process_depublication',
            'rule_process_republication',
-           'rule_update_publication']
-
-
-def get_publication_config(ctx):
-    """Get all publication config keys and their values and report any missing keys."""
-    zone = user.zone(ctx)
-    system_coll = "/" + zone + constants.UUSYSTEMCOLLECTION
-
-    attr2keys = {"public_host": "publicHost",
-                 "public_vhost": "publicVHost",
-                 "moai_host": "moaiHost",
-                 "yoda_prefix": "yodaPrefix",
-                 "datacite_prefix": "dataCitePrefix",
-                 "random_id_length": "randomIdLength",
-                 "yoda_instance": "yodaInstance",
-                 "davrods_vhost": "davrodsVHost",
-                 "davrods_anonymous_vhost": "davrodsAnonymousVHost"}
-    configKeys = {}
-    found_attrs = []
-
-    prefix_length = len(constants.UUORGMETADATAPREFIX)
-    iter = genquery.row_iterator(
-        "META_COLL_ATTR_NAME, META_COLL_ATTR_VALUE",
-        "COLL_NAME = '" + system_coll + "' AND  META_COLL_ATTR_NAME like '" + constants.UUORGMETADATAPREFIX + "%'",
-        genquery.AS_LIST, ctx
-    )
-
-    for row in iter:
-        # Strip prefix From attribute names
-        attr = row[0][prefix_length:]
-        val = row[1]
-
-        try:
-            found_attrs.append(attr)
-            configKeys[attr2keys[attr]] = val
-        except KeyError:
-            continue
-
-    # Any differences between
-    if len(found_attrs) != len(attr2keys):
-        # Difference between attrs wanted and found
-        for key in attr2keys:
-            if key not in found_attrs:
-                log.write(ctx, 'Missing config key ' + key)
-
-    return configKeys
+           'rule_update_publication',
+           'rule_update_publications']
 
 
 def generate_combi_json(ctx, publication_config, publication_state):
@@ -130,80 +91,105 @@ def generate_system_json(ctx, publication_config, publication_state):
     publication_state["combiJsonPath"] = system_json_path
 
 
+class PublicationState(dict):
+    """Dict with state of the publication process that remembers what has been persisted.
+
+    The persisted attribute holds the key-value-pairs as stored on the vault
+    package, so that save_publication_state only needs to write changed keys.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PublicationState, self).__init__(*args, **kwargs)
+        self.persisted = {}
+        self.vault_status = None
+
+
 def get_publication_state(ctx, vault_package):
     """The publication state is kept as metadata on the vault package.
 
+    All metadata of the vault package is retrieved in a single query. Besides
+    the publication state, this provides the access restriction, license and
+    vault status of the package (the latter as the vault_status attribute).
+
     :param ctx:           Combined type of a callback and rei struct
     :param vault_package: Path to the package in the vault
 
     :returns: Dict with state of the publication process
     """
-    publication_state = {
+    publication_state = PublicationState({
         "status": "Unknown",
         "accessRestriction": "Closed"
-    }
+    })
 
-    publ_metadata = get_collection_metadata(ctx, vault_package, constants.UUORGMETADATAPREFIX + 'publication_')
+    prefix = constants.UUORGMETADATAPREFIX + 'publication_'
+    metadata = list(Query(ctx, "META_COLL_ATTR_NAME, META_COLL_ATTR_VALUE", "COLL_NAME = '" + vault_package + "'"))
 
     # Take over all actual values as saved earlier.
-    for key in publ_metadata.keys():
-        publication_state[key] = publ_metadata[key]
+    for attr, value in metadata:
+        if attr.startswith(prefix):
+            publication_state.persisted[attr[len(prefix):]] = value
+    publication_state.update(publication_state.persisted)
 
-    # Handle access restriction.
-    iter = genquery.row_iterator(
-        "META_COLL_ATTR_VALUE",
-        "META_COLL_ATTR_NAME like '%Data_Access_Restriction' AND COLL_NAME = '" + vault_package + "'",
-        genquery.AS_LIST, ctx
-    )
-    for row in iter:
-        publication_state["accessRestriction"] = row[0]
-
-    # Handle license.
     license = ""
-    iter = genquery.row_iterator(
-        "META_COLL_ATTR_VALUE",
-        "META_COLL_ATTR_NAME like '%License' AND COLL_NAME = '" + vault_package + "'",
-        genquery.AS_LIST, ctx
-    )
-    for row in iter:
-        license = row[0]
+    license_uri = ""
+    for attr, value in metadata:
+        # Handle access restriction.
+        if attr.endswith('Data_Access_Restriction'):
+            publication_state["accessRestriction"] = value
+        # Handle license.
+        elif attr.endswith('License'):
+            license = value
+        elif attr == constants.UUORGMETADATAPREFIX + "license_uri":
+            license_uri = value
 
     if license != "":
         publication_state["license"] = license
-        license_uri = ""
-        iter = genquery.row_iterator(
-            "META_COLL_ATTR_VALUE",
-            "META_COLL_ATTR_NAME like '" + constants.UUORGMETADATAPREFIX + "license_uri" + "' AND COLL_NAME = '" + vault_package + "'",
-            genquery.AS_LIST, ctx
-        )
-        for row in iter:
-            license_uri = row[0]
-
         if license_uri != "":
             publication_state["licenseUri"] = license_uri
 
     publication_state["vaultPackage"] = vault_package
+    publication_state.vault_status = vault.get_coll_vault_status(ctx, vault_package, metadata).value
+
     return publication_state
 
 
 def save_publication_state(ctx, vault_package, publication_state):
     """Save the publication state key-value-pairs to AVU's on the vault package.
 
+    Only keys that changed since the state was loaded (or last saved) are
+    written. Keys that were removed or emptied are removed from the vault package.
+
     :param ctx:               Combined type of a callback and rei struct
     :param vault_package:     Path to the package in the vault
     :param publication_state: Dict with state of the publication process
     """
-    ret_val = ctx.msi_rmw_avu("-C", vault_package, constants.UUORGMETADATAPREFIX + 'publication_%', "%", "%")
-    for key in publication_state.keys():
-        if publication_state[key] != "":
-            avu.set_on_coll(ctx, vault_package, constants.UUORGMETADATAPREFIX + 'publication_' + key, publication_state[key])
+    prefix = constants.UUORGMETADATAPREFIX + 'publication_'
+
+    if isinstance(publication_state, PublicationState):
+        persisted = publication_state.persisted
+    else:
+        persisted = get_collection_metadata(ctx, vault_package, prefix)
+
+    state = dict((key, value) for key, value in publication_state.items() if value != "")
+
+    for key in persisted:
+        if key not in state:
+            avu.rmw_from_coll(ctx, vault_package, prefix + key, "%", "%")
+
+    for key, value in state.items():
+        if persisted.get(key) != value:
+            avu.set_on_coll(ctx, vault_package, prefix + key, value)
 
+    if isinstance(publication_state, PublicationState):
+        publication_state.persisted = state
 
-def set_update_publication_state(ctx, vault_package):
+
+def set_update_publication_state(ctx, vault_package, publication_state=None):
     """Routine to set publication state of vault package pending to update.
 
-    :param ctx:           Combined type of a callback and rei struct
-    :param vault_package: Path to the package in the vault
+    :param ctx:               Combined type of a callback and rei struct
+    :param vault_package:     Path to the package in the vault
+    :param publication_state: Publication state of the vault package, if already loaded (updated in place)
 
     :returns: String with state of publication state update
     """
@@ -212,15 +198,14 @@ def set_update_publication_state(ctx, vault_package):
         log.write(ctx, "User is no rodsadmin")
         return 'Insufficient permissions - should only be called by rodsadmin'
 
+    if publication_state is None:
+        publication_state = get_publication_state(ctx, vault_package)
+
     # check current status, perhaps transitioned already
-    coll_status = vault.get_coll_vault_status(ctx, vault_package).value
+    coll_status = publication_state.vault_status
     if coll_status not in [str(constants.vault_package_state.PUBLISHED), str(constants.vault_package_state.PENDING_DEPUBLICATION), str(constants.vault_package_state.PENDING_REPUBLICATION)]:
         return "NotAllowed"
 
-    # get publication configuration
-    config = get_publication_config(ctx)
-
-    publication_state = get_publication_state(ctx, vault_package)
     if publication_state["status"] != "OK":
         return "PublicationNotOK"
 
@@ -247,6 +232,10 @@ def set_update_publication_state(ctx, vault_package):
     # Save state
     save_publication_state(ctx, vault_package, publication_state)
 
+    # Reset keys are removed, as they would be when loading the state again.
+    for key in [key for key, value in publication_state.items() if value == ""]:
+        del publication_state[key]
+
     return ""
 
 
@@ -336,6 +325,8 @@ def generate_datacite_xml(ctx, publication_config, publication_state):
 
     publication_state["dataCiteXmlPath"] = datacite_xml_path
 
+    return receiveDataciteXml
+
 
 def post_metadata_to_datacite(ctx, publication_config, publication_state):
     """Upload DataCite XML to DataCite. This will register the DOI, without minting it.
@@ -350,6 +341,16 @@ def post_metadata_to_datacite(ctx, publication_config, publication_state):
 
     httpCode = datacite.register_doi_metadata(ctx, publication_state["yodaDOI"], datacite_xml)
 
+    handle_datacite_metadata_response(ctx, publication_state, httpCode)
+
+
+def handle_datacite_metadata_response(ctx, publication_state, httpCode):
+    """Update publication state with the response of DataCite to posted metadata.
+
+    :param ctx:               Combined type of a callback and rei struct
+    :param publication_state: Dict with state of the publication process
+    :param httpCode:          HTTP status code returned by DataCite
+    """
     if httpCode == 201:
         publication_state["dataCiteMetadataPosted"] = "yes"
     elif httpCode in [401, 403, 500, 503, 504]:
@@ -574,8 +575,11 @@ def process_publication(ctx, vault_package):
         log.write(ctx, "User is no rodsadmin")
         return 'Insufficient permissions - should only be called by rodsadmin'
 
+    # get state of all related to the publication
+    publication_state = get_publication_state(ctx, vault_package)
+
     # check current status, perhaps transitioned already
-    vault_status = vault.get_coll_vault_status(ctx, vault_package).value
+    vault_status = publication_state.vault_status
 
     if vault_status not in [str(constants.vault_package_state.PUBLISHED), str(constants.vault_package_state.APPROVED_FOR_PUBLICATION)]:
         return "InvalidPackageStatusForPublication" + ": " + vault_status
@@ -583,8 +587,6 @@ def process_publication(ctx, vault_package):
     # get publication configuration
     publication_config = get_publication_config(ctx)
 
-    # get state of all related to the publication
-    publication_state = get_publication_state(ctx, vault_package)
     status = publication_state['status']
 
     # Publication status check and handling
@@ -785,22 +787,22 @@ def process_depublication(ctx, vault_package):
         log.write(ctx, "User is no rodsadmin")
         return 'Insufficient permissions - should only be called by rodsadmin'
 
+    # get state of all related to the publication
+    publication_state = get_publication_state(ctx, vault_package)
+
     # check current status, perhaps transitioned already
-    vault_status = vault.get_coll_vault_status(ctx, vault_package).value
+    vault_status = publication_state.vault_status
     if vault_status not in [str(constants.vault_package_state.PENDING_DEPUBLICATION)]:
         return "InvalidPackageStatusForPublication" + ": " + vault_status
 
     # get publication configuration
     publication_config = get_publication_config(ctx)
 
-    # get state of all related to the publication
-    publication_state = get_publication_state(ctx, vault_package)
     status = publication_state['status']
 
     if status == "OK":
         # reset on first call
-        set_update_publication_state(ctx, vault_package)
-        publication_state = get_publication_state(ctx, vault_package)
+        set_update_publication_state(ctx, vault_package, publication_state)
         status = publication_state['status']
 
     if status in ["Unrecoverable", "Processing"]:
@@ -905,21 +907,21 @@ def process_republication(ctx, vault_package):
         log.write(ctx, "User is no rodsadmin")
         return 'Insufficient permissions - should only be called by rodsadmin'
 
+    # get state of all related to the publication
+    publication_state = get_publication_state(ctx, vault_package)
+
     # check current status, perhaps transitioned already
-    vault_status = vault.get_coll_vault_status(ctx, vault_package).value
+    vault_status = publication_state.vault_status
     if vault_status not in [str(constants.vault_package_state.PENDING_REPUBLICATION)]:
         return "InvalidPackageStatusForRePublication" + ": " + vault_status
 
     publication_config = get_publication_config(ctx)
 
-    # get state of all related to the publication
-    publication_state = get_publication_state(ctx, vault_package)
     status = publication_state['status']
 
     if status == "OK":
         # reset on first call
-        set_update_publication_state(ctx, vault_package)
-        publication_state = get_publication_state(ctx, vault_package)
+        set_update_publication_state(ctx, vault_package, publication_state)
         status = publication_state['status']
 
     if status in ["Unrecoverable", "Processing"]:
@@ -1040,21 +1042,182 @@ def update_publication(ctx, vault_package):
         log.write(ctx, "User is no rodsadmin")
         return 'Insufficient permissions - should only be called by rodsadmin'
 
+    # get state of all related to the publication
+    publication_state = get_publication_state(ctx, vault_package)
+
     # check current status, perhaps transitioned already
-    vault_status = vault.get_coll_vault_status(ctx, vault_package).value
+    vault_status = publication_state.vault_status
     if vault_status not in [str(constants.vault_package_state.PUBLISHED), str(constants.vault_package_state.DEPUBLISHED)]:
         return "InvalidPackageStatus" + ": " + vault_status
 
     publication_config = get_publication_config(ctx)
 
-    # Get state of all related to the publication.
-    publication_state = get_publication_state(ctx, vault_package)
     status = publication_state['status']
 
     # Publication must be finsished.
     if status != "OK":
         return status
 
+    render_publication_update(ctx, publication_config, publication_state)
+    save_publication_state(ctx, vault_package, publication_state)
+
+    if publication_state["status"] in ["Unrecoverable", "Retry"]:
+        return publication_state["status"]
+
+    upload_publication_update(ctx, publication_config, publication_state)
+    save_publication_state(ctx, vault_package, publication_state)
+
+    if publication_state["status"] == "Retry":
+        return publication_state["status"]
+
+    # Updating the landingpage was a success
+    publication_state["status"] = "OK"
+    save_publication_state(ctx, vault_package, publication_state)
+
+    return publication_state["status"]
+
+
+@rule.make(inputs=range(3), outputs=range(3, 4))
+def rule_update_publications(ctx, restart, update_datacite, workers):
+    """Rule interface for updating the publications of all published vault packages.
+
+    :param ctx:             Combined type of a callback and rei struct
+    :param restart:         "yes" to start a new run, otherwise an interrupted run is resumed
+    :param update_datacite: "yes" to post updated metadata to DataCite as well
+    :param workers:         Maximum number of concurrent DataCite requests
+
+    :return: Summary of the run
+    """
+    return update_publications(ctx, restart == "yes", update_datacite == "yes", int(workers))
+
+
+def update_publications(ctx, restart=False, update_datacite=False, workers=4):
+    """Update the publications of all published vault packages.
+
+    Landing pages (and DataCite XML) are rendered and pushed to the public
+    host by this agent, as both need the rule engine. DataCite requests do
+    not, and are sent by a pool of at most `workers` threads, so that they
+    overlap with rendering the next packages. Workers only do HTTP; the
+    responses are handled and saved by the calling thread.
+
+    Progress is checkpointed per vault package: a package is marked with
+    the current run once its update completed. A run that is interrupted
+    skips completed packages when resumed; failed packages are retried.
+
+    :param ctx:             Combined type of a callback and rei struct
+    :param restart:         Start a new run instead of resuming the current one
+    :param update_datacite: Post updated metadata to DataCite as well
+    :param workers:         Maximum number of concurrent DataCite requests
+
+    :return: Summary of the run
+    """
+    if user.user_type(ctx) != 'rodsadmin':
+        log.write(ctx, "User is no rodsadmin")
+        return 'Insufficient permissions - should only be called by rodsadmin'
+
+    zone = user.zone(ctx)
+    system_coll = "/" + zone + constants.UUSYSTEMCOLLECTION
+
+    run = Query(ctx, "META_COLL_ATTR_VALUE",
+                "COLL_NAME = '" + system_coll + "' AND META_COLL_ATTR_NAME = '"
+                + constants.UUPUBLICATIONREFRESHRUNATTRNAME + "'").first()
+    if restart or run is None:
+        run = time.strftime("%Y%m%dT%H%M%S")
+        avu.set_on_coll(ctx, system_coll, constants.UUPUBLICATIONREFRESHRUNATTRNAME, run)
+
+    published = Query(ctx, "COLL_NAME",
+                      "COLL_NAME like '/" + zone + "/home/vault-%' AND META_COLL_ATTR_NAME = '"
+                      + constants.IIVAULTSTATUSATTRNAME + "' AND META_COLL_ATTR_VALUE = '"
+                      + str(constants.vault_package_state.PUBLISHED) + "'")
+    completed = set(Query(ctx, "COLL_NAME",
+                          "COLL_NAME like '/" + zone + "/home/vault-%' AND META_COLL_ATTR_NAME = '"
+                          + constants.UUPUBLICATIONREFRESHEDATTRNAME + "' AND META_COLL_ATTR_VALUE = '" + run + "'"))
+    packages = [package for package in published if package not in completed]
+
+    log.write(ctx, "update_publications: run {}, {} of {} packages to update"
+                   .format(run, len(packages), len(packages) + len(completed)))
+
+    publication_config = get_publication_config(ctx)
+    results = {}
+
+    def finish(publication_state, http_code=None):
+        if http_code is not None:
+            handle_datacite_metadata_response(ctx, publication_state, http_code)
+
+        if publication_state["status"] not in ["Unrecoverable", "Retry"]:
+            publication_state["status"] = "OK"
+
+        vault_package = publication_state["vaultPackage"]
+        save_publication_state(ctx, vault_package, publication_state)
+
+        if publication_state["status"] == "OK":
+            avu.set_on_coll(ctx, vault_package, constants.UUPUBLICATIONREFRESHEDATTRNAME, run)
+        else:
+            log.write(ctx, "update_publications: <{}> {}".format(vault_package, publication_state["status"]))
+
+        results[publication_state["status"]] = results.get(publication_state["status"], 0) + 1
+
+    def finish_pending(pending):
+        publication_state, request = pending
+        try:
+            http_code = request.get()
+        except Exception as e:
+            log.write(ctx, "update_publications: DataCite request failed: {}".format(e))
+            http_code = 503
+        finish(publication_state, http_code)
+
+    pool = ThreadPool(max(workers, 1))
+    in_flight = []
+
+    try:
+        for vault_package in packages:
+            publication_state = get_publication_state(ctx, vault_package)
+            if publication_state["status"] != "OK":
+                results["Skipped"] = results.get("Skipped", 0) + 1
+                continue
+
+            datacite_xml = render_publication_update(ctx, publication_config, publication_state, update_datacite)
+            if publication_state["status"] not in ["Unrecoverable", "Retry"]:
+                upload_publication_update(ctx, publication_config, publication_state)
+
+            if datacite_xml is None or publication_state["status"] in ["Unrecoverable", "Retry"]:
+                finish(publication_state)
+                continue
+
+            # Only the DataCite request runs in a worker thread. The context is
+            # not shared with workers: all rule engine calls, including
+            # handling the response, are made from this thread.
+            in_flight.append((publication_state,
+                              pool.apply_async(datacite.put_doi_metadata,
+                                               (publication_state["yodaDOI"], datacite_xml))))
+
+            # Bound the number of pending requests.
+            while len(in_flight) >= max(workers, 1):
+                finish_pending(in_flight.pop(0))
+
+        while in_flight:
+            finish_pending(in_flight.pop(0))
+    finally:
+        pool.close()
+        pool.join()
+
+    log.write(ctx, "update_publications: DataCite requests: {}".format(datacite.metrics()))
+
+    return "Run {}: {}".format(run, ", ".join("{} {}".format(n, status) for status, n in sorted(results.items())))
+
+
+def render_publication_update(ctx, publication_config, publication_state, update_datacite=False):
+    """Generate the combi JSON, landing page and (optionally) DataCite XML of a publication.
+
+    :param ctx:                Combined type of a callback and rei struct
+    :param publication_config: Dict with publication configuration
+    :param publication_state:  Dict with state of the publication process
+    :param update_datacite:    Whether to generate DataCite XML
+
+    :returns: DataCite XML if requested and generated, None otherwise
+    """
+    vault_package = publication_state["vaultPackage"]
+
     # Publication date
     if "publicationDate" not in publication_state:
         publication_state["publicationDate"] = get_publication_date(ctx, vault_package)
@@ -1062,47 +1225,36 @@ def update_publication(ctx, vault_package):
     # Determine last modification time. Always run, no matter if retry
     publication_state["lastModifiedDateTime"] = get_last_modified_datetime(ctx, vault_package)
 
-    # Generate Combi Json consisting of user and system metadata
     try:
+        # Generate Combi Json consisting of user and system metadata
         generate_combi_json(ctx, publication_config, publication_state)
-    except msi.Error as e:
-        publication_state["status"] = "Unrecoverable"
-
-    save_publication_state(ctx, vault_package, publication_state)
-
-    if publication_state["status"] in ["Unrecoverable", "Retry"]:
-        return publication_state["status"]
 
-    # Create landing page
-    try:
+        # Create landing page
         generate_landing_page(ctx, publication_config, publication_state, "publish")
+
+        # Generate DataCite XML
+        if update_datacite:
+            return generate_datacite_xml(ctx, publication_config, publication_state)
     except msi.Error as e:
+        log.write(ctx, "render_publication_update: {}".format(e))
         publication_state["status"] = "Unrecoverable"
 
-    save_publication_state(ctx, vault_package, publication_state)
 
-    if publication_state["status"] == "Unrecoverable":
-        return publication_state["status"]
+def upload_publication_update(ctx, publication_config, publication_state):
+    """Push the landing page and combi JSON of a publication to the public host.
 
+    :param ctx:                Combined type of a callback and rei struct
+    :param publication_config: Dict with publication configuration
+    :param publication_state:  Dict with state of the publication process
+    """
     # Use secure copy to push landing page to the public host
     copy_landingpage_to_public_host(ctx, publication_config, publication_state)
-    save_publication_state(ctx, vault_package, publication_state)
 
     if publication_state["status"] == "Retry":
-        return publication_state["status"]
+        return
 
     # Use secure copy to push combi JSON to MOAI server
     copy_metadata_to_moai(ctx, publication_config, publication_state)
-    save_publication_state(ctx, vault_package, publication_state)
-
-    if publication_state["status"] == "Retry":
-        return publication_state["status"]
-
-    # Updating the landingpage was a success
-    publication_state["status"] = "OK"
-    save_publication_state(ctx, vault_package, publication_state)
-
-    return publication_state["status"]
 
 
 def get_collection_metadata(ctx, coll, prefix):
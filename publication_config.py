@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Publication configuration, cached per agent."""
+
+__copyright__ = 'Copyright (c) 2019-2020, Utrecht University'
+__license__   = 'GPLv3, see LICENSE'
+
+import time
+
+from util import *
+
+
+PUBLICATION_CONFIG_TTL = 300
+"""Seconds a cached publication configuration is valid (see get_publication_config)."""
+
+# Publication configuration per zone, cached for the lifetime of the agent.
+_publication_config_cache = {}
+
+
+def get_publication_config(ctx):
+    """Get all publication config keys and their values.
+
+    The configuration is cached per agent. The cache is invalidated when
+    metadata on the system collection is modified in this agent (see
+    invalidate_publication_config) and expires after PUBLICATION_CONFIG_TTL
+    seconds, to pick up changes made through other agents.
+
+    :param ctx: Combined type of a callback and rei struct
+
+    :returns: Dict with publication configuration
+    """
+    zone = user.zone(ctx)
+
+    if zone in _publication_config_cache:
+        timestamp, config = _publication_config_cache[zone]
+        if time.time() - timestamp < PUBLICATION_CONFIG_TTL:
+            return dict(config)
+
+    config = load_publication_config(ctx, zone)
+    _publication_config_cache[zone] = (time.time(), config)
+
+    return dict(config)
+
+
+def invalidate_publication_config(zone):
+    """Remove a cached publication configuration of a zone.
+
+    :param zone: Zone name
+    """
+    _publication_config_cache.pop(zone, None)
+
+
+def load_publication_config(ctx, zone):
+    """Get all publication config keys and their values and report any missing keys."""
+    system_coll = "/" + zone + constants.UUSYSTEMCOLLECTION
+
+    attr2keys = {"public_host": "publicHost",
+                 "public_vhost": "publicVHost",
+                 "moai_host": "moaiHost",
+                 "yoda_prefix": "yodaPrefix",
+                 "datacite_prefix": "dataCitePrefix",
+                 "random_id_length": "randomIdLength",
+                 "yoda_instance": "yodaInstance",
+                 "davrods_vhost": "davrodsVHost",
+                 "davrods_anonymous_vhost": "davrodsAnonymousVHost"}
+    configKeys = {}
+    found_attrs = []
+
+    prefix_length = len(constants.UUORGMETADATAPREFIX)
+    iter = genquery.row_iterator(
+        "META_COLL_ATTR_NAME, META_COLL_ATTR_VALUE",
+        "COLL_NAME = '" + system_coll + "' AND  META_COLL_ATTR_NAME like '" + constants.UUORGMETADATAPREFIX + "%'",
+        genquery.AS_LIST, ctx
+    )
+
+    for row in iter:
+        # Strip prefix From attribute names
+        attr = row[0][prefix_length:]
+        val = row[1]
+
+        try:
+            found_attrs.append(attr)
+            configKeys[attr2keys[attr]] = val
+        except KeyError:
+            continue
+
+    # Any differences between
+    if len(found_attrs) != len(attr2keys):
+        # Difference between attrs wanted and found
+        for key in attr2keys:
+            if key not in found_attrs:
+                log.write(ctx, 'Missing config key ' + key)
+
+    return configKeys
@@ -9,6 +9,7 @@ from pathvalidate import validate_filename, validate_filepath, ValidationError
 import folder
 import meta_form
 from util import *
+from util.query import Query
 
 __all__ = ['api_research_folder_add',
            'api_research_folder_delete',
@@ -57,26 +58,28 @@ def api_research_folder_add(ctx, coll, new_folder_name):
     if target_group_name.startswith('vault-'):
         return api.Error('not_allowed', 'It is not possible to add folders in the vault')
 
+    op = folder.Operation(ctx, coll, coll_names=[new_folder_name])
+
     # permissions ok for group?
-    user_full_name = user.full_name(ctx)
-    if meta_form.user_member_type(ctx, target_group_name, user_full_name) in ['none', 'reader']:
+    if not op.member:
         return api.Error('not_allowed', 'You do not have sufficient permissions to add new folders')
 
     # Collection exists?
-    if not collection.exists(ctx, coll):
+    if not op.coll_exists():
         return api.Error('invalid_foldername', 'The selected folder to add a new folder to does not exist')
 
     # Folder not locked?
-    if folder.is_locked(ctx, coll):
+    if op.locked:
         return api.Error('not_allowed', 'The indicated folder is locked so no new folders can be added to it')
 
     # new collection exists?
-    if collection.exists(ctx, coll_target):
+    if op.coll_exists(new_folder_name):
         return api.Error('invalid_foldername', 'The folder already exists. Please choose another name')
 
     # All requirements OK
     try:
-        collection.create(ctx, coll_target)
+        with folder.running(op):
+            collection.create(ctx, coll_target)
     except msi.Error as e:
         return api.Error('internal', 'Something went wrong. Please try again')
 
@@ -125,26 +128,28 @@ def api_research_folder_rename(ctx, new_folder_name, coll, org_folder_name):
     if target_group_name.startswith('vault-'):
         return api.Error('not_allowed', 'It is not possible to rename folders in the vault')
 
+    op = folder.Operation(ctx, coll, coll_names=[new_folder_name])
+
     # permissions ok for group?
-    user_full_name = user.full_name(ctx)
-    if meta_form.user_member_type(ctx, target_group_name, user_full_name) in ['none', 'reader']:
+    if not op.member:
         return api.Error('not_allowed', 'You do not have sufficient permissions to rename the selected folder')
 
     # Collection exists?
-    if not collection.exists(ctx, coll):
+    if not op.coll_exists():
         return api.Error('invalid_foldername', 'The selected folder does not exist')
 
     # Folder not locked?
-    if folder.is_locked(ctx, coll):
+    if op.locked:
         return api.Error('not_allowed', 'The indicated folder is locked and therefore can not be renamed')
 
     # new collection exists?
-    if collection.exists(ctx, coll_target):
+    if op.coll_exists(new_folder_name):
         return api.Error('invalid_foldername', 'The folder already exists. Please choose another name')
 
     # All requirements OK
     try:
-        collection.rename(ctx, coll + '/' + org_folder_name, coll_target)
+        with folder.running(op):
+            collection.rename(ctx, coll + '/' + org_folder_name, coll_target)
     except msi.Error as e:
         return api.Error('internal', 'Something went wrong. Please try again')
 
@@ -176,17 +181,18 @@ def api_research_folder_delete(ctx, coll, folder_name):
     if target_group_name.startswith('vault-'):
         return api.Error('not_allowed', 'It is not possible to delete folders from the vault')
 
+    op = folder.Operation(ctx, coll, coll_names=[folder_name])
+
     # permissions ok for group?
-    user_full_name = user.full_name(ctx)
-    if meta_form.user_member_type(ctx, target_group_name, user_full_name) in ['none', 'reader']:
+    if not op.member:
         return api.Error('not_allowed', 'You do not have sufficient permissions to delete the selected folder')
 
     # Folder not locked?
-    if folder.is_locked(ctx, coll):
+    if op.locked:
         return api.Error('not_allowed', 'The indicated folder is locked and therefore can not be deleted')
 
     # Collection exists?
-    if not collection.exists(ctx, coll_target):
+    if not op.coll_exists(folder_name):
         return api.Error('invalid_target', 'The selected folder to add a new folder to does not exist')
 
     # Folder empty?
@@ -195,7 +201,8 @@ def api_research_folder_delete(ctx, coll, folder_name):
 
     # All requirements OK
     try:
-        collection.remove(ctx, coll_target)
+        with folder.running(op):
+            collection.remove(ctx, coll_target)
     except msi.Error as e:
         return api.Error('internal', 'Something went wrong. Please try again')
 
@@ -240,26 +247,28 @@ def api_research_file_copy(ctx, copy, coll, file):
     if target_group_name.startswith('vault-'):
         return api.Error('invalid_destination', 'It is not possible to copy files in the vault')
 
+    op = folder.Operation(ctx, coll, data_names=[file, copy])
+
     # permissions ok for group?
-    user_full_name = user.full_name(ctx)
-    if meta_form.user_member_type(ctx, target_group_name, user_full_name) in ['none', 'reader']:
+    if not op.member:
         return api.Error('not_allowed', 'You do not have sufficient permissions to copy the selected file')
 
     # Folder not locked?
-    if folder.is_locked(ctx, coll):
+    if op.locked:
         return api.Error('not_allowed', 'The indicated folder is locked and therefore the indicated file can not be copied')
 
     # Does org file exist?
-    if not data_object.exists(ctx, coll + '/' + file):
+    if not op.data_exists(file):
         return api.Error('invalid_source', 'The original file ' + file + ' can not be found')
 
     # new filename already exists?
-    if data_object.exists(ctx, path_target):
+    if op.data_exists(copy):
         return api.Error('invalid_destination', 'The selected filename ' + copy + ' already exists')
 
     # All requirements OK
     try:
-        data_object.copy(ctx, coll + '/' + file, coll + '/' + copy)
+        with folder.running(op):
+            data_object.copy(ctx, coll + '/' + file, coll + '/' + copy)
     except msi.Error as e:
         return api.Error('internal', 'Something went wrong. Please try again')
 
@@ -304,26 +313,28 @@ def api_research_file_rename(ctx, new_file_name, coll, org_file_name):
     if target_group_name.startswith('vault-'):
         return api.Error('invalid_destination', 'It is not possible to rename files in the vault')
 
+    op = folder.Operation(ctx, coll, data_names=[org_file_name, new_file_name])
+
     # permissions ok for group?
-    user_full_name = user.full_name(ctx)
-    if meta_form.user_member_type(ctx, target_group_name, user_full_name) in ['none', 'reader']:
+    if not op.member:
         return api.Error('not_allowed', 'You do not have sufficient permissions to rename the selected file')
 
     # Folder not locked?
-    if folder.is_locked(ctx, coll):
+    if op.locked:
         return api.Error('not_allowed', 'The indicated folder is locked and therefore the indicated file can not be renamed')
 
     # Does org file exist?
-    if not data_object.exists(ctx, coll + '/' + org_file_name):
+    if not op.data_exists(org_file_name):
         return api.Error('invalid_source', 'The original file ' + org_file_name + ' can not be found')
 
     # new filename already exists?
-    if data_object.exists(ctx, path_target):
+    if op.data_exists(new_file_name):
         return api.Error('invalid_destination', 'The selected filename ' + new_file_name + ' already exists')
 
     # All requirements OK
     try:
-        data_object.rename(ctx, coll + '/' + org_file_name, path_target)
+        with folder.running(op):
+            data_object.rename(ctx, coll + '/' + org_file_name, path_target)
     except msi.Error as e:
         return api.Error('internal', 'Something went wrong. Please try again')
 
@@ -351,22 +362,24 @@ def api_research_file_delete(ctx, coll, file_name):
     if target_group_name.startswith('vault-'):
         return api.Error('not_allowed', 'It is not possible to delete files from the vault')
 
+    op = folder.Operation(ctx, coll, data_names=[file_name])
+
     # permissions ok for group?
-    user_full_name = user.full_name(ctx)
-    if meta_form.user_member_type(ctx, target_group_name, user_full_name) in ['none', 'reader']:
+    if not op.member:
         return api.Error('not_allowed', 'You do not have sufficient permissions to delete the selected file')
 
     # Folder not locked?
-    if folder.is_locked(ctx, coll):
+    if op.locked:
         return api.Error('not_allowed', 'The indicated folder is locked and therefore the indicated file can not be deleted')
 
     # Collection exists?
-    if not data_object.exists(ctx, path_target):
+    if not op.data_exists(file_name):
         return api.Error('invalid_target', 'The selected folder to add a new folder to does not exist')
 
     # All requirements OK
     try:
-        data_object.remove(ctx, path_target)
+        with folder.running(op):
+            data_object.remove(ctx, path_target)
     except msi.Error as e:
         return api.Error('internal', 'Something went wrong. Please try again')
 
@@ -406,35 +419,64 @@ def api_research_system_metadata(ctx, coll):
 
 @api.make()
 def api_research_collection_details(ctx, path):
-    """Return details of a research collection."""
-    if not collection.exists(ctx, path):
-        return api.Error('nonexistent', 'The given path does not exist')
+    """Return details of a research collection.
 
+    All details are derived from a constant number of queries: existence of
+    the collection and its vault, the collection's organizational metadata,
+    the group's metadata and the client's group memberships.
+    """
     # Check if collection is a research group.
     space, _, group, _ = pathutil.info(path)
+
+    vault_name = group.replace("research-", "vault-", 1)
+    vault_coll = pathutil.chop(path)[0] + "/" + vault_name
+
+    existing = set(Query(ctx, "COLL_NAME", "COLL_NAME in ('{}', '{}')".format(path, vault_coll)))
+    if path not in existing:
+        return api.Error('nonexistent', 'The given path does not exist')
+
     if space != pathutil.Space.RESEARCH:
         return {}
 
     basename = pathutil.chop(path)[1]
 
-    # Retrieve user type.
-    member_type = meta_form.user_member_type(ctx, group, user.full_name(ctx))
+    org_metadata = folder.get_org_metadata(ctx, path)
+
+    # Group metadata: category and managers.
+    category = ''
+    managers = set()
+    for attr, value in Query(ctx, "META_USER_ATTR_NAME, META_USER_ATTR_VALUE",
+                             "USER_GROUP_NAME = '{}' AND USER_TYPE = 'rodsgroup' "
+                             "AND META_USER_ATTR_NAME in ('category', 'manager')".format(group)):
+        if attr == 'category':
+            category = value
+        else:
+            managers.add(str(user.from_str(ctx, value)))
+
+    # Groups the client is a member of.
+    client = user.user_and_zone(ctx)
+    memberships = set(Query(ctx, "USER_GROUP_NAME",
+                            "USER_NAME = '{}' AND USER_ZONE = '{}'".format(client.name, client.zone)))
+
+    # Retrieve user type (see uuGroupGetMemberType).
+    if group in memberships:
+        member_type = 'manager' if str(client) in managers else 'normal'
+    elif 'read-' + group.split('-', 1)[1] in memberships:
+        member_type = 'reader'
+    else:
+        member_type = 'none'
 
     # Retrieve research folder status.
-    status = folder.get_status(ctx, path)
+    status = folder.get_status(ctx, path, org_metadata)
 
     # Check if user is datamanager.
-    category = meta_form.group_category(ctx, group)
-    is_datamanager = meta_form.user_is_datamanager(ctx, category, user.full_name(ctx))
+    is_datamanager = 'datamanager-{}'.format(category) in memberships
 
     # Retrieve lock count.
-    lock_count = meta_form.get_coll_lock_count(ctx, path)
+    lock_count = meta_form.get_coll_lock_count(ctx, path, org_metadata)
 
     # Check if vault is accessible.
-    vault_path = ""
-    vault_name = group.replace("research-", "vault-", 1)
-    if collection.exists(ctx, pathutil.chop(path)[0] + "/" + vault_name):
-        vault_path = vault_name
+    vault_path = vault_name if vault_coll in existing else ""
 
     return {"basename": basename,
             "status": status.value,
@@ -7,7 +7,9 @@ __license__   = 'GPLv3, see LICENSE'
 from datetime import datetime
 
 import meta_form
+import storage_ledger
 from util import *
+from util.query import Query
 
 __all__ = ['api_resource_groups_dm',
            'api_resource_monthly_stats_dm',
@@ -21,7 +23,9 @@ __all__ = ['api_resource_groups_dm',
            'api_resource_user_research_groups',
            'api_resource_user_is_datamanager',
            'api_resource_full_year_group_data',
-           'rule_resource_store_monthly_storage_statistics']
+           'api_resource_full_year_category_data',
+           'rule_resource_store_monthly_storage_statistics',
+           'rule_resource_store_daily_storage_statistics']
 
 
 @api.make()
@@ -64,34 +68,70 @@ def api_resource_full_year_group_data(ctx, group_name, current_month):
             if user.user_type(ctx) != 'rodsadmin':
                 return api.Error('not_allowed', 'Insufficient permissions')
 
-    allStorage = []  # list of all month-tier combinations present including their storage size
+    series = get_full_year_storage_series(ctx, "USER_NAME = '" + group_name + "'", current_month)
 
-    # per month gather month/tier/storage information from metadata:
-    # metadata-attr-name = constants.UUMETADATASTORAGEMONTH + '01'...'12'
-    # metadata-attr-val = [category,tier,storage] ... only tier and storage required within this code
-    for counter in range(0, 11):
-        referenceMonth = current_month - counter
-        if referenceMonth < 1:
-            referenceMonth = referenceMonth + 12
+    # Keep the list of month-tier combinations format for backwards compatibility
+    allStorage = []
+    for tier, storage in series['tiers'].items():
+        for month, data_size in zip(series['months'], storage):
+            if data_size is not None:
+                allStorage.append({'month=' + str(month) + '-tier=' + tier: data_size})
 
-        metadataAttrNameRefMonth = constants.UUMETADATASTORAGEMONTH + '%0*d' % (2, referenceMonth)
+    return allStorage
 
-        iter = genquery.row_iterator(
-            "META_USER_ATTR_VALUE, USER_NAME, USER_GROUP_NAME",
-            "META_USER_ATTR_NAME = '" + metadataAttrNameRefMonth + "' AND USER_NAME = '" + group_name + "'",
-            genquery.AS_LIST, ctx
-        )
 
-        for row in iter:
-            data = jsonutil.parse(row[0])
+@api.make()
+def api_resource_full_year_category_data(ctx, category, current_month):
+    """Get a full year of monthly storage data for all groups in a category as a time series.
 
-            tierName = data[1]
-            data_size = data[2]  # no construction for summation required in this case
+    :param ctx:           Combined type of a callback and rei struct
+    :param category:      Category that is searched for storage data
+    :param current_month: Month passed that is supposed to be the month to look back from
 
-            key = 'month=' + str(referenceMonth) + '-tier=' + tierName
-            allStorage.append({key: data_size})
+    :returns: Time series of storage per tier (see get_full_year_storage_series)
+    """
+    if not meta_form.user_is_datamanager(ctx, category, user.full_name(ctx)):
+        if user.user_type(ctx) != 'rodsadmin':
+            return api.Error('not_allowed', 'Insufficient permissions')
 
-    return allStorage
+    return get_full_year_storage_series(ctx, "META_USER_ATTR_VALUE like '[\"" + category + "\",%'", current_month)
+
+
+def get_full_year_storage_series(ctx, condition, current_month):
+    """Get a full year of monthly storage data as a compact time series.
+
+    All months are retrieved with one query on the monthly storage AVUs and
+    storage of all matching groups is summed per tier and month.
+
+    Example: {'months': [2, 3, ..., 12, 1], 'tiers': {'Standard': [None, 0, ..., 1234]}}
+
+    :param ctx:           Combined type of a callback and rei struct
+    :param condition:     Query condition selecting the groups involved
+    :param current_month: Month passed that is supposed to be the month to look back from
+
+    :returns: Dict with the twelve months (oldest first) and per tier a list of storage per month
+              (None for months without data)
+    """
+    months = [(current_month - counter - 1) % 12 + 1 for counter in range(11, -1, -1)]
+    index = dict((month, i) for i, month in enumerate(months))
+    tiers = {}
+
+    # metadata-attr-name = constants.UUMETADATASTORAGEMONTH + '01'...'12'
+    # metadata-attr-val = [category,tier,storage] ... only tier and storage required within this code
+    iter = genquery.row_iterator(
+        "META_USER_ATTR_NAME, META_USER_ATTR_VALUE, USER_NAME",
+        "META_USER_ATTR_NAME like '" + constants.UUMETADATASTORAGEMONTH + "%' AND " + condition,
+        genquery.AS_LIST, ctx
+    )
+
+    for row in iter:
+        month = int(row[0][-2:])
+        _, tier, data_size = jsonutil.parse(row[1])
+
+        storage = tiers.setdefault(tier, [None] * 12)
+        storage[index[month]] = (storage[index[month]] or 0) + int(float(data_size))
+
+    return {'months': months, 'tiers': tiers}
 
 
 @api.make()
@@ -169,6 +209,7 @@ def api_resource_resource_and_tier_data(ctx):
         return api.Error('not_allowed', 'Insufficient permissions')
 
     resourceList = list()
+    resource_tiers = get_all_resource_tiers(ctx)
 
     iter = genquery.row_iterator(
         "RESC_ID, RESC_NAME",
@@ -179,7 +220,7 @@ def api_resource_resource_and_tier_data(ctx):
     for row in iter:
         resourceId = row[0]
         resourceName = row[1]
-        tierName = get_tier_by_resource_name(ctx, resourceName)
+        tierName = resource_tiers.get(resourceName, constants.UUDEFAULTRESOURCETIER)
         resourceList.append({'name': resourceName,
                              'id': resourceId,
                              'tier': tierName})
@@ -232,49 +273,66 @@ def api_resource_monthly_category_stats_export_dm(ctx):
     :returns: API status
     """
     datamanager = user.full_name(ctx)
-    categories = get_categories_datamanager(ctx, datamanager)
+    categories = set(get_categories_datamanager(ctx, datamanager))
+    groupToSubcategory = get_group_subcategories(ctx)
     allStorage = []
 
     # Select a full year by not limiting constants.UUMETADATASTORAGEMONTH to a perticular month. But only on its presence.
     # There always is a maximum of one year of history of storage data
-    for category in categories:
-        groupToSubcategory = {}
-
-        iter = genquery.row_iterator(
-            "META_USER_ATTR_VALUE, META_USER_ATTR_NAME, USER_NAME, USER_GROUP_NAME",
-            "META_USER_ATTR_VALUE like '[\"" + category + "\",%' AND META_USER_ATTR_NAME like  '" + constants.UUMETADATASTORAGEMONTH + "%'",
-            genquery.AS_LIST, ctx
-        )
-
-        for row in iter:
-            attrValue = row[0]
-            month = row[1]
-            month = str(int(month[-2:]))  # the month storage data is about, is taken from the attr_name of the AVU
-            groupName = row[3]
-
-            # Determine subcategory on groupName
-            try:
-                subcategory = groupToSubcategory[groupName]
-            except KeyError:
-                catInfo = get_group_category_info(ctx, groupName)
-                subcategory = catInfo['subcategory']
-                groupToSubcategory[groupName] = subcategory
-
-            temp = jsonutil.parse(attrValue)
-            category = temp[0]
-            tier = temp[1]
-            storage = int(float(temp[2]))
+    for groupName, attrName, category, tier, storage in get_storage_month_data(ctx, "like '" + constants.UUMETADATASTORAGEMONTH + "%'"):
+        if category not in categories:
+            continue
 
-            allStorage.append({'category': category,
-                               'subcategory': subcategory,
-                               'groupname': groupName,
-                               'tier': tier,
-                               'month': month,
-                               'storage': str(storage)})
+        month = str(int(attrName[-2:]))  # the month storage data is about, is taken from the attr_name of the AVU
+
+        allStorage.append({'category': category,
+                           'subcategory': groupToSubcategory.get(groupName, ''),
+                           'groupname': groupName,
+                           'tier': tier,
+                           'month': month,
+                           'storage': str(storage)})
 
     return allStorage
 
 
+def get_storage_month_data(ctx, attr_condition):
+    """Get monthly storage data of all groups in one query.
+
+    :param ctx:            Combined type of a callback and rei struct
+    :param attr_condition: Query condition on the storage month attribute name, e.g. "= 'org_storage_data_month01'"
+
+    :returns: Generator of (group name, attribute name, category, tier, storage) tuples
+    """
+    iter = genquery.row_iterator(
+        "USER_NAME, META_USER_ATTR_NAME, META_USER_ATTR_VALUE",
+        "USER_TYPE = 'rodsgroup' AND META_USER_ATTR_NAME " + attr_condition,
+        genquery.AS_LIST, ctx
+    )
+
+    for row in iter:
+        category, tier, storage = jsonutil.parse(row[2])
+        yield row[0], row[1], category, tier, int(float(storage))
+
+
+def get_group_subcategories(ctx):
+    """Get subcategory of all groups that have one.
+
+    :param ctx: Combined type of a callback and rei struct
+
+    :returns: Dict of group name => subcategory
+    """
+    group_subcategories = {}
+    iter = genquery.row_iterator(
+        "USER_NAME, META_USER_ATTR_VALUE",
+        "USER_TYPE = 'rodsgroup' AND  META_USER_ATTR_NAME  = 'subcategory'",
+        genquery.AS_LIST, ctx
+    )
+    for row in iter:
+        group_subcategories[row[0]] = row[1]
+
+    return group_subcategories
+
+
 def get_group_category_info(ctx, groupName):
     """Get category and subcategory for a group.
 
@@ -317,33 +375,17 @@ def getMonthlyCategoryStorageStatistics(ctx, categories):
     """
     month = '%0*d' % (2, datetime.now().month)
     metadataName = constants.UUMETADATASTORAGEMONTH + month
+    categories = set(categories)
 
     storageDict = {}
 
-    for category in categories:
-        iter = genquery.row_iterator(
-            "META_USER_ATTR_VALUE, META_USER_ATTR_NAME, USER_NAME, USER_GROUP_NAME",
-            "META_USER_ATTR_VALUE like '[\"" + category + "\",%' AND META_USER_ATTR_NAME = '" + metadataName + "'",
-            genquery.AS_LIST, ctx
-        )
-        for row in iter:
-            # hier wordt door alle groepen gezocht, geordend van een category.
-            # per tier moet worden gesommeerd om totale hoeveelheid storage op een tier te verkrijgen.
-            attrValue = row[0]
-
-            temp = jsonutil.parse(attrValue)
-            category = temp[0]
-            tier = temp[1]
-            storage = int(float(temp[2]))
-
-            try:
-                storageDict[category][tier] = storageDict[category][tier] + storage
-            except KeyError:
-                # if key error, can be either category or category/tier combination is missing
-                try:
-                    storageDict[category][tier] = storage
-                except KeyError:
-                    storageDict[category] = {tier: storage}
+    # Storage of all groups is summed per category/tier in one pass over the storage data of this month
+    for _, _, category, tier, storage in get_storage_month_data(ctx, "= '" + metadataName + "'"):
+        if category not in categories:
+            continue
+
+        tier_storage = storageDict.setdefault(category, {})
+        tier_storage[tier] = tier_storage.get(tier, 0) + storage
 
     # prepare for json output, convert storageDict into dict with keys
     allStorage = []
@@ -365,31 +407,18 @@ def get_groups_on_categories(ctx, categories):
 
     :returns: All groups belonging to all given categories
     """
-    groups = []
     metadataAttrNameRefMonth = constants.UUMETADATASTORAGEMONTH + '%0*d' % (2, datetime.now().month)
+    categories = set(categories)
+
+    # Storage of this month per group
+    group_storage = {}
+    for groupName, _, _, _, storage in get_storage_month_data(ctx, "= '" + metadataAttrNameRefMonth + "'"):
+        group_storage[groupName] = group_storage.get(groupName, 0) + storage
 
-    for category in categories:
-        iter = genquery.row_iterator(
-            "USER_NAME",
-            "USER_TYPE = 'rodsgroup' AND META_USER_ATTR_NAME = 'category' AND META_USER_ATTR_VALUE = '" + category + "' ",
-            genquery.AS_LIST, ctx
-        )
-
-        for row in iter:
-            groupName = row[0]
-            if groupName.startswith('research-'):
-                iter2 = genquery.row_iterator(
-                    "META_USER_ATTR_VALUE, USER_NAME, USER_GROUP_NAME",
-                    "META_USER_ATTR_NAME = '" + metadataAttrNameRefMonth + "' AND USER_NAME = '" + groupName + "'",
-                    genquery.AS_LIST, ctx
-                )
-
-                data_size = 0
-                for row in iter2:
-                    data = row[0]
-                    temp = jsonutil.parse(data)
-                    data_size = data_size + int(float(temp[2]))  # no construction for summation required in this case
-                groups.append([groupName, data_size])
+    groups = []
+    for groupName, category in get_group_categories(ctx).items():
+        if category in categories and groupName.startswith('research-'):
+            groups.append([groupName, group_storage.get(groupName, 0)])
 
     return groups
 
@@ -404,19 +433,13 @@ def get_categories_datamanager(ctx, datamanagerName):
     """
     categories = []
 
-    iter = genquery.row_iterator(
-        "USER_NAME",
-        "USER_TYPE = 'rodsgroup' AND USER_NAME like 'datamanager-%'",
-        genquery.AS_LIST, ctx
-    )
-
-    for row in iter:
-        datamanagerGroupname = row[0]
-
-        if user.is_member_of(ctx, datamanagerGroupname):
-            # Example: 'datamanager-initial' is groupname of datamanager, second part is category
-            temp = '-'.join(datamanagerGroupname.split('-')[1:])
-            categories.append(temp)
+    # All groups the datamanager is a member of, in one query
+    for datamanagerGroupname in Query(ctx, "USER_GROUP_NAME",
+                                      "USER_NAME = '{}' AND USER_ZONE = '{}' AND USER_GROUP_NAME like 'datamanager-%'"
+                                      .format(*user.from_str(ctx, datamanagerName))):
+        # Example: 'datamanager-initial' is groupname of datamanager, second part is category
+        temp = '-'.join(datamanagerGroupname.split('-')[1:])
+        categories.append(temp)
 
     return categories
 
@@ -456,6 +479,11 @@ def rule_resource_store_monthly_storage_statistics(ctx):
     2) tier
     3) actual calculated storage for the group
 
+    Storage data of the running month is kept up to date by the daily rollup
+    (see rule_resource_store_daily_storage_statistics). This full count is a
+    snapshot for the new month and a drift check of the daily totals: groups
+    for which the totals of last month differ from the full count are logged.
+
     :param ctx:  Combined type of a callback and rei struct
 
     :returns: Storage data for each group of each category
@@ -465,6 +493,7 @@ def rule_resource_store_monthly_storage_statistics(ctx):
     # Get storage month with leading 0
     dt = datetime.today()
     md_storage_month = constants.UUMETADATASTORAGEMONTH + dt.strftime("%m")
+    md_storage_previous_month = constants.UUMETADATASTORAGEMONTH + '%0*d' % (2, (dt.month - 2) % 12 + 1)
 
     # Delete previous data for that month. Could be one year ago as this is circular buffer containing max 1 year
     iter = genquery.row_iterator(
@@ -475,92 +504,155 @@ def rule_resource_store_monthly_storage_statistics(ctx):
     for row in iter:
         avu.rm_from_group(ctx, row[1], md_storage_month, row[0])
 
-    # Get all categories
-    categories = []
-    iter = genquery.row_iterator(
-        "META_USER_ATTR_VALUE",
-        "USER_TYPE = 'rodsgroup' AND META_USER_ATTR_NAME = 'category'",
-        genquery.AS_LIST, ctx
-    )
-    for row in iter:
-        categories.append(row[0])
+    # Get category of every group
+    group_categories = get_group_categories(ctx)
 
     # Get all tiers - Standard must be present
     tiers = get_all_tiers(ctx)
 
     # List of resources and their corresponding tiers (for easy access further)
-    resource_tiers = {}
-    for resource in get_resources(ctx):
-        resource_tiers[resource] = get_tier_by_resource_name(ctx, resource)
+    resource_tiers = get_all_resource_tiers(ctx)
+
+    # Storage per group and tier, gathered for all groups at once
+    group_storage = get_group_tier_storage(ctx, zone, resource_tiers)
 
-    # Steps to be taken per group
-    steps = ['research', 'vault']
+    # Drift check of the daily maintained totals of last month.
+    # Groups modified since the last daily rollup are expected to differ.
+    modified = storage_ledger.get_storage_ledger(ctx, zone)
+    previous_storage = {}
+    for group, _, _, tier, storage in get_storage_month_data(ctx, "= '" + md_storage_previous_month + "'"):
+        previous_storage.setdefault(group, {})[tier] = storage
+
+    for group, category in group_categories.items():
+        tier_storage = group_storage.get(group, {})
+
+        for tier in tiers:
+            previous = previous_storage.get(group, {}).get(tier)
+            if group not in modified and previous is not None and previous != tier_storage.get(tier, 0):
+                log.write(ctx, 'storage drift for group <{}> on tier <{}>: {} accounted, {} counted'
+                               .format(group, tier, previous, tier_storage.get(tier, 0)))
+
+        # Write total storages as metadata on current group for any tier
+        store_group_tier_storage(ctx, md_storage_month, group, category, tiers, tier_storage)
+
+    return 'ok'
+
+
+@rule.make()
+def rule_resource_store_daily_storage_statistics(ctx):
+    """Fold the storage ledger into the storage data of the running month.
 
-    # Loop through all categories
-    for category in categories:
-        groups = get_groups_on_category(ctx, category)
+    Only groups that have been marked as modified in the ledger (see
+    storage_ledger.mark_storage_modified) in a window that has ended are
+    counted again. Their storage data for the running month is replaced and
+    the ledger entries are removed.
+
+    :param ctx:  Combined type of a callback and rei struct
+
+    :returns: Status
+    """
+    zone = user.zone(ctx)
+    md_storage_month = constants.UUMETADATASTORAGEMONTH + datetime.today().strftime("%m")
+
+    # Groups modified in windows that have ended since the last rollup.
+    # Entries of the running window are counted by the next rollup.
+    modified = storage_ledger.get_storage_ledger(ctx, zone, before=storage_ledger.current_window())
+
+    group_categories = get_group_categories(ctx)
+    groups = [group for group in modified if group in group_categories]
+
+    if groups:
+        tiers = get_all_tiers(ctx)
+        group_storage = get_group_tier_storage(ctx, zone, get_all_resource_tiers(ctx), groups)
 
         for group in groups:
-            # Per group collect totals for category and tier
-
-            # Loop though all tiers and set storage to 0
-            tier_storage = {}
-            for tier in tiers:
-                tier_storage[tier] = 0
-
-            # per group handle research and vault
-            for step in steps:
-                if step == 'research':
-                    path = '/' + zone + '/home/' + group
-                else:
-                    path = '/' + zone + '/home/vault/' + group.replace('research-', 'vault-', 1)
-
-                # Per group two statements are required to gather all data
-                # 1) data in folder itself
-                # 2) data in all subfolders of the folder
-
-                for folder in ['self', 'subfolders']:
-                    if folder == 'self':
-                        whereClause = "COLL_NAME = '" + path + "'"
-                    else:
-                        whereClause = "COLL_NAME like '" + path + "%'"
-
-                    iter = genquery.row_iterator(
-                        "SUM(DATA_SIZE), RESC_NAME",
-                        whereClause,
-                        genquery.AS_LIST, ctx
-                    )
-
-                    for row in iter:
-                        # sum up for this tier
-                        the_tier = resource_tiers[row[1]]
-                        tier_storage[the_tier] += int(row[0])
-
-            # 3) Revision erea
-            revision_path = '/' + zone + '/' + constants.UUREVISIONCOLLECTION + '/' + group
-            whereClause = "COLL_NAME like '" + revision_path + "%'"
-            iter = genquery.row_iterator(
-                "SUM(DATA_SIZE), RESC_NAME",
-                whereClause,
-                genquery.AS_LIST, ctx
-            )
-            for row in iter:
-                # sum up for this tier
-                the_tier = resource_tiers[row[1]]
-                tier_storage[the_tier] += int(row[0])
-
-            # Write total storages as metadata on current group for any tier
-            key = md_storage_month
-            # val = [category, tier, storage]
-            for tier in tiers:
-                # constructed this way to be backwards compatible (not using json.dump)
-                val = "[\"" + category + "\", \"" + tier + "\", " + str(tier_storage[tier]) + "]"
-                # write as metadata (kv-pair) to current group
-                avu.associate_to_group(ctx, group, key, val)
+            for value in Query(ctx, "META_USER_ATTR_VALUE",
+                               "USER_GROUP_NAME = '" + group + "' AND META_USER_ATTR_NAME = '" + md_storage_month + "'"):
+                avu.rm_from_group(ctx, group, md_storage_month, value)
+
+            store_group_tier_storage(ctx, md_storage_month, group, group_categories[group],
+                                     tiers, group_storage.get(group, {}))
+
+    # Remove ledger entries, unless the group was modified again in the meantime.
+    for coll_name, timestamp in modified.values():
+        try:
+            avu.rm_from_coll(ctx, coll_name, constants.UUSTORAGEMODIFIEDATTRNAME, timestamp)
+        except msi.Error:
+            pass
 
     return 'ok'
 
 
+def store_group_tier_storage(ctx, attr, group, category, tiers, tier_storage):
+    """Write storage per tier as metadata on a group.
+
+    :param ctx:          Combined type of a callback and rei struct
+    :param attr:         Storage month attribute name
+    :param group:        Group name
+    :param category:     Category of the group
+    :param tiers:        All tiers
+    :param tier_storage: Dict of tier name => storage in bytes
+    """
+    # val = [category, tier, storage]
+    for tier in tiers:
+        # constructed this way to be backwards compatible (not using json.dump)
+        val = "[\"" + category + "\", \"" + tier + "\", " + str(tier_storage.get(tier, 0)) + "]"
+        # write as metadata (kv-pair) to current group
+        avu.associate_to_group(ctx, group, attr, val)
+
+
+def get_group_tier_storage(ctx, zone, resource_tiers, groups=None):
+    """Sum up storage per group and tier.
+
+    Instead of aggregating per group, storage is summed per collection and
+    resource in one grouped query per area. Sums are attributed to groups
+    based on the collection path:
+    1) research area: /zone/home/research-x/... belongs to research-x
+    2) vault area:    /zone/home/vault-x/...    belongs to research-x
+    3) revisions:     /zone/yoda/revisions/x/... belongs to x
+    Other collections in home are attributed to the group with the same name.
+
+    :param ctx:            Combined type of a callback and rei struct
+    :param zone:           Zone name
+    :param resource_tiers: Dict of resource name => tier name (see get_all_resource_tiers)
+    :param groups:         Only count storage of these groups (defaults to all groups in the zone)
+
+    :returns: Dict of group name => dict of tier name => storage in bytes
+    """
+    group_storage = {}
+
+    def add(group, resource, size):
+        tier = resource_tiers.get(resource, constants.UUDEFAULTRESOURCETIER)
+        tier_storage = group_storage.setdefault(group, {})
+        tier_storage[tier] = tier_storage.get(tier, 0) + size
+
+    home = '/' + zone + '/home/'
+    revisions = '/' + zone + constants.UUREVISIONCOLLECTION + '/'
+
+    if groups is None:
+        conditions = [(home, "COLL_NAME like '" + home + "%'"),
+                      (revisions, "COLL_NAME like '" + revisions + "%'")]
+    else:
+        conditions = []
+        for group in groups:
+            names = [(home, group), (revisions, group)]
+            if group.startswith(constants.IIGROUPPREFIX):
+                names.append((home, constants.IIVAULTPREFIX + group[len(constants.IIGROUPPREFIX):]))
+
+            for root, name in names:
+                conditions += [(root, "COLL_NAME = '" + root + name + "'"),
+                               (root, "COLL_NAME like '" + root + name + "/%'")]
+
+    for root, condition in conditions:
+        for size, coll_name, resource in Query(ctx, "SUM(DATA_SIZE), COLL_NAME, RESC_NAME", condition):
+            name = coll_name[len(root):].split('/')[0]
+            if root == home and name.startswith(constants.IIVAULTPREFIX):
+                name = constants.IIGROUPPREFIX + name[len(constants.IIVAULTPREFIX):]
+            add(name, resource, int(size))
+
+    return group_storage
+
+
 def resource_exists(ctx, resource_name):
     """Check whether given resource actually exists."""
     iter = genquery.row_iterator(
@@ -576,6 +668,29 @@ def resource_exists(ctx, resource_name):
     return False
 
 
+def get_all_resource_tiers(ctx):
+    """Get the tier of every resource that has a tier set, in one query.
+
+    Resources that are not present in the result are on the default tier.
+
+    :param ctx: Combined type of a callback and rei struct
+
+    :returns: Dict of resource name => tier name
+    """
+    resource_tiers = {}
+
+    iter = genquery.row_iterator(
+        "RESC_NAME, META_RESC_ATTR_VALUE",
+        "META_RESC_ATTR_NAME = '" + constants.UURESOURCETIERATTRNAME + "'",
+        genquery.AS_LIST, ctx
+    )
+
+    for row in iter:
+        resource_tiers[row[0]] = row[1]
+
+    return resource_tiers
+
+
 def get_all_tiers(ctx):
     """List all tiers currently present including 'Standard'."""
     tiers = [constants.UUDEFAULTRESOURCETIER]
@@ -610,6 +725,25 @@ def get_categories(ctx):
     return categories
 
 
+def get_group_categories(ctx):
+    """Get category of all groups that have one.
+
+    :param ctx: Combined type of a callback and rei struct
+
+    :returns: Dict of group name => category
+    """
+    group_categories = {}
+    iter = genquery.row_iterator(
+        "USER_NAME, META_USER_ATTR_VALUE",
+        "USER_TYPE = 'rodsgroup' AND  META_USER_ATTR_NAME  = 'category'",
+        genquery.AS_LIST, ctx
+    )
+    for row in iter:
+        group_categories[row[0]] = row[1]
+
+    return group_categories
+
+
 def get_groups_on_category(ctx, category):
     """Get all groups for category."""
     groups = []
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Storage ledger: groups whose storage changed since the last daily rollup.
+
+The ledger entry of a group is an AVU on the home collection of the group,
+holding the start of the daily window in which its storage was modified.
+The daily rollup (see resources.rule_resource_store_daily_storage_statistics)
+counts groups with entries of windows that have ended, and removes those
+entries.
+"""
+
+__copyright__ = 'Copyright (c) 2020, Utrecht University'
+__license__   = 'GPLv3, see LICENSE'
+
+import time
+
+from util import *
+from util.query import Query
+
+STORAGE_LEDGER_WINDOW = 86400
+"""Length in seconds of the windows in which storage modifications are recorded."""
+
+
+def current_window():
+    """Get the start of the running ledger window, as a Unix timestamp."""
+    now = int(time.time())
+    return now - now % STORAGE_LEDGER_WINDOW
+
+
+def get_storage_ledger(ctx, zone, before=None):
+    """Get groups marked as modified in the storage ledger.
+
+    :param ctx:    Combined type of a callback and rei struct
+    :param zone:   Zone name
+    :param before: Only include entries of windows starting before this timestamp
+
+    :returns: Dict of group name => (home collection, ledger timestamp)
+    """
+    ledger = {}
+    for coll_name, timestamp in Query(ctx, "COLL_NAME, META_COLL_ATTR_VALUE",
+                                      "COLL_NAME like '/" + zone + "/home/%' AND META_COLL_ATTR_NAME = '"
+                                      + constants.UUSTORAGEMODIFIEDATTRNAME + "'"):
+        if before is None or int(timestamp) < before:
+            ledger[coll_name.split('/')[3]] = (coll_name, timestamp)
+
+    return ledger
+
+
+def mark_storage_modified(ctx, path):
+    """Record in the storage ledger that the storage of the group owning a path has changed.
+
+    The ledger entry is an AVU on the home collection of the group, so that
+    it can be written by any user with write access to the group's data.
+    It is only written once per window: the rollup leaves entries of the
+    running window alone, so an existing entry for the running window
+    already covers this modification.
+    Failures are logged and otherwise ignored, as storage accounting must
+    never block data operations.
+
+    :param ctx:  Combined type of a callback and rei struct
+    :param path: Path of a data object or collection that was created, modified, moved or removed
+    """
+    info = pathutil.info(path)
+    revisions = '/' + info.zone + constants.UUREVISIONCOLLECTION + '/'
+
+    if info.space is pathutil.Space.RESEARCH:
+        group = info.group
+    elif info.space is pathutil.Space.VAULT:
+        group = constants.IIGROUPPREFIX + info.group[len(constants.IIVAULTPREFIX):]
+    elif path.startswith(revisions):
+        group = path[len(revisions):].split('/')[0]
+    else:
+        return
+
+    coll = '/' + info.zone + '/home/' + group
+    window = str(current_window())
+
+    if Query(ctx, "META_COLL_ATTR_VALUE",
+             "COLL_NAME = '" + coll + "' AND META_COLL_ATTR_NAME = '" + constants.UUSTORAGEMODIFIEDATTRNAME
+             + "' AND META_COLL_ATTR_VALUE = '" + window + "'").first() is not None:
+        return
+
+    try:
+        avu.set_on_coll(ctx, coll, constants.UUSTORAGEMODIFIEDATTRNAME, window)
+    except msi.Error as e:
+        log.write(ctx, 'Could not record storage modification of <{}>: {}'.format(path, e))
@@ -151,6 +151,13 @@ Feature: Datarequest API
         And the Yoda datarequest reviews get API is queried with request id
         Then the response status code is "200"
 
+    Scenario: Datarequest documents get
+        Given user "bodmember" is authenticated
+        And datarequest exists
+        And the Yoda datarequest documents get API is queried with request id
+        Then the response status code is "200"
+        And the data request and its reviews are returned
+
     Scenario: Datarequest evaluation submit
         Given user "bodmember" is authenticated
         And datarequest exists
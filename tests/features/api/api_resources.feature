@@ -120,3 +120,13 @@ Feature: Resources API
         Examples:
             | user        | group_name        |
             | datamanager | research-initial  |
+
+    Scenario: Get a full year of monthly storage data of a category as a time series
+        Given user "<user>" is authenticated
+        And the Yoda resources API is queried for full year of monthly data for category "<category>" starting from current month backward
+        Then the response status code is "200"
+        And full year storage time series is found
+
+        Examples:
+            | user        | category |
+            | datamanager | initial  |
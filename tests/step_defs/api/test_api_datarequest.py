@@ -230,6 +230,15 @@ def api_datarequest_reviews_get(user, datarequest_id):
     )
 
 
+@given('the Yoda datarequest documents get API is queried with request id', target_fixture="api_response")
+def api_datarequest_documents_get(user, datarequest_id):
+    return api_request(
+        user,
+        "datarequest_documents_get",
+        {"request_id": datarequest_id}
+    )
+
+
 @given('the datarequest evaluation submit API is queried with request id', target_fixture="api_response")
 def api_datarequest_evaluation_submit(user, datarequest_id):
     return api_request(
@@ -285,6 +294,15 @@ def request_status(user, datarequest_id, status):
     assert body['data']['requestStatus'] == status
 
 
+@then('the data request and its reviews are returned')
+def documents_returned(api_response):
+    _, body = api_response
+
+    assert body['data']['requestStatus'] == "REVIEWED"
+    assert len(body['data']['datarequest']) > 0
+    assert len(body['data']['reviews']) > 0
+
+
 @then('the result is "<result>"')
 def result_is(api_response, result):
     _, body = api_response
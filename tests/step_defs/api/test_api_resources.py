@@ -238,6 +238,29 @@ def api_response_full_year_storage(api_response):
         break
 
 
+@given('the Yoda resources API is queried for full year of monthly data for category "<category>" starting from current month backward', target_fixture="api_response")
+def api_get_full_year_category_data(user, category):
+    from datetime import datetime
+    current_month = datetime.now().month
+
+    return api_request(
+        user,
+        "resource_full_year_category_data",
+        {"category": category, "current_month": current_month}
+    )
+
+
+@then('full year storage time series is found')
+def api_response_full_year_storage_series(api_response):
+    _, body = api_response
+
+    # A dict like following
+    # {'months': [11, 12, ..., 10], 'tiers': {'Standard': [None, ..., 6772]}}
+    assert len(body['data']['months']) == 12
+    for tier in body['data']['tiers']:
+        assert len(body['data']['tiers'][tier]) == 12
+
+
 @then(parsers.parse('the response status code is "{code:d}"'))
 def api_response_code(api_response, code):
     http_status, _ = api_response
@@ -0,0 +1,7 @@
+#!/bin/sh
+group="$2"
+# The whole directory is only rebuilt by tools/update-group-directory.r.
+case "$group" in
+    ""|*[!a-z0-9-]*) exit 1 ;;
+esac
+irule -r irods_rule_engine_plugin-irods_rule_language-instance -F /etc/irods/irods-ruleset-uu/tools/update-group-directory.r '*group="'"$group"'"'
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import io
+import json
+import os
+import sys
+import time
+
+import jsonschema
+
+# usage: ./benchmark-datarequest-validation.py [number of validations] [schema name]
+
+# This script measures datarequest form validation throughput from the local
+# schemas, comparing reading, parsing and compiling the schemas per validation
+# with a single compiled validator (as cached by datarequest_schema_load).
+
+validations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+schema_name = sys.argv[2] if len(sys.argv) > 2 else 'datarequest'
+
+schema_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'datarequest', 'schemas', 'youth-0', schema_name)
+
+data = {}
+
+
+def read(name):
+    with io.open(os.path.join(schema_dir, name), encoding='utf-8') as f:
+        return json.loads(f.read())
+
+
+def run(name, f):
+    t = time.time()
+    f()
+    t = time.time() - t
+    print('{:40} {:8.2f}s {:10.1f} validations/s'.format(name, t, validations / t))
+
+
+def uncached():
+    for _ in range(validations):
+        schema = read('schema.json')
+        read('uischema.json')
+        list(jsonschema.Draft7Validator(schema).iter_errors(data))
+
+
+def cached():
+    validator = jsonschema.Draft7Validator(read('schema.json'))
+    read('uischema.json')
+    for _ in range(validations):
+        list(validator.iter_errors(data))
+
+
+run('read, parse and compile per validation', uncached)
+run('compiled validator', cached)
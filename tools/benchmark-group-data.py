@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import random
+import re
+import sys
+import time
+
+# usage: ./benchmark-group-data.py [number of groups] [number of users] [query latency in ms]
+
+# This script counts the genqueries, result pages and rows needed to gather the
+# group data of a single user (see api_group_data_filtered), for several values
+# of GROUP_QUERY_CHUNK, compared with reading the group data of the whole zone.
+# The iCAT is stubbed by in-memory tables; with a real iCAT every query and
+# every page of MAX_SQL_ROWS rows also costs a round trip, which is estimated
+# using the given query latency.
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'unit-tests'))
+
+import fake_irods
+import group
+from util.query import MAX_SQL_ROWS
+
+groups  = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+users   = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+latency = float(sys.argv[3]) if len(sys.argv) > 3 else 2.0
+
+zone = 'tempZone'
+
+random.seed(1)
+
+group_attrs   = {}  # group name => [(attr, value)]
+group_members = {}  # group name => [user name]
+user_groups   = {}  # user name => [group name]
+
+user_names = ['user{:05}@example.org'.format(i) for i in range(users)]
+group_names = ['research-{:05}'.format(i) for i in range(groups)]
+
+
+def add_member(group_name, user_name):
+    group_members.setdefault(group_name, []).append(user_name)
+    user_groups.setdefault(user_name, []).append(group_name)
+
+
+for name in group_names:
+    suffix = name.split('-', 1)[1]
+    group_attrs[name] = [('category', 'category{}'.format(random.randint(0, 50))),
+                         ('subcategory', 'subcategory{}'.format(random.randint(0, 10))),
+                         ('description', '.'),
+                         ('data_classification', 'unspecified')]
+    members = random.sample(user_names, random.randint(1, 20))
+    for user_name in members:
+        add_member(name, user_name)
+    for user_name in members[:random.randint(1, 3)]:
+        group_attrs[name].append(('manager', user_name + '#' + zone))
+    for user_name in random.sample(user_names, random.randint(0, 5)):
+        add_member('read-' + suffix, user_name)
+    group_attrs['read-' + suffix] = []
+    group_attrs['vault-' + suffix] = []
+    add_member('vault-' + suffix, 'rods')
+
+# Users that are member of many groups, e.g. data managers and support staff.
+profiles = [('member of 1 group', min(user_names, key=lambda u: len(user_groups.get(u, [])) or users))]
+for size in [10, 100, 1000]:
+    if size < groups:
+        user_name = 'power{}@example.org'.format(size)
+        for name in random.sample(group_names, size):
+            add_member(name, user_name)
+        profiles.append(('member of {} groups'.format(size), user_name))
+
+pages = [0]
+
+
+def query(columns, conditions):
+    names = None
+    match = re.search(r"USER_GROUP_NAME in \((.*)\)", conditions)
+    if match:
+        names = re.findall(r"'([^']*)'", match.group(1))
+
+    if columns == ['USER_GROUP_NAME']:
+        user_name = conditions.split("'")[1]
+        rows = [[name] for name in user_groups.get(user_name, [])]
+    elif "USER_TYPE = 'rodsgroup'" in conditions:
+        rows = [[name, attr, value]
+                for name in (names if names is not None else sorted(group_attrs))
+                for attr, value in group_attrs.get(name, [('', '')])]
+    else:
+        rows = [[name, user_name, zone]
+                for name in (names if names is not None else sorted(group_members))
+                for user_name in group_members.get(name, [])]
+
+    pages[0] += max(1, -(-len(rows) // MAX_SQL_ROWS))
+    return rows
+
+
+def run(title, f):
+    ctx = fake_irods.FakeCtx(query=query)
+    pages[0] = 0
+    t = time.time()
+    f(ctx)
+    t = time.time() - t
+    longest = max(len(conditions) for _, conditions in ctx.queries)
+    print('{:34} {:6} queries {:6} pages {:8} rows {:8.3f}s (+{:.2f}s at {}ms per page)  longest condition {:6} chars'
+          .format(title, len(ctx.queries), pages[0], ctx.rows, t, pages[0] * latency / 1000, latency, longest))
+
+
+def filtered(user_name):
+    def f(ctx):
+        group_names = set()
+        for name in fake_irods.util.query.Query(ctx, "USER_GROUP_NAME",
+                                                "USER_NAME = '{}' AND USER_ZONE = '{}'".format(user_name, zone)):
+            if name.startswith("read-"):
+                group_names.update(["research-" + name[5:], "initial-" + name[5:]])
+            else:
+                group_names.add(name)
+        group.queryGroupData(ctx, list(group_names))
+    return f
+
+
+print('{} groups, {} users, {} memberships, {} group attributes'
+      .format(groups, users, sum(map(len, group_members.values())), sum(map(len, group_attrs.values()))))
+
+run('whole zone', lambda ctx: group.queryGroupData(ctx))
+
+default_chunk = group.GROUP_QUERY_CHUNK
+for title, user_name in profiles:
+    print('\n' + title)
+    for chunk in [1, 16, 64, 256, 1024]:
+        group.GROUP_QUERY_CHUNK = chunk
+        run('  GROUP_QUERY_CHUNK = {}{}'.format(chunk, ' (default)' if chunk == default_chunk else ''),
+            filtered(user_name))
+group.GROUP_QUERY_CHUNK = default_chunk
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# usage: ./benchmark-integrity-hashing.py [number of files] [file size in MiB] [threads]
+
+# This script measures checksum throughput of the integrity check hashing
+# engine over local temporary files, comparing the previous 8 KiB
+# single-threaded reads with large buffer reads and with the thread pool that
+# integrity.checkDataObjects uses (integrity_hash.file_checksums).
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import integrity_hash
+
+files     = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+size_mib  = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+threads   = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+tmpdir = tempfile.mkdtemp(prefix='integrity-bench-')
+
+try:
+    paths = []
+    for i in range(files):
+        path = os.path.join(tmpdir, 'file{}'.format(i))
+        with open(path, 'wb') as f:
+            for _ in range(size_mib):
+                f.write(os.urandom(1024 * 1024))
+        paths.append(path)
+
+    total_mib = files * size_mib
+
+    for algorithm in ['md5', 'sha256']:
+        jobs = [(p, algorithm) for p in paths]
+
+        def run(name, f):
+            t = time.time()
+            f()
+            t = time.time() - t
+            print('{:8} {:32} {:8.2f}s {:10.1f} MiB/s'.format(algorithm, name, t, total_mib / t))
+
+        run('8 KiB buffer, 1 thread',
+            lambda: [integrity_hash.file_checksum(f, a, buffer_size=8192) for f, a in jobs])
+        run('4 MiB buffer, 1 thread',
+            lambda: [integrity_hash.file_checksum(f, a) for f, a in jobs])
+        run('4 MiB buffer, thread pool',
+            lambda: integrity_hash.file_checksums(jobs, threads))
+finally:
+    shutil.rmtree(tmpdir)
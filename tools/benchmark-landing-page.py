@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import io
+import os
+import sys
+import time
+
+import jinja2
+
+# usage: ./benchmark-landing-page.py [number of landing pages] [template]
+
+# This script measures landing page rendering throughput from a local
+# template, comparing a new Jinja environment and template compilation per
+# landing page with a single compiled template (as cached by json_landing_page).
+
+pages    = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+template = sys.argv[2] if len(sys.argv) > 2 else \
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'templates', 'landingpage.html.j2')
+
+with io.open(template, encoding='utf-8') as f:
+    source = f.read()
+
+metadata = {'title':                   u'Benchmark landing page',
+            'description':             u'Landing page rendered by benchmark <script>',
+            'disciplines':             [u'Natural Sciences - Earth and related environmental sciences (1.5)'],
+            'version':                 u'1.0',
+            'language':                u'en - English',
+            'tags':                    [u'benchmark', u'landing page'],
+            'creators':                [],
+            'contributors':            [],
+            'contacts':                [],
+            'publication_date':        u'2021-01-01',
+            'data_access_restriction': u'Open - freely retrievable',
+            'license':                 u'Creative Commons Attribution 4.0 International Public License',
+            'persistent_identifier_datapackage': {'Identifier_Scheme': u'DOI', 'Identifier': u'10.00012/UU01-BENCH'}}
+
+
+def environment():
+    return jinja2.Environment(autoescape=True,
+                              extensions=['jinja2.ext.autoescape'])
+
+
+def run(name, f):
+    t = time.time()
+    f()
+    t = time.time() - t
+    print('{:40} {:8.2f}s {:10.1f} pages/s'.format(name, t, pages / t))
+
+
+def uncached():
+    for _ in range(pages):
+        environment().from_string(source).render(**metadata)
+
+
+def cached():
+    tm = environment().from_string(source)
+    for _ in range(pages):
+        tm.render(**metadata)
+
+
+run('environment and compile per page', uncached)
+run('compiled template', cached)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import bisect
+import os
+import random
+import sys
+import time
+
+# usage: ./benchmark-storage-statistics.py [number of groups] [query latency in ms]
+
+# This script counts the genqueries and measures the runtime needed to gather
+# monthly storage statistics of all groups, comparing the per-group queries
+# used before with the grouped aggregate queries of get_group_tier_storage.
+# The iCAT is stubbed by an in-memory table; with a real iCAT every query also
+# costs a round trip, which is estimated using the given query latency.
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'unit-tests'))
+
+import fake_irods
+import resources
+from util import constants
+
+groups  = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+latency = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+
+zone      = 'tempZone'
+home      = '/' + zone + '/home/'
+revisions = '/' + zone + constants.UUREVISIONCOLLECTION + '/'
+tiers     = {'irodsResc': 'Standard', 'irodsRescRepl': 'Archive'}
+
+random.seed(1)
+
+# Data sizes per (collection, resource), sorted by collection name.
+table = []
+names = ['research-{:05}'.format(i) for i in range(groups)]
+for name in names:
+    colls = [home + name] + [home + name + '/dir{}'.format(i) for i in range(5)]
+    colls += [home + 'vault-' + name[len('research-'):]] \
+        + [home + 'vault-' + name[len('research-'):] + '/pkg{}'.format(i) for i in range(3)]
+    colls += [revisions + name + '/dir{}'.format(i) for i in range(2)]
+    for coll in colls:
+        for resource in tiers:
+            table.append((coll, resource, random.randint(0, 1 << 30)))
+table.sort()
+keys = [coll for coll, _, _ in table]
+
+
+def query(columns, conditions):
+    """Answer "SUM(DATA_SIZE)" queries grouped by the other selected columns."""
+    coll = conditions.split("'")[1]
+    if ' like ' in conditions:
+        prefix = coll.rstrip('%')
+        rows = table[bisect.bisect_left(keys, prefix):bisect.bisect_left(keys, prefix + '\xff')]
+    else:
+        rows = table[bisect.bisect_left(keys, coll):bisect.bisect_right(keys, coll)]
+
+    sums = {}
+    for coll, resource, size in rows:
+        key = (coll, resource) if 'COLL_NAME' in columns else (resource,)
+        sums[key] = sums.get(key, 0) + size
+    return [[str(size)] + list(group_by) for group_by, size in sorted(sums.items())]
+
+
+def per_group(ctx):
+    """Storage per group and tier, queried per group as done before grouped aggregation."""
+    group_storage = {}
+    for group in names:
+        tier_storage = group_storage.setdefault(group, {})
+        paths = [home + group, home + group.replace('research-', 'vault-', 1)]
+        conditions = []
+        for path in paths:
+            conditions += ["COLL_NAME = '" + path + "'", "COLL_NAME like '" + path + "/%'"]
+        conditions.append("COLL_NAME like '" + revisions + group + "/%'")
+
+        for condition in conditions:
+            for size, resource in fake_irods.util.query.Query(ctx, "SUM(DATA_SIZE), RESC_NAME", condition):
+                tier_storage[tiers[resource]] = tier_storage.get(tiers[resource], 0) + int(size)
+    return group_storage
+
+
+def grouped(ctx):
+    return resources.get_group_tier_storage(ctx, zone, tiers)
+
+
+def run(title, f):
+    ctx = fake_irods.FakeCtx(query=query)
+    t = time.time()
+    result = f(ctx)
+    t = time.time() - t
+    print('{:24} {:8} queries {:10} rows {:10.3f}s  (+{:.1f}s at {}ms per query)'
+          .format(title, len(ctx.queries), ctx.rows, t, len(ctx.queries) * latency / 1000, latency))
+    return result
+
+
+print('{} groups, {} collection/resource sums'.format(groups, len(table)))
+a = run('per group', per_group)
+b = run('get_group_tier_storage', grouped)
+assert all(a[group] == b[group] for group in names)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import random
+import string
+import sys
+import time
+
+# usage: ./benchmark-user-search.py [number of users] [number of searches] [limit]
+
+# This script measures user search latency of the prefix index used by the
+# group manager's user autocomplete, compared with a linear substring scan.
+# Short patterns have many prefix matches, long patterns have fewer than
+# [limit] prefix matches, so searches that include substring matches fall
+# back to a scan.
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import prefix_index
+
+users    = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+searches = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+limit    = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+
+random.seed(1)
+
+
+def name():
+    return ''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(4, 12))) \
+        + '@' + random.choice(['uu.nl', 'students.uu.nl', 'example.org'])
+
+
+names = ['{}#tempZone'.format(name()) for _ in range(users)]
+short_patterns = [random.choice(names)[:random.randint(1, 4)] for _ in range(searches)]
+long_patterns  = [random.choice(names)[:random.randint(5, 8)] for _ in range(searches)]
+
+t = time.time()
+index = prefix_index.PrefixIndex(names)
+print('{:32} {:10.3f}s'.format('build index of {} users'.format(len(index)), time.time() - t))
+
+
+def run(title, patterns, f):
+    t = time.time()
+    for pattern in patterns:
+        f(pattern)
+    t = time.time() - t
+    print('{:32} {:10.3f}ms per search'.format(title, 1000 * t / searches))
+
+
+for kind, patterns in [('short', short_patterns), ('long', long_patterns)]:
+    print('{} patterns:'.format(kind))
+    run('  substring scan', patterns, lambda pattern: sorted(n for n in names if pattern in n.split('#')[0])[:limit])
+    run('  prefix index', patterns, lambda pattern: index.search(pattern, limit=limit))
+    run('  prefix index with substrings', patterns, lambda pattern: index.search(pattern, limit=limit, substring=True))
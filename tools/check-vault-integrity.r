@@ -1,6 +1,7 @@
+# Use *start="-1" to resume an interrupted check after the last completed batch.
 check {
-        rule_integrity_check_vault("0", *batch, *pause, *delay);
+        rule_integrity_check_vault(*start, *batch, *budget, *delay, *interval);
 }
 
-input *batch="256", *pause="0.5", *delay="60"
+input *start="0", *batch="256", *budget="104857600", *delay="60", *interval="365"
 output ruleExecOut
@@ -0,0 +1,19 @@
+# Run daily to update storage statistics of groups modified since the last run
+run {
+	uuGetUserType("$userNameClient#$rodsZoneClient", *usertype);
+
+	if (*usertype != "rodsadmin") {
+		failmsg(-1, "This script needs to be run by a rodsadmin");
+	}
+
+	# Retrieve current timestamp.
+	msiGetIcatTime(*timestamp, "human");
+	writeLine('stdout', '[' ++ *timestamp ++ '] Updating storage statistics of modified groups');
+
+	*result = rule_resource_store_daily_storage_statistics();
+
+	writeLine('stdout', 'Status: Finished updating storage statistics');
+	writeLine('stdout', *result);
+}
+input null
+output ruleExecOut
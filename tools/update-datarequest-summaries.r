@@ -0,0 +1,15 @@
+# Rebuild the browse summaries of all data requests (or of a single data
+# request collection, when given).
+updateDatarequestSummaries {
+	uuGetUserType("$userNameClient#$rodsZoneClient", *usertype);
+
+	if (*usertype != "rodsadmin") {
+		failmsg(-1, "This script needs to be run by a rodsadmin");
+	}
+
+	*status = "";
+	rule_datarequest_summary_update(*coll, *status);
+	writeLine("stdout", "Data request summary update: *status");
+}
+input *coll=""
+output ruleExecOut
@@ -0,0 +1,15 @@
+# Update the group directory for a single group, or rebuild it for all groups
+# when no group is given (run periodically to reconcile the directory).
+updateGroupDirectory {
+	uuGetUserType("$userNameClient#$rodsZoneClient", *usertype);
+
+	if (*usertype != "rodsadmin") {
+		failmsg(-1, "This script needs to be run by a rodsadmin");
+	}
+
+	*status = "";
+	rule_group_directory_update(*group, *status);
+	writeLine("stdout", "Group directory update: *status");
+}
+input *group=""
+output ruleExecOut
@@ -1,33 +1,11 @@
+# Update the landing pages (and optionally DataCite metadata) of all published vault packages.
+#
+# An interrupted run is resumed: vault packages that were already updated in
+# the current run are skipped. Use *restart="yes" to start a new run.
 updatePublications() {
-	# Scan for published vault packages.
-	*ContInxOld = 1;
-	msiAddSelectFieldToGenQuery("COLL_NAME", "", *GenQ2Inp);
-	msiAddConditionToGenQuery("COLL_NAME", "like", "%%/home/vault-%%", *GenQ2Inp);
-	msiAddConditionToGenQuery("META_COLL_ATTR_NAME", "=", UUORGMETADATAPREFIX ++ "vault_status", *GenQ2Inp);
-	msiAddConditionToGenQuery("META_COLL_ATTR_VALUE", "=", PUBLISHED, *GenQ2Inp);
-
-	msiExecGenQuery(*GenQ2Inp, *GenQ2Out);
-	msiGetContInxFromGenQueryOut(*GenQ2Out, *ContInxNew);
-
-	while(*ContInxOld > 0) {
-		foreach(*row in *GenQ2Out) {
-			*collName = *row.COLL_NAME;
-
-			# Check if this really is a vault package
-			if (*collName like regex "/[^/]+/home/vault-.*") {
-                *status = ''
-                *statusInfo = '';
-                rule_update_publication(*collName, *status, *statusInfo);
-                writeLine("stdout", "*collName: *status *statusInfo");
-			}
-		}
-
-		*ContInxOld = *ContInxNew;
-		if(*ContInxOld > 0) {
-			msiGetMoreRows(*GenQ2Inp, *GenQ2Out, *ContInxNew);
-		}
-	}
-	msiCloseGenQuery(*GenQ2Inp, *GenQ2Out);
+	*status = '';
+	rule_update_publications(*restart, *datacite, *workers, *status);
+	writeLine("stdout", *status);
 }
-input null
+input *restart="no", *datacite="no", *workers="4"
 output ruleExecOut
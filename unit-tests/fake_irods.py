@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Stand-ins for the iRODS Python rule engine, to run ruleset code outside of iRODS.
+
+Importing this module registers fake irods_types, session_vars and genquery
+modules and puts the ruleset on sys.path, so that ruleset modules can be
+imported as usual.  FakeCtx answers genqueries from a Python function and
+records every other microservice or rule call, so that tests and benchmarks
+can count round trips to the iCAT.
+
+Example:
+
+    import fake_irods
+    import resources
+
+    ctx = fake_irods.FakeCtx(query=lambda columns, conditions: [['a', 'b']])
+    resources.get_groups_on_categories(ctx, ['research'])
+    print(len(ctx.queries))
+
+The unit tests in this directory are run with the ruleset's requirements
+installed, using Python 2.7:
+
+    cd unit-tests && python -m unittest discover
+"""
+
+__copyright__ = 'Copyright (c) 2020, Utrecht University'
+__license__   = 'GPLv3, see LICENSE'
+
+import os
+import sys
+import threading
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+class Struct(object):
+    """Generic iRODS struct stand-in: any attribute can be set, unset attributes default to 0."""
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.__dict__.update(kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return 0
+
+
+def _register(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+_register('irods_types', **dict((name, Struct) for name in
+                                ['BytesBuf', 'ExecCmdOut', 'GenQueryInp', 'GenQueryOut',
+                                 'InxIvalPair', 'InxValPair', 'KeyValPair', 'c_string',
+                                 'c_string_array', 'char_array', 'int_array']))
+
+# Tests pass the session variable map itself as rei.
+_register('session_vars', get_map=lambda rei: rei)
+
+import util  # noqa: E402
+
+# The ruleset's genquery compatibility module offers the same interface as
+# the one shipped with the rule engine.
+sys.modules['genquery'] = util.genquery
+
+
+class _Column(object):
+    def __init__(self, values):
+        self.values = values
+
+    def row(self, i):
+        return self.values[i]
+
+
+class FakeCtx(object):
+    """Callback that answers genqueries from a function and records all other calls.
+
+    :param query: Function (columns, conditions) -> list of rows (lists of strings)
+    :param calls: Dict of call name -> function (*args) -> result dict or list of output arguments
+    :param rei:   Session variable map (see session_vars.get_map)
+    """
+
+    def __init__(self, query=None, calls=None, rei=None):
+        self.query_handler = query or (lambda columns, conditions: [])
+        self.call_handlers = calls or {}
+        self.rei           = rei or {'client_user': {'user_name': 'rods', 'irods_zone': 'tempZone'}}
+        self.queries       = []  # (columns, conditions) of each executed genquery
+        self.rows          = 0   # total number of rows returned by genqueries
+        self.calls         = []  # (name, args) of each other call
+        self.threads       = set()  # names of the threads that used this callback
+        self.log           = []
+        self.stdout        = ''
+
+    def calls_to(self, name):
+        """Return the argument lists of all recorded calls to the given microservice or rule."""
+        return [args for n, args in self.calls if n == name]
+
+    def msiMakeGenQuery(self, columns, conditions, gqi):
+        return {'status': True, 'code': 0,
+                'arguments': [columns, conditions, Struct(columns=[c.strip() for c in columns.split(',')],
+                                                          conditions=conditions,
+                                                          options=0,
+                                                          rowOffset=0)]}
+
+    def msiExecGenQuery(self, gqi, gqo):
+        self.threads.add(threading.current_thread().name)
+        self.queries.append((gqi.columns, gqi.conditions))
+        rows = [list(row) for row in self.query_handler(gqi.columns, gqi.conditions)]
+        self.rows += len(rows)
+        result = rows[gqi.rowOffset:]
+        return {'status': True, 'code': 0,
+                'arguments': [gqi, Struct(rowCnt=len(result),
+                                          attriCnt=len(gqi.columns),
+                                          continueInx=0,
+                                          totalRowCount=len(rows),
+                                          sqlResult=[_Column([row[i] for row in result])
+                                                     for i in range(len(gqi.columns))])]}
+
+    def msiGetMoreRows(self, gqi, gqo, cti):
+        return {'status': True, 'code': 0, 'arguments': [gqi, Struct(rowCnt=0), 0]}
+
+    def writeLine(self, stream, text):
+        self.log.append(text)
+
+    def writeString(self, stream, text):
+        self.stdout += text
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def call(*args):
+            self.threads.add(threading.current_thread().name)
+            self.calls.append((name, args))
+            result = self.call_handlers[name](*args) if name in self.call_handlers else None
+            if isinstance(result, dict):
+                return result
+            return {'status': True, 'code': 0,
+                    'arguments': list(args) if result is None else list(result)}
+        return call
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for requests to DataCite."""
+
+__copyright__ = 'Copyright (c) 2020, Utrecht University'
+__license__   = 'GPLv3, see LICENSE'
+
+from unittest import TestCase
+
+import fake_irods  # noqa: F401
+import requests
+
+import datacite
+
+
+class Response(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class StubSession(object):
+    """HTTP session that replies with the given status codes, in order."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return Response(reply)
+
+
+class DataCiteRequestTest(TestCase):
+
+    def setUp(self):
+        self.backoff = datacite.BACKOFF
+        datacite.BACKOFF = 0
+
+    def tearDown(self):
+        datacite.BACKOFF = self.backoff
+        datacite._session = None
+
+    def request(self, replies, method, idempotent=True):
+        datacite._session = StubSession(replies)
+        before = datacite.metrics()
+        response = datacite.request(method, 'https://datacite.test/doi/10.5072/X', idempotent=idempotent)
+        after = datacite.metrics()
+
+        return response, datacite._session.requests, dict((k, after[k] - before[k]) for k in after)
+
+    def test_retry_transient_status(self):
+        response, sent, metrics = self.request([429, 200], 'PUT')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(sent), 2)
+        self.assertEqual((metrics['requests'], metrics['retries'], metrics['errors']), (1, 1, 0))
+
+    def test_retry_connection_error(self):
+        response, sent, metrics = self.request([requests.exceptions.ConnectionError(), 201], 'GET')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(sent), 2)
+
+    def test_give_up_after_retries(self):
+        response, sent, metrics = self.request([503] * (datacite.RETRIES + 1), 'DELETE')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(sent), datacite.RETRIES + 1)
+        self.assertEqual((metrics['requests'], metrics['retries'], metrics['errors']), (1, datacite.RETRIES, 1))
+
+    def test_no_retry_non_idempotent(self):
+        response, sent, metrics = self.request([500, 201], 'POST', idempotent=False)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(sent, [('POST', 'https://datacite.test/doi/10.5072/X')])
+        self.assertEqual((metrics['requests'], metrics['retries'], metrics['errors']), (1, 0, 1))
+
+    def test_no_retry_client_error(self):
+        response, sent, metrics = self.request([404, 200], 'GET')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(sent), 1)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for browsing data requests."""
+
+__copyright__ = 'Copyright (c) 2020, Utrecht University'
+__license__   = 'GPLv3, see LICENSE'
+
+import json
+from unittest import TestCase
+
+import fake_irods
+
+import datarequest
+
+COLL = '/tempZone/home/datarequests-research'
+
+
+class DatarequestBrowseTest(TestCase):
+
+    def setUp(self):
+        # Data request id => (status, title, has summary)
+        self.requests = {'1001': ('SUBMITTED', 'First', True),
+                         '1002': ('APPROVED', 'Second', True),
+                         '1003': ('DAO_SUBMITTED', 'Third', True)}
+
+    def query(self, columns, conditions):
+        ids = sorted(self.requests)
+        if "META_DATA_ATTR_NAME = 'browse_summary'" in conditions:
+            return [[COLL + '/' + x, '1577836800', 'researcher',
+                     json.dumps(self.requests[x][:2]), self.requests[x][1]]
+                    for x in ids if self.requests[x][2]]
+        elif "META_DATA_ATTR_NAME = 'status'" in conditions:
+            if len(columns) == 1:
+                return [[COLL + '/' + x] for x in ids]
+            return [[COLL + '/' + x, '1577836800', 'researcher', self.requests[x][0]] for x in ids]
+        elif "META_DATA_ATTR_NAME = 'title'" in conditions:
+            return [[COLL + '/' + x, self.requests[x][1]] for x in ids if "'{}/{}'".format(COLL, x) in conditions]
+        return []
+
+    def browse(self):
+        ctx = fake_irods.FakeCtx(query=self.query)
+        datarequest.api_datarequest_browse([json.dumps({'sort_on': 'title'})], ctx, ctx.rei)
+        result = json.loads(ctx.stdout)
+        self.assertEqual(result['status'], 'ok')
+        return ctx, result['data']
+
+    def test_browse_summaries(self):
+        ctx, data = self.browse()
+
+        self.assertEqual(len(ctx.queries), 2)
+        self.assertIn('ORDER(META_DATA_ATTR_UNITS)', ctx.queries[0][0])
+        self.assertEqual(data['total'], 3)
+        self.assertEqual([(x['id'], x['status'], x['title']) for x in data['items']],
+                         [('1001', 'SUBMITTED', 'First'),
+                          ('1002', 'APPROVED', 'Second'),
+                          ('1003', 'DAO_SUBMITTED', 'Third')])
+
+    def test_browse_without_summaries(self):
+        self.requests['1002'] = ('APPROVED', 'Second', False)
+        ctx, data = self.browse()
+
+        self.assertEqual(len(ctx.queries), 4)
+        self.assertEqual(data['total'], 3)
+        self.assertEqual([(x['id'], x['status'], x['title']) for x in data['items']],
+                         [('1001', 'SUBMITTED', 'First'),
+                          ('1002', 'APPROVED', 'Second'),
+                          ('1003', 'DAO_SUBMITTED', 'Third')])
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the group directory."""
+
+__copyright__ = 'Copyright (c) 2020, Utrecht University'
+__license__   = 'GPLv3, see LICENSE'
+
+import json
+import time
+from unittest import TestCase
+
+import fake_irods
+
+import group
+from util import constants, msi
+
+DIRECTORY = '/tempZone' + constants.UUGROUPDIRECTORY
+LOCK = '/tempZone' + constants.UUGROUPDIRECTORYLOCK
+
+
+class GroupDirectoryTest(TestCase):
+
+    def setUp(self):
+        self.objects = {}   # path => data
+        self.modified = {}  # path => modify time
+        self.pending = []   # (value, units) of the pending attribute on the system collection
+        self.fail_write = False
+        self.groups = {'research-a': 'science', 'research-b': 'science'}  # group => category
+
+    def query(self, columns, conditions):
+        if columns == ['USER_TYPE']:
+            return [['rodsadmin']]
+        elif columns == ['META_COLL_ATTR_VALUE', 'META_COLL_ATTR_UNITS']:
+            return [list(avu) for avu in self.pending]
+        elif columns == ['DATA_MODIFY_TIME']:
+            path = '/'.join(conditions.split("'")[1:4:2])
+            return [[str(self.modified[path])]] if path in self.objects else []
+        elif columns[0] == 'DATA_SIZE':
+            path = '/'.join(conditions.split("'")[1:4:2])
+            return [[str(len(self.objects[path])), '0']] if path in self.objects else []
+        elif "USER_TYPE = 'rodsgroup'" in conditions:
+            return [[name, 'category', category] for name, category in sorted(self.groups.items())
+                    if "'{}'".format(name) in conditions or ' in ' not in conditions]
+        return []
+
+    def names(self):
+        return [name for name, _ in self.pending]
+
+    def add_avu(self, kind, path, attr, value, units):
+        if (value, units) in self.pending:
+            raise RuntimeError('CATALOG_ALREADY_HAS_ITEM_BY_THAT_NAME')
+        self.pending.append((value, units))
+
+    def rmw_avu(self, kind, path, attr, value, units):
+        self.pending.remove((value, units))
+
+    def create(self, path, flags, handle):
+        if path in self.objects and 'forceFlag' not in flags:
+            raise RuntimeError('OVERWRITE_WITHOUT_FORCE_FLAG')
+        if path == DIRECTORY and self.fail_write:
+            raise RuntimeError('SYS_RESC_QUOTA_EXCEEDED')
+        self.objects[path] = ''
+        self.modified[path] = int(time.time())
+        return [path, flags, path]
+
+    def write(self, handle, data, length):
+        self.objects[handle] += data
+
+    def open(self, options, handle):
+        return [options, options.split('=', 1)[1]]
+
+    def read(self, handle, length, buf):
+        data = self.objects[handle]
+        return [handle, length, fake_irods.Struct(buf=data, len=len(data))]
+
+    def rename(self, path, target, mode, status):
+        self.objects[target] = self.objects.pop(path)
+
+    def unlink(self, options, status):
+        del self.objects[options.split('=', 1)[1].split('++++')[0]]
+
+    def update(self, group_name):
+        ctx = fake_irods.FakeCtx(query=self.query,
+                                 calls={'msi_add_avu':      self.add_avu,
+                                        'msi_rmw_avu':      self.rmw_avu,
+                                        'msiDataObjCreate': self.create,
+                                        'msiDataObjWrite':  self.write,
+                                        'msiDataObjOpen':   self.open,
+                                        'msiDataObjRead':   self.read,
+                                        'msiDataObjRename': self.rename,
+                                        'msiDataObjUnlink': self.unlink})
+        args = [group_name, '']
+        group.rule_group_directory_update(args, ctx, ctx.rei)
+        self.assertEqual(args[1], 'Success')
+        return ctx
+
+    def directory(self):
+        return dict((name, data.get('category')) for name, data in json.loads(self.objects[DIRECTORY]).items())
+
+    def test_rebuild(self):
+        self.update('')
+        self.assertEqual(self.directory(), self.groups)
+        self.assertEqual(self.pending, [])
+        self.assertNotIn(LOCK, self.objects)
+
+    def test_update_group(self):
+        self.update('')
+        self.groups['research-a'] = 'medicine'
+        del self.groups['research-b']
+        self.update('research-a')
+
+        # Only the given group is updated.
+        self.assertEqual(self.directory(), {'research-a': 'medicine', 'research-b': 'science'})
+
+    def test_update_while_locked(self):
+        self.update('')
+
+        # Updates that do not get the lock leave their group to the lock holder.
+        self.objects[LOCK] = str(2 ** 40)
+        for name in ['research-a', 'research-b']:
+            self.groups[name] = 'medicine'
+            ctx = self.update(name)
+            self.assertEqual(ctx.calls_to('msiSetACL'), [])
+        self.assertEqual(self.names(), ['research-a', 'research-b'])
+
+        # The next lock holder writes all pending groups at once.
+        del self.objects[LOCK]
+        self.groups['research-c'] = 'medicine'
+        ctx = self.update('research-c')
+        self.assertEqual(len(ctx.calls_to('msiSetACL')), 1)
+        self.assertEqual(self.directory(), {'research-a': 'medicine', 'research-b': 'medicine', 'research-c': 'medicine'})
+        self.assertEqual(self.pending, [])
+        self.assertNotIn(LOCK, self.objects)
+
+    def test_stale_lock(self):
+        self.objects[LOCK] = '0'
+        self.update('')
+        self.assertEqual(self.directory(), self.groups)
+        self.assertNotIn(LOCK, self.objects)
+
+    def test_empty_stale_lock(self):
+        # The lock of an update that died before writing the time it was taken.
+        self.objects[LOCK] = ''
+        self.modified[LOCK] = int(time.time())
+        self.update('')
+        self.assertNotIn(DIRECTORY, self.objects)
+        self.assertEqual(self.names(), [group.GROUP_DIRECTORY_REBUILD])
+
+        self.modified[LOCK] = int(time.time()) - group.GROUP_DIRECTORY_LOCK_TIMEOUT - 1
+        self.update('')
+        self.assertEqual(self.directory(), self.groups)
+        self.assertEqual(self.pending, [])
+        self.assertNotIn(LOCK, self.objects)
+
+    def test_failed_write(self):
+        self.update('')
+        self.groups['research-a'] = 'medicine'
+
+        # Pending updates are kept when the directory could not be written.
+        self.fail_write = True
+        self.assertRaises(msi.Error, self.update, 'research-a')
+        self.assertEqual(self.names(), ['research-a'])
+        self.assertNotIn(LOCK, self.objects)
+
+        self.fail_write = False
+        self.update('research-b')
+        self.assertEqual(self.directory(), self.groups)
+        self.assertEqual(self.pending, [])
+
+    def test_large_directory(self):
+        self.update('')
+        max_size = group.GROUP_DIRECTORY_MAX_SIZE
+        group.GROUP_DIRECTORY_MAX_SIZE = 10
+        try:
+            # A directory that is too large to read is rebuilt from the iCAT.
+            self.groups['research-a'] = 'medicine'
+            self.update('research-b')
+            self.assertEqual(self.directory(), self.groups)
+
+            ctx = fake_irods.FakeCtx(query=self.query, calls={'msiDataObjRead': self.read})
+            self.assertEqual(dict((x['name'], x['category']) for x in group.getGroupData(ctx)), self.groups)
+        finally:
+            group.GROUP_DIRECTORY_MAX_SIZE = max_size
+
+    def test_only_successful_changes(self):
+        for status, updates in [('0', 1), ('1', 0)]:
+            ctx = fake_irods.FakeCtx(calls={'uuGroupUserAdd': lambda g, u, s, m: [g, u, status, '']})
+            group.api_group_user_add([json.dumps({'username': 'user', 'group_name': 'research-a'})], ctx, ctx.rei)
+            self.assertEqual(len(ctx.calls_to('uuGroupDirectoryUpdate')), updates)
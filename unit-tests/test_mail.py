@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the mail queue."""
+
+__copyright__ = 'Copyright (c) 2020, Utrecht University'
+__license__   = 'GPLv3, see LICENSE'
+
+import smtplib
+from unittest import TestCase
+
+import fake_irods
+
+import mail
+from util import constants
+
+QUEUE = '/tempZone' + constants.UUMAILQUEUECOLLECTION
+MARKER = QUEUE + '/' + constants.UUMAILQUEUESCHEDULEDNAME
+
+
+class Clock(object):
+    """Stand-in for the time module."""
+
+    def __init__(self):
+        self.now = 1577836800
+
+    def time(self):
+        return self.now
+
+
+class WorkerDied(BaseException):
+    """Ends a queue worker halfway, like an agent that is killed."""
+
+
+class StubSMTP(object):
+    """Mail server that accepts all mails, except those to bounce@example.org."""
+
+    connections = 0
+    sent = []
+    hooks = []  # functions called before sending a mail
+
+    def __init__(self, host, port):
+        StubSMTP.connections += 1
+
+    def login(self, username, password):
+        pass
+
+    def sendmail(self, sender, to, msg):
+        for hook in StubSMTP.hooks:
+            hook()
+        StubSMTP.sent.append(to[0])
+        if to[0] == 'bounce@example.org':
+            raise smtplib.SMTPRecipientsRefused({to[0]: (550, 'No such user')})
+
+    def quit(self):
+        pass
+
+
+class FakeStore(object):
+    """Data objects in memory, accessed through the data object microservices."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.objects = {}
+        self.modified = {}  # path => modify time
+
+    def ctx(self):
+        return fake_irods.FakeCtx(query=self.query,
+                                  calls={'msiDataObjCreate': self.create,
+                                         'msiDataObjWrite':  self.write,
+                                         'msiDataObjOpen':   self.open,
+                                         'msiDataObjRead':   self.read,
+                                         'msiDataObjRename': self.rename,
+                                         'msiDataObjUnlink': self.unlink})
+
+    def names(self):
+        return sorted(path.split('/')[-1] for path in self.objects)
+
+    def query(self, columns, conditions):
+        if columns == ['USER_TYPE']:
+            return [['rodsadmin']]
+        elif columns == ['COLL_ID']:
+            return [['1']]
+        elif columns == ['DATA_MODIFY_TIME']:
+            path = '/'.join(conditions.split("'")[1:4:2])
+            return [[str(self.modified[path])]] if path in self.objects else []
+        elif columns[0] == 'DATA_SIZE':
+            path = '/'.join(conditions.split("'")[1:4:2])
+            return [[str(len(self.objects[path])), '0']] if path in self.objects else []
+        elif 'DATA_NAME' in columns[0]:
+            return [[name] for name in self.names()]
+        return []
+
+    def create(self, path, flags, handle):
+        if path in self.objects and 'forceFlag' not in flags:
+            raise RuntimeError('OVERWRITE_WITHOUT_FORCE_FLAG')
+        self.objects[path] = ''
+        self.modified[path] = self.clock.now
+        return [path, flags, path]
+
+    def write(self, handle, data, length):
+        self.objects[handle] += data
+        self.modified[handle] = self.clock.now
+
+    def open(self, options, handle):
+        return [options, options.split('=', 1)[1]]
+
+    def read(self, handle, length, buf):
+        data = self.objects[handle]
+        return [handle, length, fake_irods.Struct(buf=data, len=len(data))]
+
+    def rename(self, path, target, mode, status):
+        if path not in self.objects or target in self.objects:
+            raise RuntimeError('CAT_NO_ROWS_FOUND')
+        self.objects[target] = self.objects.pop(path)
+
+    def unlink(self, options, status):
+        path = options.split('=', 1)[1].split('++++')[0]
+        if path not in self.objects:
+            raise RuntimeError('CAT_NO_ROWS_FOUND')
+        del self.objects[path]
+
+
+class MailQueueTest(TestCase):
+
+    def setUp(self):
+        self.config = dict(mail.config._items)
+        mail.config._items.update(notifications_enabled=True,
+                                  notifications_sender_email='noreply@example.org',
+                                  smtp_server='smtps://smtp.example.org')
+        self.smtp = smtplib.SMTP_SSL
+        smtplib.SMTP_SSL = StubSMTP
+        StubSMTP.connections = 0
+        StubSMTP.sent = []
+        StubSMTP.hooks = []
+
+        self.clock = Clock()
+        mail.time = self.clock
+        self.store = FakeStore(self.clock)
+
+    def tearDown(self):
+        mail.config._items.clear()
+        mail.config._items.update(self.config)
+        smtplib.SMTP_SSL = self.smtp
+        mail.time = __import__('time')
+
+    def send(self, to):
+        ctx = self.store.ctx()
+        self.assertIsNone(mail.send(ctx, to, 'rods', 'Subject', 'Body'))
+        return ctx
+
+    def process(self):
+        ctx = self.store.ctx()
+        mail.rule_mail_process_queue([], ctx, ctx.rei)
+        return ctx
+
+    def test_deliver(self):
+        ctx = self.send('one@example.org')
+        self.assertEqual(len(ctx.calls_to('delayExec')), 1)
+
+        # A worker is scheduled already.
+        ctx = self.send('two@example.org')
+        self.assertEqual(ctx.calls_to('delayExec'), [])
+        self.assertEqual(len(self.store.names()), 3)
+
+        ctx = self.process()
+        self.assertEqual(sorted(StubSMTP.sent), ['one@example.org', 'two@example.org'])
+        self.assertEqual(StubSMTP.connections, 1)
+        self.assertEqual(self.store.objects, {})
+        self.assertEqual(ctx.calls_to('delayExec'), [])
+
+    def test_retry(self):
+        self.send('bounce@example.org')
+        self.send('one@example.org')
+
+        ctx = self.process()
+        self.assertEqual(sorted(StubSMTP.sent), ['bounce@example.org', 'one@example.org'])
+
+        # The undelivered mail is released with a later due time, and the worker rescheduled.
+        name, = [name for name in self.store.names() if name != constants.UUMAILQUEUESCHEDULEDNAME]
+        self.assertTrue(name.startswith('{}-'.format(self.clock.now + mail.MAIL_BACKOFF)), name)
+        self.assertIn('"attempts": 1', self.store.objects[QUEUE + '/' + name])
+        self.assertEqual([args[0] for args in ctx.calls_to('delayExec')],
+                         ['<PLUSET>{}s</PLUSET>'.format(mail.MAIL_BACKOFF)])
+        self.assertIn(MARKER, self.store.objects)
+
+        # Not due yet.
+        self.process()
+        self.assertEqual(len(StubSMTP.sent), 2)
+
+        for attempt in range(mail.MAIL_RETRIES):
+            self.clock.now += mail.MAIL_BACKOFF * 2 ** attempt
+            ctx = self.process()
+            self.assertEqual(len(StubSMTP.sent), 3 + attempt)
+
+        # Given up.
+        self.assertEqual(self.store.objects, {})
+        self.assertEqual(ctx.calls_to('delayExec'), [])
+
+    def test_send_during_delivery(self):
+        self.send('one@example.org')
+
+        sent = []
+        StubSMTP.hooks = [lambda: sent.append(self.send('two@example.org')) if not sent else None]
+        ctx = self.process()
+
+        # The mail queued during delivery did not schedule a second worker,
+        # it is picked up by the worker that is rescheduled afterwards.
+        self.assertEqual(sent[0].calls_to('delayExec'), [])
+        self.assertEqual(StubSMTP.sent, ['one@example.org'])
+        self.assertEqual([args[0] for args in ctx.calls_to('delayExec')], ['<PLUSET>1s</PLUSET>'])
+
+        self.process()
+        self.assertEqual(StubSMTP.sent, ['one@example.org', 'two@example.org'])
+        self.assertEqual(self.store.objects, {})
+
+    def test_claimed_mails(self):
+        self.send('one@example.org')
+
+        def die():
+            raise WorkerDied()
+
+        # The worker dies while delivering the mail it claimed.
+        StubSMTP.hooks = [die]
+        self.assertRaises(WorkerDied, self.process)
+        StubSMTP.hooks = []
+        name, = [name for name in self.store.names() if name != constants.UUMAILQUEUESCHEDULEDNAME]
+        self.assertTrue(name.endswith('.json.{}.claimed'.format(self.clock.now)), name)
+        self.assertEqual(len(mail.queued_mails(self.store.ctx(), QUEUE)), 1)
+
+        # The next worker delivers mails queued in the meantime, and leaves
+        # the claimed mail to its worker until the claim times out.
+        self.send('two@example.org')
+        ctx = self.process()
+        self.assertEqual(StubSMTP.sent, ['two@example.org'])
+        self.assertEqual([args[0] for args in ctx.calls_to('delayExec')],
+                         ['<PLUSET>{}s</PLUSET>'.format(mail.MAIL_CLAIM_TIMEOUT)])
+
+        # The claimed mail is claimed again once the claim has timed out.
+        self.clock.now += mail.MAIL_CLAIM_TIMEOUT
+        ctx = self.process()
+        self.assertEqual(StubSMTP.sent, ['two@example.org', 'one@example.org'])
+        self.assertEqual(self.store.objects, {})
+        self.assertEqual(ctx.calls_to('delayExec'), [])
+
+    def test_stale_marker(self):
+        self.send('one@example.org')
+
+        # The worker never ran.
+        self.clock.now += mail.MAIL_CLAIM_TIMEOUT + 1
+        ctx = self.send('two@example.org')
+        self.assertEqual(len(ctx.calls_to('delayExec')), 1)
+        self.assertEqual(self.store.objects[MARKER], str(self.clock.now + 1))
+
+    def test_empty_stale_marker(self):
+        # The marker of a worker that was not scheduled after creating it.
+        self.store.create(MARKER, '', 0)
+        ctx = self.send('one@example.org')
+        self.assertEqual(ctx.calls_to('delayExec'), [])
+
+        self.clock.now += mail.MAIL_CLAIM_TIMEOUT + 1
+        ctx = self.send('two@example.org')
+        self.assertEqual(len(ctx.calls_to('delayExec')), 1)
+        self.assertEqual(self.store.objects[MARKER], str(self.clock.now + 1))
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the publication state."""
+
+__copyright__ = 'Copyright (c) 2020, Utrecht University'
+__license__   = 'GPLv3, see LICENSE'
+
+import threading
+from unittest import TestCase
+
+import fake_irods
+
+import datacite
+import publication
+from util import constants
+
+VAULT_PACKAGE = '/tempZone/home/vault-a/package[1577836800]'
+PREFIX = constants.UUORGMETADATAPREFIX + 'publication_'
+
+# Metadata of a vault package of which the publication state was saved before.
+METADATA = [[PREFIX + 'status', 'OK'],
+            [PREFIX + 'accessRestriction', 'Open - freely retrievable'],
+            [PREFIX + 'vaultPackage', VAULT_PACKAGE],
+            [PREFIX + 'yodaDOI', '10.5072/UU01/ABCDEF'],
+            [PREFIX + 'randomId', 'ABCDEF'],
+            ['Data_Access_Restriction', 'Open - freely retrievable'],
+            [constants.IIVAULTSTATUSATTRNAME, 'PUBLISHED']]
+
+
+class PublicationStateTest(TestCase):
+
+    def load(self):
+        ctx = fake_irods.FakeCtx(query=lambda columns, conditions: METADATA)
+        state = publication.get_publication_state(ctx, VAULT_PACKAGE)
+        self.assertEqual(len(ctx.queries), 1)
+        self.assertEqual(state.vault_status, 'PUBLISHED')
+
+        return fake_irods.FakeCtx(), state
+
+    def test_save_unchanged(self):
+        ctx, state = self.load()
+        publication.save_publication_state(ctx, VAULT_PACKAGE, state)
+
+        self.assertEqual(ctx.queries, [])
+        self.assertEqual(ctx.calls, [])
+
+    def test_save_changed_key(self):
+        ctx, state = self.load()
+        state['status'] = 'Retry'
+        publication.save_publication_state(ctx, VAULT_PACKAGE, state)
+
+        self.assertEqual(ctx.queries, [])
+        writes = ctx.calls_to('msiSetKeyValuePairsToObj')
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(writes[0][1], VAULT_PACKAGE)
+        self.assertEqual(ctx.calls_to('msiString2KeyValPair')[0][0], PREFIX + 'status=Retry')
+        self.assertEqual(ctx.calls_to('msi_rmw_avu'), [])
+
+        # Saving again writes nothing.
+        ctx.calls = []
+        publication.save_publication_state(ctx, VAULT_PACKAGE, state)
+        self.assertEqual(ctx.calls, [])
+
+    def test_save_removed_key(self):
+        ctx, state = self.load()
+        state['randomId'] = ''
+        publication.save_publication_state(ctx, VAULT_PACKAGE, state)
+
+        self.assertEqual(ctx.calls_to('msiSetKeyValuePairsToObj'), [])
+        self.assertEqual([args[2] for args in ctx.calls_to('msi_rmw_avu')], [PREFIX + 'randomId'])
+
+
+class StubSession(object):
+    """DataCite stub: accepts metadata, except for DOIs ending in FAIL."""
+
+    def __init__(self):
+        self.requests = []
+        self.threads = set()
+
+    def request(self, method, url, **kwargs):
+        self.threads.add(threading.current_thread().name)
+        self.requests.append((method, url))
+
+        class Response(object):
+            status_code = 500 if url.endswith('FAIL') else 201
+        return Response()
+
+
+class UpdatePublicationsTest(TestCase):
+
+    packages = ['/tempZone/home/vault-a/package[{}]'.format(i) for i in range(6)]
+
+    def setUp(self):
+        self.patched = dict((name, getattr(publication, name))
+                            for name in ['get_publication_config', 'render_publication_update', 'upload_publication_update'])
+        publication.get_publication_config = lambda ctx: {}
+        publication.render_publication_update = lambda ctx, config, state, update_datacite: \
+            '<resource>{}</resource>'.format(state['yodaDOI']) if update_datacite else None
+        publication.upload_publication_update = lambda ctx, config, state: None
+
+        self.backoff = datacite.BACKOFF
+        datacite.BACKOFF = 0
+        datacite._session = StubSession()
+
+    def tearDown(self):
+        for name, f in self.patched.items():
+            setattr(publication, name, f)
+        datacite.BACKOFF = self.backoff
+        datacite._session = None
+
+    def query(self, columns, conditions):
+        if columns == ['USER_TYPE']:
+            return [['rodsadmin']]
+        elif constants.IIVAULTSTATUSATTRNAME in conditions:
+            return [[package] for package in self.packages]
+        elif conditions.startswith("COLL_NAME = '/tempZone/home/vault-a/"):
+            package = conditions.split("'")[1]
+            doi = '10.5072/UU01/' + ('FAIL' if package == self.packages[2] else package[-2])
+            return [[PREFIX + 'status', 'OK'],
+                    [PREFIX + 'vaultPackage', package],
+                    [PREFIX + 'yodaDOI', doi],
+                    [constants.IIVAULTSTATUSATTRNAME, 'PUBLISHED']]
+        return []
+
+    def test_update_datacite(self):
+        ctx = fake_irods.FakeCtx(query=self.query)
+        result = publication.update_publications(ctx, update_datacite=True, workers=3)
+
+        self.assertTrue(result.endswith(': 5 OK, 1 Retry'), result)
+
+        # Every package was sent, the failing one was retried.
+        sent = datacite._session.requests
+        self.assertEqual(len(sent), len(self.packages) + datacite.RETRIES)
+        self.assertEqual(set(method for method, _ in sent), set(['PUT']))
+
+        # HTTP is done by workers, the rule engine is only used by the calling thread.
+        self.assertNotIn(threading.current_thread().name, datacite._session.threads)
+        self.assertEqual(ctx.threads, set([threading.current_thread().name]))
+
+        # Only successfully updated packages are checkpointed.
+        refreshed = [args[0] for args in ctx.calls_to('msiString2KeyValPair')
+                     if args[0].startswith(constants.UUPUBLICATIONREFRESHEDATTRNAME + '=')]
+        self.assertEqual(len(refreshed), 5)
+        retried = [args[0] for args in ctx.calls_to('msiString2KeyValPair') if args[0] == PREFIX + 'status=Retry']
+        self.assertEqual(len(retried), 1)
+
+    def test_update_without_datacite(self):
+        ctx = fake_irods.FakeCtx(query=self.query)
+        result = publication.update_publications(ctx, workers=3)
+
+        self.assertTrue(result.endswith(': 6 OK'), result)
+        self.assertEqual(datacite._session.requests, [])
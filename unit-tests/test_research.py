@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the research space API and folder operations."""
+
+__copyright__ = 'Copyright (c) 2020, Utrecht University'
+__license__   = 'GPLv3, see LICENSE'
+
+import json
+from unittest import TestCase
+
+import fake_irods
+import policies
+import research
+
+import folder
+from util import constants
+
+PATH = '/tempZone/home/research-a'
+
+
+class ResearchCollectionDetailsTest(TestCase):
+
+    def details(self, members, client='rods', locked=False):
+        """Call api_research_collection_details on a group with the given number of managers and client memberships."""
+        def query(columns, conditions):
+            if columns == ['COLL_NAME']:
+                return [[PATH], ['/tempZone/home/vault-a']]
+            elif columns == ['META_COLL_ATTR_NAME', 'META_COLL_ATTR_VALUE']:
+                return [[constants.IILOCKATTRNAME, PATH]] if locked else []
+            elif columns == ['META_USER_ATTR_NAME', 'META_USER_ATTR_VALUE']:
+                return [['category', 'science']] + [['manager', 'user{}#tempZone'.format(i)] for i in range(members)]
+            elif columns == ['USER_GROUP_NAME']:
+                return [['research-a'], ['datamanager-science']] + [['research-{}'.format(i)] for i in range(members)]
+            return []
+
+        ctx = fake_irods.FakeCtx(query=query,
+                                 rei={'client_user': {'user_name': client, 'irods_zone': 'tempZone'}})
+        research.api_research_collection_details([json.dumps({'path': PATH})], ctx, ctx.rei)
+
+        return ctx, json.loads(ctx.stdout)
+
+    def test_constant_number_of_queries(self):
+        for members in [0, 10, 1000, 10000]:
+            ctx, result = self.details(members)
+            self.assertEqual(result['status'], 'ok')
+            self.assertEqual(len(ctx.queries), 4, members)
+
+    def test_details(self):
+        ctx, result = self.details(10, client='user3', locked=True)
+
+        self.assertEqual(result['data'], {'basename': 'research-a',
+                                          'status': '',
+                                          'member_type': 'manager',
+                                          'is_datamanager': True,
+                                          'lock_count': 1,
+                                          'vault_path': 'vault-a'})
+
+        ctx, result = self.details(10, client='user10')
+        self.assertEqual(result['data']['member_type'], 'normal')
+        self.assertEqual(result['data']['lock_count'], 0)
+
+
+class ResearchFileOperationTest(TestCase):
+
+    coll = '/tempZone/home/research-a/folder'
+
+    def setUp(self):
+        self.locks = []
+        self.data_locks = []
+
+    def query(self, columns, conditions):
+        if columns == ['USER_GROUP_NAME']:
+            return [['research-a']]
+        elif columns in (['META_COLL_ATTR_NAME', 'META_COLL_ATTR_VALUE'],
+                         ['META_DATA_ATTR_NAME', 'META_DATA_ATTR_VALUE']):
+            return [[constants.IILOCKATTRNAME, lock] for lock in self.locks]
+        elif columns == ['COLL_NAME']:
+            return [[self.coll]]
+        elif columns == ['DATA_NAME'] and 'META_DATA_ATTR_NAME' in conditions:
+            return [[name] for name in self.data_locks]
+        elif columns == ['DATA_NAME']:
+            return [['file.txt']]
+        return []
+
+    def delete(self, ctx):
+        research.api_research_file_delete([json.dumps({'coll': self.coll, 'file_name': 'file.txt'})], ctx, ctx.rei)
+        return json.loads(ctx.stdout)
+
+    def test_operation_queries(self):
+        ctx = fake_irods.FakeCtx(query=self.query)
+        op = folder.Operation(ctx, self.coll, data_names=['file.txt', 'copy.txt'], coll_names=['sub'])
+
+        self.assertEqual(len(ctx.queries), 5)
+        self.assertTrue(op.member)
+        self.assertFalse(op.locked)
+        self.assertTrue(op.coll_exists())
+        self.assertTrue(op.data_exists('file.txt'))
+        self.assertFalse(op.data_exists('copy.txt'))
+        self.assertFalse(folder.is_data_locked(ctx, self.coll + '/file.txt', op=op))
+        self.assertEqual(len(ctx.queries), 5)
+
+    def pep_ctx(self, client='rods'):
+        """Context of a PEP triggered by the deletion of file.txt."""
+        return fake_irods.FakeCtx(query=self.query,
+                                  rei={'client_user': {'user_name': client, 'irods_zone': 'tempZone'},
+                                       'data_object': {'object_path': self.coll + '/file.txt'}})
+
+    def test_policies_reuse_operation(self):
+        peps = []
+
+        def unlink(*args):
+            # The delete policy runs in the same agent request as the API call.
+            pep = self.pep_ctx()
+            policies.py_acDataDeletePolicy([], pep, pep.rei)
+            peps.append(pep)
+            self.assertIsNone(folder.running_operation(self.pep_ctx('other')))
+
+        ctx = fake_irods.FakeCtx(query=self.query, calls={'msiDataObjUnlink': unlink})
+        self.assertEqual(self.delete(ctx)['status'], 'ok')
+
+        self.assertEqual(peps[0].queries, [])
+        self.assertEqual(peps[0].calls_to('msiDeleteDisallowed'), [])
+        self.assertIsNone(folder.running_operation(self.pep_ctx()))
+
+    def test_policies_use_operation_lock_state(self):
+        self.data_locks = ['file.txt']
+        peps = []
+
+        def unlink(*args):
+            pep = self.pep_ctx()
+            peps.append(pep)
+            policies.py_acDataDeletePolicy([], pep, pep.rei)
+
+        ctx = fake_irods.FakeCtx(query=self.query, calls={'msiDataObjUnlink': unlink})
+        self.assertEqual(self.delete(ctx)['status'], 'error_internal')
+
+        # The data lock gathered by the operation denies the deletion, the
+        # admin check is the only query of the policy.
+        self.assertEqual(len(peps[0].calls_to('msiDeleteDisallowed')), 1)
+        self.assertEqual([columns for columns, _ in peps[0].queries], [['USER_TYPE']])
+
+    def test_state_is_scoped_to_the_call(self):
+        ctx = fake_irods.FakeCtx(query=self.query)
+        self.assertEqual(self.delete(ctx)['status'], 'ok')
+        self.assertEqual(len(ctx.calls_to('msiDataObjUnlink')), 1)
+
+        # Lock checks made after the operation, e.g. by policies, see the current lock state.
+        self.locks = [self.coll]
+        ctx = fake_irods.FakeCtx(query=self.query)
+        self.assertTrue(folder.is_locked(ctx, self.coll))
+        self.assertEqual(len(ctx.queries), 1)
+
+        ctx = fake_irods.FakeCtx(query=self.query)
+        self.assertEqual(self.delete(ctx)['status'], 'error_not_allowed')
+        self.assertEqual(ctx.calls_to('msiDataObjUnlink'), [])
+
+    def test_state_is_dropped_on_failure(self):
+        def fail(*args):
+            raise RuntimeError('SYS_INTERNAL_ERR')
+
+        ctx = fake_irods.FakeCtx(query=self.query, calls={'msiDataObjUnlink': fail})
+        self.assertEqual(self.delete(ctx)['status'], 'error_internal')
+        self.assertIsNone(folder.running_operation(ctx))
+
+        self.locks = [self.coll]
+        ctx = fake_irods.FakeCtx(query=self.query)
+        self.assertTrue(folder.is_locked(ctx, self.coll))
+        self.assertTrue(folder.is_data_locked(ctx, self.coll + '/file.txt'))
+        self.assertEqual(len(ctx.queries), 2)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the storage ledger."""
+
+__copyright__ = 'Copyright (c) 2020, Utrecht University'
+__license__   = 'GPLv3, see LICENSE'
+
+from unittest import TestCase
+
+import fake_irods
+
+import storage_ledger
+
+
+class StorageLedgerTest(TestCase):
+
+    def ctx(self, marker=None):
+        def query(columns, conditions):
+            if marker is not None and "META_COLL_ATTR_VALUE = '" + marker + "'" in conditions:
+                return [[marker]]
+            return []
+        return fake_irods.FakeCtx(query=query)
+
+    def test_mark_first_modification_in_window(self):
+        ctx = self.ctx()
+        storage_ledger.mark_storage_modified(ctx, '/tempZone/home/research-a/file.txt')
+
+        self.assertEqual(len(ctx.queries), 1)
+        writes = ctx.calls_to('msiSetKeyValuePairsToObj')
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(writes[0][1:], ('/tempZone/home/research-a', '-C'))
+        self.assertEqual(ctx.calls_to('msiString2KeyValPair')[0][0],
+                         '{}={}'.format(fake_irods.util.constants.UUSTORAGEMODIFIEDATTRNAME,
+                                        storage_ledger.current_window()))
+
+    def test_skip_marked_window(self):
+        ctx = self.ctx(str(storage_ledger.current_window()))
+        storage_ledger.mark_storage_modified(ctx, '/tempZone/home/vault-a/package/file.txt')
+
+        self.assertEqual(len(ctx.queries), 1)
+        self.assertIn("COLL_NAME = '/tempZone/home/research-a'", ctx.queries[0][1])
+        self.assertEqual(ctx.calls, [])
+
+    def test_mark_after_previous_window(self):
+        ctx = self.ctx(str(storage_ledger.current_window() - storage_ledger.STORAGE_LEDGER_WINDOW))
+        storage_ledger.mark_storage_modified(ctx, '/tempZone/yoda/revisions/research-a/file.txt')
+
+        self.assertEqual(len(ctx.calls_to('msiSetKeyValuePairsToObj')), 1)
+
+    def test_ignore_other_spaces(self):
+        ctx = self.ctx()
+        storage_ledger.mark_storage_modified(ctx, '/tempZone/home/datamanager-a/file.txt')
+
+        self.assertEqual(ctx.queries, [])
+        self.assertEqual(ctx.calls, [])
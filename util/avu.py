@@ -5,6 +5,7 @@ __copyright__ = 'Copyright (c) 2019-2020, Utrecht University'
 __license__   = 'GPLv3, see LICENSE'
 
 import itertools
+import json
 from collections import namedtuple
 
 import irods_types
@@ -82,6 +83,33 @@ def associate_to_resource(ctx, resource, a, v):
     msi.associate_key_value_pairs_to_obj(ctx, x['arguments'][1], resource, '-R')
 
 
+def add_to_data(ctx, path, a, v, u=''):
+    """Add AVU to a data object."""
+    msi.add_avu(ctx, '-d', path, a, v, u)
+
+
+def add_to_coll(ctx, coll, a, v, u=''):
+    """Add AVU to a collection."""
+    msi.add_avu(ctx, '-C', coll, a, v, u)
+
+
+def add_all_to_coll(ctx, coll, avus):
+    """Add a list of AVUs to a collection in a single atomic operation.
+
+    Requires iRODS >= 4.2.8 (msi_atomic_apply_metadata_operations).
+
+    :param ctx:  Combined type of a callback and rei struct
+    :param coll: Collection to add AVUs to
+    :param avus: List of (a,v,u) triplets
+    """
+    operations = [{'operation': 'add', 'attribute': a, 'value': v, 'units': u} for a, v, u in avus]
+    msi.atomic_apply_metadata_operations(ctx,
+                                         json.dumps({'entity_name': coll,
+                                                     'entity_type': 'collection',
+                                                     'operations':  operations}),
+                                         '')
+
+
 def rm_from_coll(ctx, coll, a, v):
     """Remove key/value metadata from a collection."""
     x = msi.string_2_key_val_pair(ctx, '{}={}'.format(a, v), irods_types.BytesBuf())
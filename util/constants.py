@@ -37,18 +37,60 @@ UURESOURCETIERATTRNAME = UUORGMETADATAPREFIX + 'storage_tier'
 UUMETADATASTORAGEMONTH = UUORGMETADATAPREFIX + 'storage_data_month'
 """Metadata for calculated storage month."""
 
+UUSTORAGEMODIFIEDATTRNAME = UUORGMETADATAPREFIX + 'storage_modified'
+"""Storage ledger: metadata on a group's home collection marking its storage as changed."""
+
 UUPROVENANCELOG = UUORGMETADATAPREFIX + 'action_log'
 """Provenance log item."""
 
+UUINTEGRITYLEDGERATTRNAME = UUORGMETADATAPREFIX + 'integrity_verified'
+"""Metadata attribute for last verification time and result of a replica."""
+
+UUINTEGRITYPROGRESSATTRNAME = UUORGMETADATAPREFIX + 'integrity_next_data_id'
+"""Metadata attribute for the next DATA_ID to check of a running integrity check."""
+
+UUINTEGRITYSWEEPATTRNAME = UUORGMETADATAPREFIX + 'integrity_sweep'
+"""Metadata attribute for the report collection of the latest integrity sweep."""
+
+UUINTEGRITYCOUNTATTRNAME = UUORGMETADATAPREFIX + 'integrity_count_'
+"""Metadata attribute prefix for the number of replicas per status in an integrity sweep."""
+
+UUINTEGRITYFAILUREATTRNAME = UUORGMETADATAPREFIX + 'integrity_failure'
+"""Metadata attribute for a failed replica check (JSON) in an integrity sweep."""
+
+UUGROUPDIRECTORY = UUSYSTEMCOLLECTION + '/group-directory.json'
+"""iRODS path of the materialized group directory (see group.getGroupData)."""
+
+UUGROUPDIRECTORYLOCK = UUSYSTEMCOLLECTION + '/group-directory.lock'
+"""iRODS path of the data object that exists while the group directory is being written."""
+
+UUGROUPDIRECTORYPENDINGATTRNAME = UUORGMETADATAPREFIX + 'group_directory_pending'
+"""Metadata on the system collection for groups of which the group directory entry is outdated."""
+
+UUMAILQUEUECOLLECTION = UUSYSTEMCOLLECTION + '/mail'
+"""iRODS path where outgoing e-mails are queued."""
+
+UUMAILQUEUESCHEDULEDNAME = 'scheduled'
+"""Name of the data object in the mail queue that exists while a queue worker is scheduled."""
+
 IILICENSECOLLECTION = UUSYSTEMCOLLECTION + '/licenses'
 """iRODS path where all licenses will be stored."""
 
 IIPUBLICATIONCOLLECTION = UUSYSTEMCOLLECTION + '/publication'
 """iRODS path where publications will be stored. """
 
+UUPUBLICATIONREFRESHRUNATTRNAME = UUORGMETADATAPREFIX + 'refresh_publications_run'
+"""Metadata on the system collection with the current bulk publication refresh run."""
+
+UUPUBLICATIONREFRESHEDATTRNAME = UUORGMETADATAPREFIX + 'refreshed_publication'
+"""Metadata on a vault package with the last bulk publication refresh run that completed it."""
+
 IITERMSCOLLECTION = UUSYSTEMCOLLECTION + "/terms"
 """iRODS path where the publication terms will be stored."""
 
+UUINTEGRITYCOLLECTION = UUSYSTEMCOLLECTION + '/integrity'
+"""iRODS path where data integrity check results will be stored."""
+
 IIJSONMETADATA = 'yoda-metadata.json'
 """Name of metadata JSON file."""
 
@@ -59,27 +59,55 @@ def write(ctx, path, data):
     msi.data_obj_close(ctx, handle, 0)
 
 
-def read(ctx, path, max_size=constants.IIDATA_MAX_SLURP_SIZE):
-    """Read an entire iRODS data object into a string."""
-    sz = size(ctx, path)
+def append(ctx, path, data):
+    """Append a string to an iRODS data object, creating it if it does not exist.
+
+    :param ctx:  Combined type of a callback and rei struct
+    :param path: Path to iRODS data object
+    :param data: Data to append to data object
+    """
+    if not exists(ctx, path):
+        write(ctx, path, data)
+        return
+
+    ret = msi.data_obj_open(ctx, 'objPath={}++++openFlags=O_WRONLY'.format(path), 0)
+    handle = ret['arguments'][1]
+
+    msi.data_obj_lseek(ctx, handle, 0, 'SEEK_END', 0)
+    msi.data_obj_write(ctx, handle, data, 0)
+    msi.data_obj_close(ctx, handle, 0)
+
+
+def read(ctx, path, max_size=constants.IIDATA_MAX_SLURP_SIZE, sz=None, offset=0):
+    """Read an entire iRODS data object into a string.
+
+    The size of the data object is queried, unless it is already known to the
+    caller (e.g. from a query listing multiple data objects).
+    When an offset is given, only the data from that offset onwards is read.
+    """
+    if sz is None:
+        sz = size(ctx, path)
     if sz is None:
         raise error.UUFileNotExistError('data_object.read: object does not exist ({})'
                                         .format(path))
 
-    if sz > max_size:
+    if sz - offset > max_size:
         raise error.UUFileSizeError('data_object.read: file size limit exceeded ({} > {})'
-                                    .format(sz, max_size))
+                                    .format(sz - offset, max_size))
 
-    if sz == 0:
+    if sz - offset <= 0:
         # Don't bother reading an empty file.
         return ''
 
     ret = msi.data_obj_open(ctx, 'objPath=' + path, 0)
     handle = ret['arguments'][1]
 
+    if offset > 0:
+        msi.data_obj_lseek(ctx, handle, offset, 'SEEK_SET', 0)
+
     ret = msi.data_obj_read(ctx,
                             handle,
-                            sz,
+                            sz - offset,
                             irods_types.BytesBuf())
 
     buf = ret['arguments'][2]
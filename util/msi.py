@@ -96,6 +96,7 @@ data_obj_open,   DataObjOpenError   = make('DataObjOpen',   'Could not open data
 data_obj_read,   DataObjReadError   = make('DataObjRead',   'Could not read data object')
 data_obj_write,  DataObjWriteError  = make('DataObjWrite',  'Could not write data object')
 data_obj_close,  DataObjCloseError  = make('DataObjClose',  'Could not close data object')
+data_obj_lseek,  DataObjLseekError  = make('DataObjLseek',  'Could not seek in data object')
 data_obj_copy,   DataObjCopyError   = make('DataObjCopy',   'Could not copy data object')
 data_obj_unlink, DataObjUnlinkError = make('DataObjUnlink', 'Could not remove data object')
 data_obj_rename, DataObjRenameError = make('DataObjRename', 'Could not rename data object')
@@ -125,6 +126,9 @@ remove_key_value_pairs_from_obj, RemoveKeyValuePairsFromObjError = \
 add_avu, AddAvuError = make('_add_avu', 'Could not add metadata to object')
 rmw_avu, RmwAvuError = make('_rmw_avu', 'Could not remove metadata to object')
 
+atomic_apply_metadata_operations, AtomicApplyMetadataOperationsError = \
+    make('_atomic_apply_metadata_operations', 'Could not apply metadata operations to object')
+
 sudo_obj_acl_set, SudoObjAclSetError = make('SudoObjAclSet', 'Could not set ACLs as admin')
 
 # Add new msis here as needed.
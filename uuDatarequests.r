@@ -210,6 +210,12 @@ uuDatarequestProcessMetadataChange(*datarequestColl, *attributeName,
                 }
         }
 
+        # Keep the browse summary of the data request up to date
+        if (*attributeName == "status" && *status == "Success") {
+                *summaryStatus = "";
+                rule_datarequest_summary_update(*datarequestColl, *summaryStatus);
+        }
+
         # Revoke temporary write ACL
         msiSetACL("default", "admin:null", uuClientFullName, *filePath);
 }
@@ -829,6 +829,14 @@ uuExternalUser(*userName) {
 	}
 }
 
+# \brief Update the entry of a group in the group directory as rodsadmin.
+#
+# \param[in] groupName
+#
+uuGroupDirectoryUpdate(*groupName) {
+	msiExecCmd("admin-groupdirectory.sh", uuClientFullName ++ " " ++ *groupName, "", "", 0, *out);
+}
+
 # \brief Add a user to a group.
 #
 # \param[in]  groupName
@@ -16,6 +16,7 @@ acDataDeletePolicy             { cut; py_acDataDeletePolicy }
 acPreProcForObjRename(*x, *y)  { cut; py_acPreProcForObjRename(*x, *y) }
 acPreProcForExecCmd(*cmd, *args, *addr, *hint) { cut; py_acPreProcForExecCmd(*cmd, *args, *addr, *hint) }
 acPostProcForObjRename(*src, *dst) { py_acPostProcForObjRename(*src, *dst) }
+acPostProcForDelete               { py_acPostProcForDelete }
 
 # Matches any imeta (or equivalent) command *except* mod and cp.
 acPreProcForModifyAVUMetadata(*Option,*ItemType,*ItemName,*AName,*AValue,*AUnit)